@@ -0,0 +1,937 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import evaluator
+import game
+import model
+import ponder
+import server
+import threats
+import tournament
+
+# Moves (x, y, z, player) that set up the benchmark positions.
+POSITIONS = {
+    'empty': [],
+    'opening': [(1,1,1,'max'), (2,2,2,'min'), (0,0,0,'max'), (3,3,3,'min')],
+    'midgame': [(1,1,1,'max'), (2,2,2,'min'), (0,0,0,'max'), (3,3,3,'min'),
+                (1,2,1,'max'), (1,0,1,'min'), (2,1,2,'max'), (0,3,3,'min'),
+                (3,0,0,'max'), (2,1,1,'min')],
+    'endgame': [(1,1,2,'min'), (0,3,2,'max'), (2,3,0,'min'), (0,1,1,'max'), (3,1,0,'min'), (2,0,3,'max'),
+                (2,3,1,'min'), (0,2,0,'max'), (0,1,2,'min'), (0,0,1,'max'), (1,0,3,'min'), (1,1,1,'max'),
+                (1,0,0,'min'), (3,3,0,'max'), (1,1,0,'min'), (1,2,2,'max'), (2,0,0,'min'), (2,0,1,'max'),
+                (2,2,3,'min'), (1,1,3,'max'), (3,3,3,'min'), (1,3,3,'max'), (0,0,2,'min'), (0,0,3,'max'),
+                (0,3,1,'min'), (1,2,1,'max'), (3,0,1,'min'), (1,3,0,'max'), (3,2,2,'min'), (0,1,0,'max'),
+                (1,2,3,'min'), (2,1,3,'max'), (2,2,1,'min'), (2,3,2,'max'), (0,2,1,'min'), (3,2,1,'max'),
+                (2,0,2,'min'), (2,1,0,'max'), (3,1,3,'min'), (2,2,0,'max'), (3,2,0,'min'), (2,3,3,'max'),
+                (1,3,2,'min'), (0,3,3,'max'), (0,2,2,'min'), (3,3,2,'max'), (2,2,2,'min')],
+}
+
+# Positions of the benchmark suite, from the first move to the last few.
+# Every one has max to move.
+SUITE_POSITIONS = ('empty', 'opening', 'midgame', 'endgame')
+
+# Search depths of the benchmark suite, and how many times each is timed.
+SUITE_DEPTHS = (2, 4, 6)
+SUITE_REPEATS = {2: 20, 4: 5, 6: 1}
+
+# Samples taken per State operation in the benchmark suite, and calls
+# per sample of the operations too short to time one by one.
+SUITE_SAMPLES = 1000
+SUITE_BATCH = 20
+
+# Slowdown of a median latency, against the baseline, reported as a
+# regression.
+REGRESSION_THRESHOLD = 0.10
+
+# makePosition(moves)
+#    Input: moves (list of (x, y, z, player) tuples)
+#
+#    Output: State (the state after playing every move)
+#
+#    Builds a benchmark position from a list of moves.
+def makePosition(moves):
+    state = game.State()
+    for x, y, z, player in moves:
+        state.play(x, y, z, player)
+    #end for
+
+    return state
+#end makePosition
+
+# timeCall(function, repeat)
+#    Input: function (a function taking no arguments)
+#    repeat (the number of times to call it)
+#
+#    Output: Float (calls per second)
+#
+#    Times repeated calls of function.
+def timeCall(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    #end for
+
+    return repeat / (time.perf_counter() - start)
+#end timeCall
+
+# benchOps(state)
+#    Input: state (the position to time the operations on)
+#
+#    Output: Dictionary (operation name to calls per second)
+#
+#    Times the State primitives used by the search on one position.
+def benchOps(state):
+    def playCopy():
+        state.copy().play(3, 0, 3, 'max')
+    #end playCopy
+
+    def pushPop():
+        state.push(game.cellIndex(3, 0, 3), 1)
+        state.pop()
+    #end pushPop
+
+    return {
+        'copy+play': timeCall(playCopy, 20000),
+        'push+pop': timeCall(pushPop, 20000),
+        'isValid': timeCall(lambda: state.isValid(3, 0, 3), 20000),
+        'isWin': timeCall(state.isWin, 2000),
+        'h': timeCall(state.h, 200),
+        'actions': timeCall(lambda: list(game.actions(state)), 2000),
+    }
+#end benchOps
+
+# benchSearch(state, depth, tableSize, useSymmetry, ordering)
+#    Input: state (the position to search)
+#    depth (the maximum depth of the search)
+#    tableSize (slots in the transposition table, 0 for none)
+#    useSymmetry (whether the search skips symmetric moves)
+#    ordering (the move ordering of the search, see model.ORDERINGS)
+#
+#    Output: Tuple (nodes searched, seconds taken, nodes per second,
+#    transposition table counters or None)
+#
+#    Runs one alpha-beta search and measures how fast it visits nodes.
+def benchSearch(state, depth, tableSize=model.DEFAULT_TABLE_SIZE, useSymmetry=True, ordering='full'):
+    ai = model.Model(depth, tableSize, useSymmetry, ordering=ordering)
+    start = time.perf_counter()
+    ai.alphaBetaSearch(state)
+    elapsed = time.perf_counter() - start
+
+    counters = ai.table.counters() if ai.table is not None else None
+    return (ai.nodes, elapsed, ai.nodes / elapsed, counters)
+#end benchSearch
+
+# benchSymmetry()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Compares the nodes searched with and without skipping symmetric moves
+#    at each difficulty depth, on the positions that still have symmetries.
+def benchSymmetry():
+    for name in ('empty', 'opening'):
+        state = makePosition(POSITIONS[name])
+        print('%s: %d symmetries' % (name, len(state.symmetries())))
+
+        for depth in (2, 4, 6):
+            plain = benchSearch(state, depth, useSymmetry=False)
+            reduced = benchSearch(state, depth, useSymmetry=True)
+            print('    depth %d: %d -> %d nodes (%.1fx), %.2fs -> %.2fs'
+                  % (depth, plain[0], reduced[0], plain[0] / reduced[0], plain[1], reduced[1]))
+        #end for
+    #end for
+#end benchSymmetry
+
+# benchOrdering()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Reports the nodes searched by every move ordering in model.ORDERINGS.
+def benchOrdering():
+    for name, moves in POSITIONS.items():
+        state = makePosition(moves)
+        print(name + ':')
+
+        for depth in (3, 4, 5):
+            results = []
+            for ordering in model.ORDERINGS:
+                nodes, elapsed = benchSearch(state, depth, ordering=ordering)[:2]
+                results.append('%s %d (%.2fs)' % (ordering, nodes, elapsed))
+            #end for
+            print('    depth %d: %s' % (depth, ', '.join(results)))
+        #end for
+    #end for
+#end benchOrdering
+
+# benchMoves()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Compares the moves of a node streamed by Model._stagedMoves with the
+#    whole ordered list, for the first move only, as at a cutoff, and for
+#    all of them, and the best of three depth 4 searches with either.
+#    Model lists the moves unless stagedMoves is set.
+def benchMoves():
+    searcher = model.Model(4)
+    for name, moves in POSITIONS.items():
+        state = makePosition(moves)
+        listed = lambda: searcher._orderMoves(state, list(game.actions(state)), None, 0, 1)
+        staged = lambda: searcher._stagedMoves(state, None, 0, 1)
+
+        searchTimes = []
+        for stagedMoves in (False, True):
+            best = float('inf')
+            for _ in range(3):
+                start = time.perf_counter()
+                model.Model(4, stagedMoves=stagedMoves).alphaBetaSearch(state)
+                best = min(best, time.perf_counter() - start)
+            #end for
+            searchTimes.append(best)
+        #end for
+
+        print('%s: first move %.0f/s listed, %.0f/s staged; all moves %.0f/s listed, %.0f/s staged; '
+              'search %.3fs listed, %.3fs staged'
+              % (name, timeCall(lambda: listed()[0], 2000), timeCall(lambda: next(staged()), 2000),
+                 timeCall(listed, 2000), timeCall(lambda: list(staged()), 2000), searchTimes[0], searchTimes[1]))
+    #end for
+#end benchMoves
+
+# benchParallel()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Prints the speedup of the parallel root search over the serial one
+#    for 1 to cpu_count() workers (at least 2, 1 being the serial search),
+#    checking that every worker count picks the move of the serial search.
+def benchParallel():
+    for name in ('opening', 'midgame'):
+        state = makePosition(POSITIONS[name])
+        print(name + ':')
+
+        for depth in (4, 5):
+            serial = model.Model(depth)
+            start = time.perf_counter()
+            serialMove = serial.alphaBetaSearch(state)
+            serialTime = time.perf_counter() - start
+
+            results = []
+            for workers in range(1, max(os.cpu_count() or 1, 2) + 1):
+                ai = model.Model(depth, workers=workers)
+                start = time.perf_counter()
+                move = ai.alphaBetaSearch(state)
+                elapsed = time.perf_counter() - start
+                ai.close()
+
+                assert(move == serialMove)
+                results.append('%d: %.2fx' % (workers, serialTime / elapsed))
+            #end for
+            print('    depth %d (serial %.2fs): %s' % (depth, serialTime, ', '.join(results)))
+        #end for
+    #end for
+#end benchParallel
+
+# benchServer()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Plays many games at once on a GameServer, with random player moves,
+#    and reports its throughput in games and moves per second.
+def benchServer():
+    generator = random.Random(8150)
+
+    for games, depth in ((100, 2), (20, 3)):
+        host = server.GameServer(depth)
+        sessions = [host.newGame() for _ in range(games)]
+        start = time.perf_counter()
+
+        playing = set(sessions)
+        while playing:
+            moves = []
+            for session in playing:
+                if not host.isWaiting(session):
+                    x, y, z = game.cellCoords(generator.choice(list(game.actions(host.getState(session)))))
+                    moves.append((session, x, y, z))
+                #end if
+            #end for
+            host.submitMoves(moves)
+
+            # Wait for one reply to avoid spinning, then take all that are ready.
+            for session in playing:
+                if host.isWaiting(session):
+                    host.awaitReply(session)
+                    break
+                #end if
+            #end for
+            host.pollAll()
+
+            finished = set(session for session in playing if host.isWin(session)[0])
+            for session in finished:
+                host.endGame(session)
+            #end for
+            playing -= finished
+        #end while
+
+        elapsed = time.perf_counter() - start
+        host.close()
+
+        moves = host.playerMoves + host.aiMoves
+        print('%d games at depth %d: %.2f games/s, %.1f moves/s, %.0f nodes/s'
+              % (games, depth, games / elapsed, moves / elapsed, host.nodes / elapsed))
+    #end for
+#end benchServer
+
+# benchBatch()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Compares scoring positions one at a time with State.h against
+#    game.evaluateBatch, and the search with and without batched leaves.
+def benchBatch():
+    state = makePosition(POSITIONS['midgame'])
+    children = []
+    for action in game.actions(state):
+        children.append(game.result(state, action, 'max'))
+    #end for
+
+    def scoreEach():
+        for child in children:
+            child.h()
+        #end for
+    #end scoreEach
+
+    def scoreBatch():
+        game.evaluateBatch(game.boardsToArray([child.maxBoard for child in children],
+                                              [child.minBoard for child in children]))
+    #end scoreBatch
+
+    def pushScorePop():
+        for action in game.actions(state):
+            state.push(action, 1)
+            state.h()
+            state.pop()
+        #end for
+    #end pushScorePop
+
+    for name, function in (('h', scoreEach), ('push+h+pop', pushScorePop), ('evaluateBatch', scoreBatch)):
+        print('%s: %.0f positions/s' % (name, timeCall(function, 200) * len(children)))
+    #end for
+
+    for name in ('opening', 'midgame'):
+        state = makePosition(POSITIONS[name])
+        for depth in (3, 4, 5):
+            results = []
+            for batchLeaves in (False, True):
+                ai = model.Model(depth, batchLeaves=batchLeaves)
+                start = time.perf_counter()
+                ai.alphaBetaSearch(state)
+                results.append('%d nodes in %.2fs' % (ai.nodes, time.perf_counter() - start))
+            #end for
+            print('%s depth %d: one by one %s, batched %s' % (name, depth, results[0], results[1]))
+        #end for
+    #end for
+#end benchBatch
+
+# benchSearches()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Compares the nodes searched by every algorithm in model.SEARCHES on
+#    the benchmark positions, and whether they agree on the move and value
+#    of the first one.
+def benchSearches():
+    for name, moves in POSITIONS.items():
+        state = makePosition(moves)
+        print(name + ':')
+        
+        for depth in (3, 4, 5):
+            results = []
+            answers = set()
+            for search in model.SEARCHES:
+                ai = model.Model(depth, search=search)
+                start = time.perf_counter()
+                move = ai.alphaBetaSearch(state)
+                elapsed = time.perf_counter() - start
+                
+                answers.add((move, ai.value))
+                results.append('%s %d (%.2fs, %d re-searches)' % (search, ai.nodes, elapsed, ai.researches))
+            #end for
+            agree = 'agree' if len(answers) == 1 else 'DISAGREE'
+            print('    depth %d: %s, %s' % (depth, ', '.join(results), agree))
+        #end for
+    #end for
+#end benchSearches
+
+# benchThreats()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Plays random games to positions where max has a forced threat win,
+#    and reports how often the plain search sees the win, against the cost
+#    of the threat search finding it. Also times the frontier threat
+#    search on the benchmark positions.
+def benchThreats():
+    generator = random.Random(8150)
+    positions = []
+    while len(positions) < 50:
+        state = game.State()
+        for ply in range(generator.randint(8, 20)):
+            state.push(generator.choice(list(game.actions(state))), -1 if ply % 2 == 0 else 1)
+            if state.isWin()[0]:
+                break
+            #end if
+        #end for
+        
+        if not state.isWin()[0] and state.moveCount % 2 == 0 and threats.ThreatSearch().forcedWin(state, 1) is not None:
+            positions.append(state)
+        #end if
+    #end while
+    
+    search = threats.ThreatSearch()
+    start = time.perf_counter()
+    lengths = [len(search.forcedWin(state, 1)) for state in positions]
+    elapsed = time.perf_counter() - start
+    print('threat search: %d wins of up to %d threats, %d nodes in %.3fs'
+          % (len(positions), max(lengths), search.nodes, elapsed))
+    
+    for depth in (2, 4):
+        seen = 0
+        nodes = 0
+        start = time.perf_counter()
+        for state in positions:
+            ai = model.Model(depth)
+            ai.alphaBetaSearch(state)
+            seen += ai.value >= game.WIN_SCORE
+            nodes += ai.nodes
+        #end for
+        print('    depth %d search: %d wins seen, %d nodes in %.2fs' % (depth, seen, nodes, time.perf_counter() - start))
+    #end for
+    
+    for name in ('opening', 'midgame'):
+        state = makePosition(POSITIONS[name])
+        for depth in (3, 4):
+            results = []
+            for threatLeaves in (False, True):
+                ai = model.Model(depth, threatDepth=threats.DEFAULT_THREATS, threatLeaves=threatLeaves)
+                start = time.perf_counter()
+                ai.alphaBetaSearch(state)
+                results.append('value %d, %d nodes in %.2fs' % (ai.value, ai.nodes, time.perf_counter() - start))
+            #end for
+            print('%s depth %d: root only %s, frontier %s' % (name, depth, results[0], results[1]))
+        #end for
+    #end for
+#end benchThreats
+
+# latencies(function, repeat, batch, reset)
+#    Input: function (a function taking no arguments)
+#    repeat (the number of samples to take)
+#    batch (calls timed together in each sample, so that calls much
+#    shorter than the clock's own overhead can be measured)
+#    reset (a function undoing a call, run untimed after each, or None;
+#    only with a batch of 1)
+#
+#    Output: List (seconds taken per call in each sample)
+#
+#    Times calls of function.
+def latencies(function, repeat, batch=1, reset=None):
+    samples = []
+    calls = range(batch)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in calls:
+            function()
+        #end for
+        samples.append((time.perf_counter() - start) / batch)
+        if reset is not None:
+            reset()
+        #end if
+    #end for
+    
+    return samples
+#end latencies
+
+# summarize(samples)
+#    Input: samples (list of seconds taken by each call)
+#
+#    Output: Dictionary (mean and percentiles of the latency, in seconds,
+#    and calls per second)
+def summarize(samples):
+    p50, p90, p99 = np.percentile(samples, (50, 90, 99))
+    mean = sum(samples) / len(samples)
+    
+    return {'mean': mean, 'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'rate': 1.0 / mean}
+#end summarize
+
+# suiteOps(state)
+#    Input: state (the position to time the operations on)
+#
+#    Output: Dictionary (operation name to its summarized latencies)
+#
+#    Times the State operations and the move generation of the game.
+def suiteOps(state):
+    empty = ~(state.maxBoard | state.minBoard) & ((1 << 64) - 1)
+    empty = game.cellCoords((empty & -empty).bit_length() - 1)
+    
+    return {
+        'play': summarize(latencies(lambda: state.play(empty[0], empty[1], empty[2], 'max'), SUITE_SAMPLES, 1, state.pop)),
+        'copy': summarize(latencies(state.copy, SUITE_SAMPLES, SUITE_BATCH)),
+        'isWin': summarize(latencies(state.isWin, SUITE_SAMPLES, SUITE_BATCH)),
+        'h': summarize(latencies(state.h, SUITE_SAMPLES, SUITE_BATCH)),
+        'actions': summarize(latencies(lambda: list(game.actions(state)), SUITE_SAMPLES)),
+    }
+#end suiteOps
+
+# suiteSearch(state, depth)
+#    Input: state (the position to search)
+#    depth (the maximum depth of the search)
+#
+#    Output: Dictionary (nodes, nodes per second, summarized latencies
+#    and peak traced memory in bytes of alphaBetaSearch)
+#
+#    Times searches of a fresh Model, so that every one does the same
+#    work, then runs one more under tracemalloc for its peak memory. The
+#    traced run is not timed, tracing slows it down.
+def suiteSearch(state, depth):
+    nodes = 0
+    samples = []
+    for _ in range(SUITE_REPEATS.get(depth, 1)):
+        ai = model.Model(depth)
+        start = time.perf_counter()
+        ai.alphaBetaSearch(state)
+        samples.append(time.perf_counter() - start)
+        nodes = ai.nodes
+    #end for
+    
+    tracemalloc.start()
+    ai = model.Model(depth)
+    ai.alphaBetaSearch(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    
+    result = summarize(samples)
+    result['nodes'] = nodes
+    result['nodeRate'] = nodes / result['mean']
+    result['peakMemory'] = peak
+    return result
+#end suiteSearch
+
+# environment()
+#    Input: None
+#
+#    Output: Dictionary (what the results were measured on)
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    #end try/except
+    
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+#end environment
+
+# compareResults(baseline, results, threshold)
+#    Input: baseline (results of an earlier benchSuite)
+#    results (results of this benchSuite)
+#    threshold (slowdown of a median latency reported as a regression)
+#
+#    Output: List (descriptions of the regressions found)
+#    (side effect of printing every change)
+#
+#    Compares the median latencies and node counts of two suite runs.
+#    Node counts do not depend on the machine, so any change means the
+#    search itself changed.
+def compareResults(baseline, results, threshold=REGRESSION_THRESHOLD):
+    regressions = []
+    print('against %s (%s):' % (baseline['environment']['commit'], baseline['environment']['time']))
+    
+    for kind in ('ops', 'search'):
+        for position, cases in results[kind].items():
+            for case, current in cases.items():
+                old = baseline[kind].get(position, {}).get(case)
+                if old is None:
+                    continue
+                #end if
+                
+                name = '%s %s %s' % (kind, position, case)
+                change = current['p50'] / old['p50'] - 1
+                note = ''
+                if change > threshold:
+                    note = ' REGRESSION'
+                    regressions.append(name)
+                #end if
+                if 'nodes' in current and current['nodes'] != old['nodes']:
+                    note += ' (nodes %d -> %d)' % (old['nodes'], current['nodes'])
+                #end if
+                print('    %s: p50 %.3gs -> %.3gs (%+.1f%%)%s' % (name, old['p50'], current['p50'], 100 * change, note))
+            #end for
+        #end for
+    #end for
+    
+    return regressions
+#end compareResults
+
+# benchSuite(depths, save, compare, threshold)
+#    Input: depths (search depths to time)
+#    save (file to save the results to as a baseline, or None)
+#    compare (baseline file to compare the results with, or None)
+#    threshold (slowdown of a median latency reported as a regression)
+#
+#    Output: Dictionary (the results)
+#    (side effect of printing them, and of writing save)
+#
+#    Runs the reproducible benchmark suite: the State operations and the
+#    search at each depth, on every position of SUITE_POSITIONS.
+def benchSuite(depths=SUITE_DEPTHS, save=None, compare=None, threshold=REGRESSION_THRESHOLD):
+    results = {'environment': environment(), 'ops': {}, 'search': {}}
+    
+    for name in SUITE_POSITIONS:
+        state = makePosition(POSITIONS[name])
+        
+        ops = suiteOps(state)
+        results['ops'][name] = ops
+        print(name + ': ' + ', '.join('%s p50 %.2fus p99 %.2fus' % (op, 1e6 * times['p50'], 1e6 * times['p99'])
+                                      for op, times in ops.items()))
+        
+        results['search'][name] = {}
+        for depth in depths:
+            search = suiteSearch(state, depth)
+            results['search'][name]['depth %d' % depth] = search
+            print('    depth %d: %d nodes, %.0f nodes/s, p50 %.3fs p90 %.3fs p99 %.3fs, peak %.1f MB'
+                  % (depth, search['nodes'], search['nodeRate'], search['p50'], search['p90'], search['p99'],
+                     search['peakMemory'] / 2 ** 20))
+        #end for
+    #end for
+    
+    if compare is not None:
+        with open(compare) as baselineFile:
+            baseline = json.load(baselineFile)
+        #end with
+        regressions = compareResults(baseline, results, threshold)
+        print('%d regressions' % len(regressions))
+    #end if
+    
+    if save is not None:
+        with open(save, 'w') as baselineFile:
+            json.dump(results, baselineFile, indent=1)
+        #end with
+    #end if
+    
+    return results
+#end benchSuite
+
+# Seconds the simulated player of benchPonder thinks per move, and the
+# number of AI moves it times.
+PONDER_THINK = 1.0
+PONDER_MOVES = 12
+
+# benchPonder()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Plays a game between a depth 2 player and a depth 4 AI that ponders
+#    while the player thinks for PONDER_THINK seconds, and times every AI
+#    reply against a cold AI with the same settings answering the same
+#    positions. Both keep their transposition tables between moves, as in
+#    a Game.
+def benchPonder():
+    settings = {'maxLayers': 4, 'threatDepth': threats.DEFAULT_THREATS}
+    player = model.Model(2)
+    thinking = model.Model(**settings)
+    cold = model.Model(**settings)
+    ponderer = ponder.Ponderer(thinking)
+
+    state = game.State()
+    warm = []
+    coldTimes = []
+    while len(warm) < PONDER_MOVES and not state.isWin()[0]:
+        ponderer.start(state)
+        time.sleep(PONDER_THINK)
+        state.push(tournament.chooseMove(player, state, -1), -1)
+        if state.isWin()[0]:
+            break
+        #end if
+
+        start = time.perf_counter()
+        action = ponderer.search(state)
+        warm.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        cold.alphaBetaSearch(state)
+        coldTimes.append(time.perf_counter() - start)
+
+        state.push(action, 1)
+    #end while
+    ponderer.stop()
+
+    print('%d AI moves, %d pondered replies, %d hits, %d misses' % (len(warm), ponderer.pondered, ponderer.hits,
+                                                                     ponderer.misses))
+    for name, times in (('cold', coldTimes), ('pondering', warm)):
+        print('    %s: mean %.4fs, median %.4fs, max %.4fs' % (name, sum(times) / len(times),
+                                                               sorted(times)[len(times) // 2], max(times)))
+    #end for
+#end benchPonder
+
+# Boards of benchSizes, as (cells per side, dimensions).
+BOARD_SIZES = ((4, 3), (5, 3), (4, 4))
+
+# benchEvaluator()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Compares the speed of the hand-written heuristic and of a learned
+#    evaluator, the one of evaluator.EVALUATOR_PATH or the hand-written
+#    values as an evaluator if there is none: State.h, push+h+pop,
+#    evaluateBatch, and a search.
+def benchEvaluator():
+    if os.path.exists(evaluator.EVALUATOR_PATH):
+        learned = evaluator.load(evaluator.EVALUATOR_PATH)
+    else:
+        learned = evaluator.fromHeuristic()
+    #end if/else
+
+    for name, scorer in (('hand-written', None), ('learned', learned)):
+        state = makePosition(POSITIONS['midgame'])
+        state.setEvaluator(scorer)
+        actions = list(game.actions(state))
+        positions = game.boardsToArray([state.maxBoard] * 256, [state.minBoard] * 256)
+
+        def pushScorePop():
+            for action in actions:
+                state.push(action, 1)
+                state.h()
+                state.pop()
+            #end for
+        #end pushScorePop
+
+        rates = (timeCall(state.h, 200000), timeCall(pushScorePop, 200) * len(actions),
+                 timeCall(lambda: game.evaluateBatch(positions, evaluator=scorer), 200) * len(positions))
+        print('%s: h %.0f/s, push+h+pop %.0f/s, evaluateBatch %.0f positions/s' % ((name,) + rates))
+
+        for depth in (3, 4):
+            ai = model.Model(depth, evaluator=scorer)
+            start = time.perf_counter()
+            ai.alphaBetaSearch(state)
+            elapsed = time.perf_counter() - start
+            print('    depth %d: %d nodes in %.2fs, %.0f nodes/s' % (depth, ai.nodes, elapsed, ai.nodes / elapsed))
+        #end for
+    #end for
+#end benchEvaluator
+
+# benchSizes()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Times building the tables of every board in BOARD_SIZES and loading
+#    them from the table cache, the State primitives and the batch
+#    evaluation on it, and a shallow search after one move of each player,
+#    to show how they scale with the lines.
+def benchSizes():
+    generator = np.random.default_rng(8150)
+    for size, dims in BOARD_SIZES:
+        geometry = game.getGeometry(size, dims)
+        start = time.perf_counter()
+        geometry._buildTables()
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        game.Geometry(size, dims)
+        loaded = time.perf_counter() - start
+        print('%d^%d: %d cells, %d lines, %d symmetries, tables built in %.3fs, loaded in %.3fs'
+              % (size, dims, geometry.cells, len(geometry.lines), len(geometry.symmetries), built, loaded))
+
+        state = game.State(geometry)
+        state.play(*([size // 2] * dims), 'max')
+        state.play(*([0] * dims), 'min')
+        last = geometry.cells - 1
+
+        def pushPop():
+            state.push(last, 1)
+            state.pop()
+        #end pushPop
+
+        positions = generator.integers(-1, 2, size=(1000, geometry.cells))
+        start = time.perf_counter()
+        game.evaluateBatch(positions, geometry)
+        batchRate = len(positions) / (time.perf_counter() - start)
+
+        print('    push+pop %.0f/s, actions %.0f/s, symmetries %.0f/s, evaluateBatch %.0f positions/s'
+              % (timeCall(pushPop, 20000), timeCall(lambda: list(game.actions(state)), 2000),
+                 timeCall(state.symmetries, 20), batchRate))
+
+        for depth in (2, 3):
+            nodes, elapsed, rate, counters = benchSearch(state, depth)
+            print('    depth %d: %d nodes in %.2fs, %.0f nodes/s' % (depth, nodes, elapsed, rate))
+        #end for
+    #end for
+#end benchSizes
+
+# Plies left from which benchCanonical keys the table on canonical forms.
+CANONICAL_DEPTHS = (0, 1, 2, 3)
+
+# benchCanonical()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Searches the benchmark positions with the transposition table keyed on
+#    the hash of every state, and on the canonical form of the states with
+#    each of CANONICAL_DEPTHS plies or more left, to show the nodes that
+#    sharing entries between symmetric states saves and the time finding
+#    the canonical forms costs.
+def benchCanonical():
+    for name in ('empty', 'opening', 'midgame'):
+        for depth in (4, 5):
+            results = []
+            for canonicalDepth in CANONICAL_DEPTHS:
+                state = makePosition(POSITIONS[name])
+                ai = model.Model(depth, canonicalDepth=canonicalDepth)
+                start = time.perf_counter()
+                ai.alphaBetaSearch(state)
+                elapsed = time.perf_counter() - start
+                results.append('%d: %d nodes, %d hits, %.2fs' % (canonicalDepth, ai.nodes, ai.table.hits, elapsed))
+            #end for
+            print('%s, depth %d: %s' % (name, depth, '; '.join(results)))
+        #end for
+    #end for
+#end benchCanonical
+
+# Most seconds importing game may take in a new process, with the tables
+# cached, and the modules it must leave to be imported when they are used.
+# run.py fails when either is broken.
+STARTUP_BUDGET = 0.1
+STARTUP_DEFERRED = ('numpy', 'concurrent.futures')
+
+# importTimes(module)
+#    Input: module (the name of the module to import)
+#
+#    Output: Dictionary (every module loaded by the import, mapped to the
+#    seconds of its own code and the seconds including what it imported)
+#
+#    Imports the module in a new Python process under -X importtime, so
+#    that nothing is loaded already.
+def importTimes(module='game'):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], capture_output=True,
+                            text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[0].startswith('import time:') and fields[1].strip().isdigit():
+            times[fields[2].strip()] = (int(fields[0][len('import time:'):]) / 1e6, int(fields[1]) / 1e6)
+        #end if
+    #end for
+
+    return times
+#end importTimes
+
+# benchStartup()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Times the cold start of game and model, with the modules whose own
+#    code takes longest, and checks them against STARTUP_BUDGET.
+def benchStartup():
+    for module in ('game', 'model'):
+        times = importTimes(module)
+        total = times[module][1]
+        deferred = [name for name in STARTUP_DEFERRED if name in times]
+        print('import %s: %.1fms (budget %.0fms, %s), %d modules, deferred modules loaded: %s'
+              % (module, total * 1e3, STARTUP_BUDGET * 1e3, 'within' if total <= STARTUP_BUDGET else 'OVER',
+                 len(times), ', '.join(deferred) or 'none'))
+
+        slowest = sorted(times.items(), key=lambda item: -item[1][0])[:5]
+        print('    slowest: ' + ', '.join('%s %.1fms' % (name, own * 1e3) for name, (own, total) in slowest))
+    #end for
+#end benchStartup
+
+# benchPositions()
+#    Input: None
+#
+#    Output: None (side effect of printing the results)
+#
+#    Times the State primitives and the search, with and without a
+#    transposition table, on every benchmark position.
+def benchPositions():
+    for name, moves in POSITIONS.items():
+        state = makePosition(moves)
+
+        ops = benchOps(state)
+        print(name + ': ' + ', '.join('%s %.0f/s' % (op, rate) for op, rate in ops.items()))
+
+        for depth in (2, 3, 4):
+            for tableSize in (0, model.DEFAULT_TABLE_SIZE):
+                nodes, elapsed, rate, counters = benchSearch(state, depth, tableSize)
+                print('    depth %d, table %d: %d nodes in %.2fs, %.0f nodes/s' % (depth, tableSize, nodes, elapsed, rate))
+                if counters is not None:
+                    print('        ' + ', '.join('%s %d' % item for item in counters.items()))
+                #end if
+            #end for
+        #end for
+    #end for
+#end benchPositions
+
+# Benchmarks that can be picked on the command line, all by default.
+BENCHMARKS = {
+    'positions': benchPositions,
+    'symmetry': benchSymmetry,
+    'ordering': benchOrdering,
+    'moves': benchMoves,
+    'parallel': benchParallel,
+    'server': benchServer,
+    'batch': benchBatch,
+    'search': benchSearches,
+    'threats': benchThreats,
+    'suite': benchSuite,
+    'sizes': benchSizes,
+    'evaluator': benchEvaluator,
+    'startup': benchStartup,
+    'canonical': benchCanonical,
+    'ponder': benchPonder,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the game engine and the AI.')
+    parser.add_argument('names', nargs='*', choices=list(BENCHMARKS), help='benchmarks to run, all by default')
+    parser.add_argument('--depths', type=int, nargs='+', default=SUITE_DEPTHS, help='search depths of the suite')
+    parser.add_argument('--save', help='file to save the suite results to as a baseline')
+    parser.add_argument('--compare', help='baseline file to compare the suite results with')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='slowdown of a median latency reported as a regression')
+    args = parser.parse_args()
+    
+    for name in args.names or BENCHMARKS:
+        if name == 'suite':
+            benchSuite(args.depths, args.save, args.compare, args.threshold)
+        else:
+            BENCHMARKS[name]()
+        #end if/else
+    #end for
+#end main
+
+if __name__ == '__main__':
+    main()
+#end if
@@ -0,0 +1,198 @@
+import argparse
+import os
+import game
+import model
+
+# Default location of the opening book, next to the code.
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opening_book.npy')
+
+# A book file is one .npy array of 2N little-endian unsigned 64-bit
+# integers. The first N are the canonical hashes of the positions, sorted,
+# and the next N the entries in the same order, each packing
+#    bits 0-7: cell index of the best move, in the canonical frame
+#    bits 8-15: depth of the search that found it
+#    bits 16-31: its score, offset by SCORE_OFFSET
+SCORE_OFFSET = 1 << 15
+
+# This class is an opening book read through a memory map. Opening it only
+# reads the file header, and a lookup is a binary search over the mapped
+# hashes, so neither grows with the size of the book. The mapped pages are
+# shared by every process that opens the same file. NumPy is imported when
+# a book is opened, so the search does not load it without one.
+class OpeningBook:
+
+    path = None
+    keys = None
+    entries = None
+
+    # __init__(self, path)
+    #    Input: self (the object being instantiated)
+    #    path (the book file written by build)
+    #
+    #    Output: None (Side effect of instantiation)
+    #
+    #    Maps the book file read-only.
+    def __init__(self, path=BOOK_PATH):
+        import numpy as np
+        self.path = path
+        data = np.load(path, mmap_mode='r')
+        size = len(data) // 2
+        self.keys = data[:size]
+        self.entries = data[size:]
+    #end __init__
+
+    # Only the path is pickled, so worker processes map the file themselves
+    # instead of receiving a copy of it.
+    def __getstate__(self):
+        return self.path
+    #end __getstate__
+
+    def __setstate__(self, path):
+        self.__init__(path)
+    #end __setstate__
+
+    def __len__(self):
+        return len(self.keys)
+    #end __len__
+
+    # lookup(self, state)
+    #    Input: self (the object)
+    #    state (the game state, with the maximizing player to move)
+    #
+    #    Output: Tuple (the cell index of the best move, its score, and the
+    #    depth it was searched to, or None if the position is not in the book)
+    #
+    #    Finds the canonical form of the state in the book and maps the
+    #    stored move back onto the state. The book only holds positions of
+    #    the 4x4x4 cube.
+    def lookup(self, state):
+        if state.geometry is not game.DEFAULT_GEOMETRY:
+            return None
+        #end if
+
+        import numpy as np
+        (maxBoard, minBoard), sym = state.canonical()
+        key = game.boardHash(maxBoard, minBoard)
+
+        index = int(np.searchsorted(self.keys, np.uint64(key)))
+        if index == len(self.keys) or int(self.keys[index]) != key:
+            return None
+        #end if
+
+        entry = int(self.entries[index])
+
+        move = game.SYMMETRIES[game.SYMMETRY_INVERSE[sym]][entry & 0xFF]
+        return (move, ((entry >> 16) & 0xFFFF) - SCORE_OFFSET, (entry >> 8) & 0xFF)
+    #end lookup
+
+#end OpeningBook
+
+# openings(plies)
+#    Input: plies (the most tokens on the board)
+#
+#    Output: List (one State per symmetry class of the positions reached
+#    from the empty board, with the player moving first, where it is the
+#    AI's turn)
+#
+#    Enumerates the opening positions the book covers. The player (min)
+#    moves first, so the AI is to move when the player has one more token.
+def openings(plies):
+    level = {(0, 0)}
+    positions = []
+
+    for ply in range(plies):
+        player = -1 if ply % 2 == 0 else 1
+        nextLevel = set()
+        for maxBoard, minBoard in level:
+            state = game.State()
+            state.setBoards(maxBoard, minBoard)
+            for action in game.actions(state):
+                state.push(action, player)
+                if not state.isWin()[0]:
+                    nextLevel.add(state.canonical()[0])
+                #end if
+                state.pop()
+            #end for
+        #end for
+
+        level = nextLevel
+        if player == -1:
+            for maxBoard, minBoard in sorted(level):
+                state = game.State()
+                state.setBoards(maxBoard, minBoard)
+                positions.append(state)
+            #end for
+        #end if
+    #end for
+
+    return positions
+#end openings
+
+# Models of a worker process, one per depth.
+_workerModels = {}
+
+# _searchOpening(boards, depth)
+#    Input: boards (the (maxBoard, minBoard) pair of a canonical opening)
+#    depth (the depth to search it to)
+#
+#    Output: Tuple (the cell index of the best move, its score)
+#
+#    Runs in a worker process of build.
+def _searchOpening(boards, depth):
+    searcher = _workerModels.get(depth)
+    if searcher is None:
+        searcher = model.Model(depth)
+        _workerModels[depth] = searcher
+    #end if
+
+    state = game.State()
+    state.setBoards(boards[0], boards[1])
+    action = searcher.alphaBetaSearch(state)
+
+    return (action, int(searcher.value))
+#end _searchOpening
+
+# build(path, plies, depth, workers)
+#    Input: path (the book file to write)
+#    plies (the most tokens on the board of a book position)
+#    depth (the depth every position is searched to)
+#    workers (number of worker processes, None for one per CPU)
+#
+#    Output: integer (the number of positions written)
+#    (side effect of writing the book file)
+#
+#    Searches every canonical opening offline and writes the book.
+def build(path=BOOK_PATH, plies=3, depth=4, workers=None):
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+    positions = openings(plies)
+    boards = [(state.maxBoard, state.minBoard) for state in positions]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_searchOpening, boards, [depth] * len(boards), chunksize=8))
+    #end with
+
+    keys = np.array([state.hash for state in positions], dtype='<u8')
+    entries = np.array([move | depth << 8 | (score + SCORE_OFFSET) << 16 for move, score in results], dtype='<u8')
+
+    order = np.argsort(keys)
+    np.save(path, np.concatenate([keys[order], entries[order]]))
+
+    return len(positions)
+#end build
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds the opening book offline.')
+    parser.add_argument('--path', default=BOOK_PATH, help='book file to write')
+    parser.add_argument('--plies', type=int, default=3, help='most tokens on the board of a book position')
+    parser.add_argument('--depth', type=int, default=4, help='search depth of every position')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, one per CPU by default')
+    args = parser.parse_args()
+
+    count = build(args.path, args.plies, args.depth, args.workers)
+    print('Wrote %d positions to %s' % (count, args.path))
+#end main
+
+if __name__ == '__main__':
+    main()
+#end if
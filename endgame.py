@@ -0,0 +1,249 @@
+import time
+import game
+import threats
+
+# Most empty cells at which the endgame solver takes over from the search
+# by default, where solving to the end of the game is cheap.
+DEFAULT_SOLVE_EMPTY = 16
+
+# Most positions an EndgameSolver remembers before it forgets them all.
+CACHE_LIMIT = 1 << 20
+
+# Bounds of a remembered value, as in model.TranspositionTable.
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# Nodes searched between two checks of the budget.
+BUDGET_CHECK_INTERVAL = 1024
+
+# Raised inside EndgameSolver._negamax when the budget runs out.
+class _BudgetExceeded(Exception):
+    pass
+#end _BudgetExceeded
+
+# This class solves positions exactly by searching every line of play to the
+# end of the game. A win scores the win score of the board plus the cells
+# still empty when it happens, so the fastest win and the slowest loss score
+# best, and a draw scores TIE_SCORE, the same as State.h gives a full board.
+# A player who can win on the spot does, and a player facing a single
+# threat has to block it, so the tree is much narrower than the board. The
+# values do not depend on the search that found them, so the solved
+# positions are remembered between calls: once one move of a game is
+# solved, the moves after it are mostly answered from memory.
+class EndgameSolver:
+
+    nodes = 0
+    cache = None
+    deadline = None
+    nodeEnd = None
+    checkAt = 0
+    stopped = False
+
+    # __init__(self)
+    #    Input: self (the object being instantiated)
+    #
+    #    Output: None (Side effect of instantiation)
+    #
+    #    Initializes the solver with no remembered positions. nodes counts
+    #    the states visited, for benchmarking.
+    def __init__(self):
+        self.nodes = 0
+        self.cache = {}
+    #end __init__
+
+    # solve(self, state, player, timeLimit, nodeLimit)
+    #    Input: self (the object)
+    #    state (the game state, with player to move, restored on return)
+    #    player (1 for max, -1 for min)
+    #    timeLimit (seconds the solver may take, or None)
+    #    nodeLimit (nodes the solver may visit, or None)
+    #
+    #    Output: Tuple (the exact value of the state for max, the best move
+    #    for player or None if the game is over), or None if the budget ran
+    #    out first
+    def solve(self, state, player, timeLimit=None, nodeLimit=None):
+        if len(self.cache) > CACHE_LIMIT:
+            self.cache = {}
+        #end if
+
+        self.deadline = time.perf_counter() + timeLimit if timeLimit is not None else None
+        self.nodeEnd = self.nodes + nodeLimit if nodeLimit is not None else None
+        self.checkAt = self.nodes + BUDGET_CHECK_INTERVAL
+        if self.nodeEnd is not None:
+            self.checkAt = min(self.checkAt, self.nodeEnd)
+        #end if
+        rootLength = len(state.moveStack)
+        try:
+            value, move = self._negamax(state, player, -float('inf'), float('inf'))
+        except _BudgetExceeded:
+            while len(state.moveStack) > rootLength:
+                state.pop()
+            #end while
+            return None
+        #end try/except
+
+        return (player * value, move)
+    #end solve
+
+    # stop(self, stopped)
+    #    Input: self (the object)
+    #    stopped (True to stop, False to let solves run again)
+    #
+    #    Output: None (side effect of stopping the running solve)
+    #
+    #    Called from another thread to make a running solve give up as if
+    #    its budget ran out, along with every solve started until stop is
+    #    called with False.
+    def stop(self, stopped=True):
+        self.stopped = stopped
+        if stopped:
+            self.checkAt = 0
+        #end if
+    #end stop
+
+    # _negamax(self, state, player, alpha, beta)
+    #    Input: self (the object)
+    #    state (the game state, with player to move)
+    #    player (1 for max, -1 for min)
+    #    alpha, beta (the window of the search, for player)
+    #
+    #    Output: Tuple (the value of the state for player, the best move)
+    #
+    #    The recursive step of solve.
+    def _negamax(self, state, player, alpha, beta):
+        self.nodes += 1
+        if self.nodes >= self.checkAt:
+            self._checkBudget()
+        #end if
+
+        geometry = state.geometry
+        empty = geometry.cells - state.moveCount
+        if state.winner != 0:
+            return (player * state.winner * (geometry.winScore + empty), None)
+        elif empty == 0:
+            return (player * game.TIE_SCORE, None)
+        #end if/elif
+
+        key = state.hash ^ state.geometry.zobristSide if player == 1 else state.hash
+        entry = self.cache.get(key)
+        cacheMove = None
+        if entry is not None:
+            flag, value, cacheMove = entry
+            if flag == EXACT:
+                return (value, cacheMove)
+            elif flag == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            #end if/elif/else
+            if alpha >= beta:
+                return (value, cacheMove)
+            #end if
+        #end if
+
+        wins = threats.threatCells(state, player)
+        if wins:
+            return (geometry.winScore + empty - 1, wins[0])
+        #end if
+
+        blocks = threats.threatCells(state, -player)
+        if len(blocks) > 1:
+            # Only one of them can be blocked, the opponent wins next move.
+            return (-(geometry.winScore + empty - 2), blocks[0])
+        #end if
+
+        if blocks:
+            moves = blocks
+        else:
+            moves = self._orderMoves(state, player, cacheMove)
+        #end if/else
+
+        alphaStart = alpha
+        best = -float('inf')
+        bestMove = None
+        for cell in moves:
+            state.push(cell, player)
+            value = -self._negamax(state, -player, -beta, -alpha)[0]
+            state.pop()
+
+            if value > best:
+                best = value
+                bestMove = cell
+            #end if
+            if best > alpha:
+                alpha = best
+            #end if
+            if alpha >= beta:
+                break
+            #end if
+        #end for
+
+        if best <= alphaStart:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        #end if/elif/else
+        self.cache[key] = (flag, best, bestMove)
+
+        return (best, bestMove)
+    #end _negamax
+
+    # _orderMoves(self, state, player, cacheMove)
+    #    Input: self (the object)
+    #    state (the game state)
+    #    player (1 for max, -1 for min)
+    #    cacheMove (the best move remembered for the state, or None)
+    #
+    #    Output: List (the empty cells, the remembered move first, then the
+    #    ones on the most valuable open lines of either player)
+    def _orderMoves(self, state, player, cacheMove):
+        own = state.maxCounts if player == 1 else state.minCounts
+        other = state.minCounts if player == 1 else state.maxCounts
+        cellLines = state.geometry.cellLines
+        weights = state.geometry.lineWeights
+
+        scores = {}
+        for cell in game.actions(state):
+            score = 0
+            for line in cellLines[cell]:
+                if other[line] == 0:
+                    score += weights[own[line] + 1]
+                elif own[line] == 0:
+                    score += weights[other[line]]
+                #end if/elif
+            #end for
+            scores[cell] = score
+        #end for
+
+        if cacheMove is not None:
+            scores[cacheMove] = float('inf')
+        #end if
+
+        return sorted(scores, key=lambda cell: (-scores[cell], cell))
+    #end _orderMoves
+
+    # _checkBudget(self)
+    #    Input: self (the object)
+    #
+    #    Output: None (raises _BudgetExceeded once the time or nodes of the
+    #    solve run out)
+    def _checkBudget(self):
+        self.checkAt = self.nodes + BUDGET_CHECK_INTERVAL
+        if self.stopped:
+            raise _BudgetExceeded()
+        #end if
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise _BudgetExceeded()
+        #end if
+        if self.nodeEnd is not None and self.nodes >= self.nodeEnd:
+            raise _BudgetExceeded()
+        #end if
+        if self.nodeEnd is not None:
+            self.checkAt = min(self.checkAt, self.nodeEnd)
+        #end if
+    #end _checkBudget
+
+#end EndgameSolver
@@ -0,0 +1,324 @@
+import argparse
+import os
+import tempfile
+import numpy as np
+import game
+import records
+import tournament
+
+# Default location of the evaluator weights, next to the code.
+EVALUATOR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'evaluator.npz')
+
+# Positions gathered before they are added to the normal equations.
+TRAIN_BATCH = 4096
+
+# Weight of the ridge penalty, which keeps the weights of rare line counts
+# small.
+DEFAULT_RIDGE = 1.0
+
+# Games of self-play generated for training when no records are given, and
+# the search depth and random opening moves of both sides.
+DEFAULT_GAMES = 400
+DEFAULT_DEPTH = 2
+DEFAULT_OPENING_PLIES = 4
+
+# An evaluator scores a state as a sum of one value per line, picked by how
+# many tokens each player has on it, the same form as the hand-written
+# heuristic of State.h. The values are learned from the outcome of games,
+# so unlike LINE_VALUE they can differ between the kinds of line, such as
+# the rows along the edges of the cube and the diagonals through its
+# center, and they depend on whose move it is: three tokens in an open
+# line win for the player to move, but can still be blocked if it is the
+# other player's turn. Lines that a symmetry of the board maps onto each
+# other share their values. The value of a line to the player to move
+# splits into the part a line is worth to max, which flips sign with the
+# counts swapped, and the tempo, which goes to whoever is to move. Both are
+# rounded and packed into one number per line (see game.TEMPO_SHIFT), so
+# State keeps their running sum through play exactly as it does the
+# hand-written values, at the same cost, and evaluateBatch scores many
+# positions at once.
+#    geometry: the Geometry of the board the values are for
+#    weights: classes x (size + 1) x (size + 1), the value of a line of
+#    each class with own tokens of the player to move and other tokens of
+#    the opponent
+#    lineValues: the packed values of every line, indexed by maxCount and
+#    minCount, the form State uses
+#    lineValueFlat: the same as a lines x (size + 1)^2 array, for
+#    evaluateBatch
+class Evaluator:
+
+    geometry = None
+    weights = None
+    lineValues = None
+    lineValueFlat = None
+
+    # __init__(self, weights, geometry)
+    #    Input: self (the object being instantiated)
+    #    weights (array of the line values by class, see above)
+    #    geometry (the Geometry of the board)
+    #
+    #    Output: None (Side effect of instantiation)
+    #
+    #    Builds the value tables of every line from the weights.
+    def __init__(self, weights, geometry=game.DEFAULT_GEOMETRY):
+        self.geometry = geometry
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+        classes = lineClasses(geometry)
+        if self.weights.shape != (max(classes) + 1, geometry.size + 1, geometry.size + 1):
+            raise ValueError('The weights do not fit a board of size %d in %d dimensions'
+                             % (geometry.size, geometry.dims))
+        #end if
+
+        swapped = self.weights.transpose((0, 2, 1))
+        values = np.rint((self.weights - swapped) / 2).astype(np.int64)
+        tempo = np.rint((self.weights + swapped) / 2).astype(np.int64)
+        packed = values + (tempo << game.TEMPO_SHIFT)
+
+        rows = [table.tolist() for table in packed]
+        self.lineValues = [rows[c] for c in classes]
+        self.lineValueFlat = packed[classes].reshape((len(classes), -1))
+    #end __init__
+
+    # valuesFor(self, geometry)
+    #    Input: self (the object)
+    #    geometry (the Geometry of a state)
+    #
+    #    Output: List (lineValues, see State)
+    #
+    #    Raises ValueError if the evaluator was trained on another board.
+    def valuesFor(self, geometry):
+        if geometry is not self.geometry:
+            raise ValueError('The evaluator is for a board of size %d in %d dimensions'
+                             % (self.geometry.size, self.geometry.dims))
+        #end if
+
+        return self.lineValues
+    #end valuesFor
+
+    # save(self, path)
+    #    Input: self (the object)
+    #    path (the weights file to write)
+    #
+    #    Output: None (side effect of writing the file)
+    def save(self, path=EVALUATOR_PATH):
+        np.savez(path, size=self.geometry.size, dims=self.geometry.dims, weights=self.weights)
+    #end save
+
+#end Evaluator
+
+# load(path)
+#    Input: path (a weights file written by Evaluator.save)
+#
+#    Output: Evaluator (the evaluator of the file)
+def load(path=EVALUATOR_PATH):
+    with np.load(path) as data:
+        geometry = game.getGeometry(int(data['size']), int(data['dims']))
+        return Evaluator(data['weights'], geometry)
+    #end with
+#end load
+
+# fromHeuristic(geometry)
+#    Input: geometry (the Geometry of the board)
+#
+#    Output: Evaluator (the evaluator with the hand-written values of every
+#    line and no tempo, scoring the same as State.h without one)
+def fromHeuristic(geometry=game.DEFAULT_GEOMETRY):
+    weights = [geometry.lineValue] * (max(lineClasses(geometry)) + 1)
+    return Evaluator(weights, geometry)
+#end fromHeuristic
+
+# Line classes of every Geometry, built once.
+_lineClasses = {}
+
+# lineClasses(geometry)
+#    Input: geometry (the Geometry of the board)
+#
+#    Output: List (the class of every line, numbered from 0 in the order
+#    the first line of each class appears)
+#
+#    Groups the lines that a symmetry of the board maps onto each other.
+def lineClasses(geometry):
+    classes = _lineClasses.get(geometry)
+    if classes is not None:
+        return classes
+    #end if
+
+    index = {frozenset(line): i for i, line in enumerate(geometry.lines)}
+    classes = [None] * len(geometry.lines)
+    count = 0
+    for i, line in enumerate(geometry.lines):
+        if classes[i] is None:
+            for perm in geometry.symmetries:
+                classes[index[frozenset(perm[cell] for cell in line)]] = count
+            #end for
+            count += 1
+        #end if
+    #end for
+
+    _lineClasses[geometry] = classes
+    return classes
+#end lineClasses
+
+# freeCounts(size)
+#    Input: size (the cells per side of the board)
+#
+#    Output: List (the (own, other) pairs of counts of a line that is not
+#    won, each with a weight of its own; an empty line is worth nothing)
+def freeCounts(size):
+    return [(own, other) for own in range(size) for other in range(size)
+            if 0 < own + other <= size]
+#end freeCounts
+
+# features(ownBoards, otherBoards, geometry)
+#    Input: ownBoards (the bitboards of the player to move in N positions)
+#    otherBoards (the bitboards of the opponent)
+#    geometry (the Geometry of the board)
+#
+#    Output: numpy ndarray (N x classes * len(freeCounts), for every class
+#    and free pair of counts, the lines of the class holding them)
+#
+#    The features the weights are learned from. The value of a position to
+#    the player to move is the dot product of its features with the free
+#    weights.
+def features(ownBoards, otherBoards, geometry=game.DEFAULT_GEOMETRY):
+    size = geometry.size
+    classes = np.array(lineClasses(geometry))
+    classCount = int(classes.max()) + 1
+    width = (size + 1) ** 2
+
+    counts = game.lineCounts(game.boardsToArray(ownBoards, otherBoards, geometry.cells), geometry)
+    rows = len(counts)
+    index = np.arange(rows)[:, None] * (classCount * width) + classes[None, :] * width + counts
+    occupancy = np.bincount(index.ravel(), minlength=rows * classCount * width)
+    occupancy = occupancy.reshape((rows, classCount, size + 1, size + 1))
+
+    pairs = freeCounts(size)
+    ownCounts = [own for own, other in pairs]
+    otherCounts = [other for own, other in pairs]
+
+    return occupancy[:, :, ownCounts, otherCounts].reshape((rows, -1)).astype(np.float64)
+#end features
+
+# train(paths, geometry, ridge)
+#    Input: paths (record files of finished games, see records.py)
+#    geometry (the Geometry of the games)
+#    ridge (the weight of the ridge penalty)
+#
+#    Output: Evaluator (the evaluator fitted to the games)
+#
+#    Fits the line values by ridge regression of the outcome of every game
+#    for the player to move, 1 for a win, -1 for a loss and 0 for a tie, on
+#    the features of every position before a move of it. The records are
+#    read a game at a time and the positions added to the normal equations
+#    in batches, so memory does not grow with the files. An outcome of 1 is
+#    scaled to a quarter of the win score, so a sure win by the estimate
+#    still scores below a real one.
+def train(paths, geometry=game.DEFAULT_GEOMETRY, ridge=DEFAULT_RIDGE):
+    pairs = freeCounts(geometry.size)
+    width = (max(lineClasses(geometry)) + 1) * len(pairs)
+    normal = np.zeros((width, width))
+    target = np.zeros(width)
+    ownBoards = []
+    otherBoards = []
+    outcomes = []
+
+    for path in paths:
+        for record in records.readRecords(path):
+            if records.recordGeometry(record) is not geometry or not record['moves']:
+                continue
+            #end if
+
+            players = []
+            for state, player, move in records.positions(record):
+                if player == 1:
+                    ownBoards.append(state.maxBoard)
+                    otherBoards.append(state.minBoard)
+                else:
+                    ownBoards.append(state.minBoard)
+                    otherBoards.append(state.maxBoard)
+                #end if/else
+                players.append(player)
+            #end for
+
+            # The state holds the whole game once the replay is done.
+            winner = state.isWin()[1]
+            outcomes.extend(winner * player for player in players)
+
+            if len(outcomes) >= TRAIN_BATCH:
+                _addBatch(normal, target, ownBoards, otherBoards, outcomes, geometry)
+                ownBoards, otherBoards, outcomes = [], [], []
+            #end if
+        #end for
+    #end for
+    if outcomes:
+        _addBatch(normal, target, ownBoards, otherBoards, outcomes, geometry)
+    #end if
+
+    free = np.linalg.solve(normal + ridge * np.eye(width), target) * (geometry.winScore / 4)
+
+    free = free.reshape((-1, len(pairs)))
+    weights = np.zeros((len(free), geometry.size + 1, geometry.size + 1))
+    for i, (own, other) in enumerate(pairs):
+        weights[:, own, other] = free[:, i]
+    #end for
+
+    return Evaluator(weights, geometry)
+#end train
+
+# _addBatch(normal, target, ownBoards, otherBoards, outcomes, geometry)
+#    Input: normal, target (the normal equations, added to in place)
+#    ownBoards, otherBoards (the bitboards of the positions, the player to
+#    move first)
+#    outcomes (the outcome of the game of every position for the player to
+#    move)
+#    geometry (the Geometry of the board)
+#
+#    Output: None (side effect of adding the positions to the equations)
+def _addBatch(normal, target, ownBoards, otherBoards, outcomes, geometry):
+    rows = features(ownBoards, otherBoards, geometry)
+    normal += rows.T @ rows
+    target += rows.T @ np.array(outcomes, dtype=np.float64)
+#end _addBatch
+
+# selfPlay(path, games, depth, plies, workers)
+#    Input: path (the record file to write)
+#    games (the number of games)
+#    depth (the search depth of both sides)
+#    plies (random moves of every opening)
+#    workers (number of worker processes, None for one per CPU)
+#
+#    Output: None (side effect of writing the records)
+#
+#    Plays games of the hand-written heuristic against itself from random
+#    openings, to train on.
+def selfPlay(path, games=DEFAULT_GAMES, depth=DEFAULT_DEPTH, plies=DEFAULT_OPENING_PLIES, workers=None):
+    config = {'maxLayers': depth}
+    tournament.runTournament(config, config, games, path, plies=plies, workers=workers)
+#end selfPlay
+
+def main():
+    parser = argparse.ArgumentParser(description='Trains the line values of the evaluator offline.')
+    parser.add_argument('records', nargs='*', help='record files to train on, self-play games by default')
+    parser.add_argument('--path', default=EVALUATOR_PATH, help='weights file to write')
+    parser.add_argument('--games', type=int, default=DEFAULT_GAMES, help='self-play games without records')
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH, help='search depth of the self-play games')
+    parser.add_argument('--plies', type=int, default=DEFAULT_OPENING_PLIES, help='random moves of every opening')
+    parser.add_argument('--ridge', type=float, default=DEFAULT_RIDGE, help='weight of the ridge penalty')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, one per CPU by default')
+    args = parser.parse_args()
+
+    paths = args.records
+    if not paths:
+        paths = [os.path.join(tempfile.mkdtemp(), 'selfplay.jsonl')]
+        selfPlay(paths[0], args.games, args.depth, args.plies, args.workers)
+    #end if
+
+    trained = train(paths, ridge=args.ridge)
+    trained.save(args.path)
+    print('Wrote the values of %d line classes to %s' % (len(trained.weights), args.path))
+#end main
+
+if __name__ == '__main__':
+    main()
+#end if
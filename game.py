@@ -1,5 +1,8 @@
-import numpy as np
-import model
+import itertools
+import marshal
+import os
+import random
+import time
 from enum import Enum
 
 class Turn(Enum):
@@ -10,20 +13,658 @@ class Token(Enum):
     PLAYER = -1
     AI = 1
 
+# Default board: 4 cells per side in 3 dimensions.
+DEFAULT_SIZE = 4
+DEFAULT_DIMS = 3
+
+# Index of the cell (x, y, z) in a 64-bit board. Matches the C-order
+# flattening of the 4x4x4 array returned by getState. The coordinates may
+# be NumPy integers, so they are converted to avoid 64-bit overflow.
+def cellIndex(x, y, z):
+    return (int(x) << 4) | (int(y) << 2) | int(z)
+#end cellIndex
+
+# The (x, y, z) coordinates of every cell index.
+CELL_COORDS = tuple((index >> 4, (index >> 2) & 3, index & 3) for index in range(64))
+
+# Inverse of cellIndex, the (x, y, z) coordinates of a cell index.
+def cellCoords(index):
+    return CELL_COORDS[index]
+#end cellCoords
+
+# Heuristic weights. A line holding only one player's tokens is worth
+# LINE_WEIGHTS[count] to that player, so every extra token in an open line
+# is worth four times the previous one. A line holding both players' tokens
+# is blocked and worth nothing. A win outweighs any sum of open lines.
+# These are the weights of the default board, see Geometry for the others.
+LINE_WEIGHTS = (0, 1, 4, 16, 0)
+WIN_SCORE = 1000
+TIE_SCORE = -20
+
+# A learned evaluator.Evaluator gives every line a value for max and a tempo
+# for the player to move. The tempo is packed into the bits from TEMPO_SHIFT
+# up, so State keeps both in the one running sum of score, and splitTempo
+# takes them apart again. The hand-written values have no tempo.
+TEMPO_SHIFT = 32
+TEMPO_HALF = 1 << (TEMPO_SHIFT - 1)
+
+# The tables of every board are built once and cached in a file per size,
+# here with the compiled modules, so that a new process (a pool worker, or
+# a run of run.py) loads them instead of building them again. The files are
+# written with marshal, the format of the compiled modules, which loads
+# lists of integers faster than pickle and is built into Python. Raise
+# TABLE_CACHE_VERSION whenever the tables are built differently, so that
+# the files of the old build are rebuilt. Where the code is installed
+# read-only, the files go to USER_CACHE_DIR instead.
+TABLE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__')
+USER_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                              'tic-tac-toe')
+TABLE_CACHE_VERSION = 2
+
+# NumPy is only imported by the functions that work on arrays, such as
+# evaluateBatch and getState, and the process pools of model.py,
+# tournament.py and records.py only import concurrent.futures when they are
+# started, so that the integer paths of State and the search start up
+# without either. Likewise Game imports the search, pondering and records
+# only when a game is made, so that importing the State alone stays light.
+
+# This class holds the tables of a board of size cells per side in dims
+# dimensions, the default being the 4x4x4 cube. A cell is numbered by the
+# C-order flattening of its coordinates, so a board of any size is held in
+# one integer bitboard per player. Everything is built once per size by
+# getGeometry, or loaded from the table cache, and shared by every State
+# on that board:
+#    lines, lineMasks, cellLines: the winning lines as tuples of cells, as
+#    bit masks, and the lines through every cell
+#    symmetries, symmetryInverse: the permutations of the cells mapping
+#    lines onto lines, identity first, and the index of each inverse
+#    lineWeights, lineValue, winScore: the heuristic weights, see
+#    LINE_WEIGHTS
+#    lineValues: lineValue once per line, the form State scores with
+#    lineMatrix, lineValueFlat: the same as arrays for evaluateBatch, built
+#    the first time they are used
+#    zobristMax, zobristMin: the Zobrist keys of the cells
+#    zobristSide: the key XORed in for max to move, drawn apart from them
+class Geometry:
+
+    size = DEFAULT_SIZE
+    dims = DEFAULT_DIMS
+    cells = 64
+    fullMask = 0
+    strides = None
+    cellCoords = None
+    lines = None
+    lineMasks = None
+    cellLines = None
+    symmetries = None
+    symmetryInverse = None
+    lineWeights = None
+    lineValue = None
+    lineValues = None
+    _lineValueFlat = None
+    _lineMatrix = None
+    winScore = WIN_SCORE
+    zobristMax = None
+    zobristMin = None
+    zobristSide = 0
+
+    # __init__(self, size, dims)
+    #    Input: self (the object being instantiated)
+    #    size (the cells per side, at least 2)
+    #    dims (the number of dimensions, at least 1)
+    #
+    #    Output: None (Side effect of instantiation)
+    #
+    #    Builds every table of the board. Use getGeometry instead, which builds
+    #    each size once.
+    def __init__(self, size=DEFAULT_SIZE, dims=DEFAULT_DIMS):
+        if size < 2 or dims < 1:
+            raise ValueError('A board needs at least 2 cells per side and 1 dimension')
+        #end if
+
+        self.size = size
+        self.dims = dims
+        self.cells = size ** dims
+        self.fullMask = (1 << self.cells) - 1
+        self.strides = tuple(size ** (dims - 1 - axis) for axis in range(dims))
+        self.cellCoords = tuple(itertools.product(range(size), repeat=dims))
+
+        tables = _loadTables(size, dims)
+        if tables is None:
+            tables = self._buildTables()
+            _saveTables(size, dims, tables)
+        #end if
+        self.lines = tables['lines']
+        self.symmetries = tables['symmetries']
+        self.symmetryInverse = tables['symmetryInverse']
+        self.zobristMax = tables['zobristMax']
+        self.zobristMin = tables['zobristMin']
+        self.zobristSide = tables['zobristSide']
+
+        self.lineMasks = [sum(1 << cell for cell in line) for line in self.lines]
+        self.cellLines = [[] for _ in range(self.cells)]
+        for i, line in enumerate(self.lines):
+            for cell in line:
+                self.cellLines[cell].append(i)
+            #end for
+        #end for
+
+        # Every extra token in an open line is worth four times the previous
+        # one, and the win is scaled up with the weight of a line one token
+        # short of it, so that it still outweighs any sum of open lines.
+        self.lineWeights = tuple(0 if count in (0, size) else 4 ** (count - 1) for count in range(size + 1))
+        self.winScore = WIN_SCORE * max(1, self.lineWeights[size - 1] // LINE_WEIGHTS[3])
+        weights = self.lineWeights
+        self.lineValue = [[weights[m] if n == 0 else -weights[n] if m == 0 else 0
+                           for n in range(size + 1)] for m in range(size + 1)]
+        self.lineValues = [self.lineValue] * len(self.lines)
+    #end __init__
+
+    # A pickled Geometry is rebuilt through geometry, so every process holds
+    # one per size and compares them by identity.
+    def __reduce__(self):
+        return (getGeometry, (self.size, self.dims))
+    #end __reduce__
+
+    def __repr__(self):
+        return 'Geometry(%d, %d)' % (self.size, self.dims)
+    #end __repr__
+
+    @property
+    def lineMatrix(self):
+        if self._lineMatrix is None:
+            import numpy as np
+            self._lineMatrix = np.zeros((len(self.lines), self.cells), dtype=np.float32)
+            for line, cells in enumerate(self.lines):
+                self._lineMatrix[line, list(cells)] = 1
+            #end for
+        #end if
+
+        return self._lineMatrix
+    #end lineMatrix
+
+    @property
+    def lineValueFlat(self):
+        if self._lineValueFlat is None:
+            import numpy as np
+            self._lineValueFlat = np.array(self.lineValue).ravel()
+        #end if
+
+        return self._lineValueFlat
+    #end lineValueFlat
+
+    # _buildTables(self)
+    #    Input: self (the object, with its size, dims and cells set)
+    #
+    #    Output: Dictionary (the lines, symmetries, symmetryInverse and the
+    #    Zobrist keys of the board, the tables the cache holds)
+    def _buildTables(self):
+        symmetries = self._buildSymmetries()
+        index = {perm: i for i, perm in enumerate(symmetries)}
+        inverse = [index[tuple(sorted(range(self.cells), key=perm.__getitem__))] for perm in symmetries]
+
+        # The seed is fixed so that hashes are the same in every process.
+        # Every size draws its cell keys from the start of the same stream,
+        # so the side key comes from a seed of its own, or it would be the
+        # key of a cell on a larger board.
+        generator = random.Random(8150)
+        zobristMax = [generator.getrandbits(64) for _ in range(self.cells)]
+        zobristMin = [generator.getrandbits(64) for _ in range(self.cells)]
+        zobristSide = random.Random(8151).getrandbits(64)
+
+        return {'lines': self._buildLines(), 'symmetries': symmetries, 'symmetryInverse': inverse,
+                'zobristMax': zobristMax, 'zobristMin': zobristMin, 'zobristSide': zobristSide}
+    #end _buildTables
+
+    # cellIndex(self, coords)
+    #    Input: self (the object)
+    #    coords (one coordinate per dimension, 0 to size - 1)
+    #
+    #    Output: integer (the index of the cell)
+    def cellIndex(self, coords):
+        index = 0
+        for coord, stride in zip(coords, self.strides):
+            index += int(coord) * stride
+        #end for
+
+        return index
+    #end cellIndex
+
+    # onBoard(self, coords)
+    #    Input: self (the object)
+    #    coords (the coordinates of a cell)
+    #
+    #    Output: Boolean (if there is one coordinate per dimension, each 0 to
+    #    size - 1)
+    def onBoard(self, coords):
+        return len(coords) == self.dims and all(0 <= coord < self.size for coord in coords)
+    #end onBoard
+
+    # _buildLines(self)
+    #    Input: self (the object)
+    #
+    #    Output: List (every winning line, each a tuple of size cell indices)
+    #
+    #    Finds the winning lines of the board, ((size + 2)^dims - size^dims)/2
+    #    of them: 76 for the 4x4x4 cube. A line starts on a cell where
+    #    stepping back in its direction leaves the board and stepping forward
+    #    size - 1 times stays on it. Only one of each pair of opposite
+    #    directions is used so that every line is found once.
+    def _buildLines(self):
+        size = self.size
+        # Keep the direction whose first non-zero step is positive.
+        directions = [step for step in itertools.product((-1, 0, 1), repeat=self.dims) if step > (0,) * self.dims]
+
+        lines = []
+        for coords in self.cellCoords:
+            for step in directions:
+                startOnEdge = not all(0 <= c - d < size for c, d in zip(coords, step))
+                endOnBoard = all(0 <= c + (size - 1) * d < size for c, d in zip(coords, step))
+                if startOnEdge and endOnBoard:
+                    lines.append(tuple(self.cellIndex([c + i * d for c, d in zip(coords, step)]) for i in range(size)))
+                #end if
+            #end for
+        #end for
+
+        return lines
+    #end _buildLines
+
+    # _buildSymmetries(self)
+    #    Input: self (the object)
+    #
+    #    Output: List (the symmetries, each a tuple mapping a cell index to the
+    #    cell index it is moved to)
+    #
+    #    Builds every permutation of the cells that maps winning lines onto
+    #    winning lines. Each one permutes the axes, applies one map to every
+    #    coordinate, then may reverse each axis. A coordinate map keeps lines
+    #    if it commutes with reversing, that is if it permutes the pairs of
+    #    coordinates c and size - 1 - c and may swap the two of each pair. One
+    #    of each map and its reverse is kept: for the cube that leaves the
+    #    identity, swapping the inner and outer cells, and the two
+    #    combinations with swapping 0/1 and 2/3, so 6 * 4 * 8 = 192
+    #    symmetries. The identity is always first.
+    def _buildSymmetries(self):
+        size = self.size
+        half = size // 2
+
+        coordinateMaps = []
+        for pairOrder in itertools.permutations(range(half)):
+            for swaps in range(1 << half):
+                coordinateMap = list(range(size))
+                for pair, target in enumerate(pairOrder):
+                    low, high = target, size - 1 - target
+                    if swaps >> pair & 1:
+                        low, high = high, low
+                    #end if
+                    coordinateMap[pair] = low
+                    coordinateMap[size - 1 - pair] = high
+                #end for
+                if coordinateMap[0] < coordinateMap[-1]:
+                    coordinateMaps.append(tuple(coordinateMap))
+                #end if
+            #end for
+        #end for
+        coordinateMaps.sort()
+
+        # Axis order[axis] of a cell becomes axis axis of its image, so each
+        # coordinate of the cell adds a fixed offset to the image's index.
+        # The cells are in C order, so the image of every cell is a sum over
+        # the axes in turn, the first one outermost.
+        symmetries = []
+        for order in itertools.permutations(range(self.dims)):
+            target = [order.index(axis) for axis in range(self.dims)]
+            for coordinateMap in coordinateMaps:
+                for reverse in range(1 << self.dims):
+                    perm = [0]
+                    for axis in range(self.dims):
+                        image = target[axis]
+                        stride = self.strides[image]
+                        flip = reverse >> image & 1
+                        offsets = [(size - 1 - coordinateMap[c] if flip else coordinateMap[c]) * stride
+                                   for c in range(size)]
+                        perm = [index + offset for index in perm for offset in offsets]
+                    #end for
+                    symmetries.append(tuple(perm))
+                #end for
+            #end for
+        #end for
+
+        return symmetries
+    #end _buildSymmetries
+
+#end Geometry
+
+# Geometries built so far, by (size, dims).
+_geometries = {}
+
+# getGeometry(size, dims)
+#    Input: size (the cells per side)
+#    dims (the number of dimensions)
+#
+#    Output: Geometry (the tables of the board, built on the first call for
+#    that size and shared afterwards)
+def getGeometry(size=DEFAULT_SIZE, dims=DEFAULT_DIMS):
+    key = (size, dims)
+    result = _geometries.get(key)
+    if result is None:
+        result = Geometry(size, dims)
+        _geometries[key] = result
+    #end if
+
+    return result
+#end getGeometry
+
+# _tablePath(size, dims, directory)
+#    Input: size (the cells per side)
+#    dims (the number of dimensions)
+#    directory (the cache directory, defaults to TABLE_CACHE_DIR)
+#
+#    Output: String (the table cache file of the board)
+def _tablePath(size, dims, directory=None):
+    return os.path.join(directory or TABLE_CACHE_DIR, 'tables-%d-%d.marshal' % (size, dims))
+#end _tablePath
+
+# _loadTables(size, dims)
+#    Input: size (the cells per side)
+#    dims (the number of dimensions)
+#
+#    Output: Dictionary (the cached tables of the board, see
+#    Geometry._buildTables, or None if there is no usable cache file)
+#
+#    The file next to the code is tried first, then the one in
+#    USER_CACHE_DIR.
+def _loadTables(size, dims):
+    for directory in (TABLE_CACHE_DIR, USER_CACHE_DIR):
+        try:
+            with open(_tablePath(size, dims, directory), 'rb') as cache:
+                tables = marshal.loads(cache.read())
+            #end with
+        except (OSError, EOFError, ValueError, TypeError):
+            continue
+        #end try/except
+
+        if isinstance(tables, dict) and tables.get('version') == TABLE_CACHE_VERSION:
+            return tables
+        #end if
+    #end for
+
+    return None
+#end _loadTables
+
+# _saveTables(size, dims, tables)
+#    Input: size (the cells per side)
+#    dims (the number of dimensions)
+#    tables (the tables built by Geometry._buildTables)
+#
+#    Output: None (side effect of writing the cache file)
+#
+#    The file is written under another name and then moved into place, so
+#    processes starting together never read half of it. If TABLE_CACHE_DIR
+#    cannot be written, such as in a read-only install, the file goes to
+#    USER_CACHE_DIR, and if neither can be written the tables are built in
+#    every process.
+def _saveTables(size, dims, tables):
+    for directory in (TABLE_CACHE_DIR, USER_CACHE_DIR):
+        path = _tablePath(size, dims, directory)
+        partial = '%s.%d' % (path, os.getpid())
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(partial, 'wb') as cache:
+                marshal.dump(dict(tables, version=TABLE_CACHE_VERSION), cache)
+            #end with
+            os.replace(partial, path)
+            return
+        except OSError:
+            if os.path.exists(partial):
+                os.remove(partial)
+            #end if
+        #end try/except
+    #end for
+#end _saveTables
+
+# The 4x4x4 cube every State is on unless given another Geometry.
+DEFAULT_GEOMETRY = getGeometry()
+
+# Bit mask of the whole board.
+FULL_BOARD = DEFAULT_GEOMETRY.fullMask
+
+# The 76 winning lines of the cube as tuples of cell indices, the same lines
+# as bit masks, and for every cell the indices of the lines passing through it.
+LINES = DEFAULT_GEOMETRY.lines
+LINE_MASKS = DEFAULT_GEOMETRY.lineMasks
+CELL_LINES = DEFAULT_GEOMETRY.cellLines
+
+# The 192 symmetries of the cube, and the index of the inverse of each one.
+SYMMETRIES = DEFAULT_GEOMETRY.symmetries
+SYMMETRY_INVERSE = DEFAULT_GEOMETRY.symmetryInverse
+
+# transformBoard(board, perm)
+#    Input: board (a bitboard)
+#    perm (one of the symmetries of its Geometry)
+#
+#    Output: integer (the bitboard with every set bit moved by perm)
+#
+#    Applies a symmetry to one player's tokens. Only the set bits are
+#    visited, so this is cheap for the sparse boards of the opening.
+def transformBoard(board, perm):
+    result = 0
+    while board:
+        low = board & -board
+        result |= 1 << perm[low.bit_length() - 1]
+        board ^= low
+    #end while
+    
+    return result
+#end transformBoard
+
+# LINE_VALUE[maxCount][minCount] is the signed worth of one line.
+LINE_VALUE = DEFAULT_GEOMETRY.lineValue
+
+# The 76x64 line-incidence matrix, LINE_MATRIX[line, cell] is 1 if the
+# line passes through the cell, and LINE_VALUE flattened so that
+# LINE_VALUE_FLAT[5*maxCount + minCount] is LINE_VALUE[maxCount][minCount],
+# for the vectorized evaluation of many positions at once. The matrix is
+# float32 so that the products go through BLAS. Both are NumPy arrays, so
+# they are only built when first read.
+def __getattr__(name):
+    if name == 'LINE_MATRIX':
+        return DEFAULT_GEOMETRY.lineMatrix
+    elif name == 'LINE_VALUE_FLAT':
+        return DEFAULT_GEOMETRY.lineValueFlat
+    #end if/elif
+
+    raise AttributeError("module 'game' has no attribute %r" % name)
+#end __getattr__
+
+# boardsToArray(maxBoards, minBoards, cells)
+#    Input: maxBoards (list of max bitboards)
+#    minBoards (list of min bitboards, in the same order)
+#    cells (the number of cells of the board)
+#
+#    Output: numpy ndarray, N x cells (1 for max, -1 for min, 0 for empty)
+#
+#    Unpacks many pairs of bitboards into rows of cells at once. Row n,
+#    column i is cell i of the n-th pair. Boards of up to 64 cells are
+#    unpacked as 64-bit integers, larger ones through their bytes.
+def boardsToArray(maxBoards, minBoards, cells=64):
+    import numpy as np
+    if cells <= 64:
+        maxBytes = np.array(maxBoards, dtype='<u8').view(np.uint8)
+        minBytes = np.array(minBoards, dtype='<u8').view(np.uint8)
+        width = 64
+    else:
+        width = (cells + 7) // 8
+        maxBytes = np.frombuffer(b''.join(board.to_bytes(width, 'little') for board in maxBoards), dtype=np.uint8)
+        minBytes = np.frombuffer(b''.join(board.to_bytes(width, 'little') for board in minBoards), dtype=np.uint8)
+        width *= 8
+    #end if/else
+
+    maxBits = np.unpackbits(maxBytes, bitorder='little').reshape((-1, width))
+    minBits = np.unpackbits(minBytes, bitorder='little').reshape((-1, width))
+    
+    return (maxBits[:, :cells].astype(np.int8) - minBits[:, :cells].astype(np.int8))
+#end boardsToArray
+
+# splitTempo(score)
+#    Input: score (a sum of line values, or a numpy ndarray of them)
+#
+#    Output: Tuple (the value for max, the tempo for the player to move)
+def splitTempo(score):
+    tempo = (score + TEMPO_HALF) >> TEMPO_SHIFT
+    return (score - (tempo << TEMPO_SHIFT), tempo)
+#end splitTempo
+
+# lineCounts(positions, geometry)
+#    Input: positions (numpy ndarray, N x cells or N x size x ... x size,
+#    positive values are max tokens, negative values are min tokens)
+#    geometry (the Geometry of the positions)
+#
+#    Output: numpy ndarray (N x lines, (size + 1)*maxCount + minCount of
+#    every line of every position)
+#
+#    Counts the tokens on every line of many positions in one product.
+#    Each max token counts size + 1 and each min token 1, so the product
+#    with the line matrix gives both counts of a line in one number.
+def lineCounts(positions, geometry=DEFAULT_GEOMETRY):
+    import numpy as np
+    size = geometry.size
+    boards = np.asarray(positions).reshape((-1, geometry.cells))
+    weights = np.where(boards > 0, size + 1, np.where(boards < 0, 1, 0)).astype(np.float32)
+    
+    return (weights @ geometry.lineMatrix.T).astype(np.intp)
+#end lineCounts
+
+# evaluateBatch(positions, geometry, evaluator, toMove)
+#    Input: positions (numpy ndarray, N x cells or N x size x ... x size,
+#    positive values are max tokens, negative values are min tokens)
+#    geometry (the Geometry of the positions, the cube by default)
+#    evaluator (the evaluator.Evaluator scoring the lines, or None for the
+#    hand-written weights)
+#    toMove (the player to move in every position, or None for the one
+#    whose turn it is if the player (min) moved first)
+#
+#    Output: numpy ndarray (the N heuristic scores, as State.h gives them)
+#    numpy ndarray (N flags, if the position is won or tied)
+#    numpy ndarray (the N winners, 1, -1 or 0 as State.isWin gives them)
+#
+#    Scores many positions in one vectorized pass. The counts of every
+#    line (see lineCounts) index the flattened line values, or the row of
+#    every line in the values of an evaluator.
+def evaluateBatch(positions, geometry=DEFAULT_GEOMETRY, evaluator=None, toMove=None):
+    import numpy as np
+    size = geometry.size
+    boards = np.asarray(positions).reshape((-1, geometry.cells))
+    counts = lineCounts(boards, geometry)
+    
+    if evaluator is None:
+        values = geometry.lineValueFlat[counts].sum(axis=1)
+    else:
+        if toMove is None:
+            toMove = np.where(np.count_nonzero(boards, axis=1) & 1, 1, -1)
+        #end if
+        values, tempo = splitTempo(evaluator.lineValueFlat[np.arange(counts.shape[1]), counts].sum(axis=1))
+        values = values + toMove * tempo
+    #end if/else
+    winners = np.where((counts == size * (size + 1)).any(axis=1), 1, np.where((counts == size).any(axis=1), -1, 0))
+    full = (boards != 0).all(axis=1)
+    
+    scores = np.where(winners != 0, winners * geometry.winScore, np.where(full, TIE_SCORE, values))
+    
+    return (scores, (winners != 0) | full, winners)
+#end evaluateBatch
+
+# Zobrist keys of the cube, one random 64-bit number per cell and player.
+# The hash of a state is the XOR of the keys of its tokens. Callers that
+# need to tell apart the same board with a different player to move XOR in
+# the zobristSide of the Geometry of the state.
+ZOBRIST_MAX = DEFAULT_GEOMETRY.zobristMax
+ZOBRIST_MIN = DEFAULT_GEOMETRY.zobristMin
+
+# boardHash(maxBoard, minBoard, geometry)
+#    Input: maxBoard, minBoard (the bitboards of the two players)
+#    geometry (their Geometry, the cube by default)
+#
+#    Output: integer (the Zobrist hash State.hash would have for them)
+#
+#    Hashes a pair of bitboards that is not held by a State.
+def boardHash(maxBoard, minBoard, geometry=DEFAULT_GEOMETRY):
+    result = 0
+    for board, keys in ((maxBoard, geometry.zobristMax), (minBoard, geometry.zobristMin)):
+        while board:
+            low = board & -board
+            result ^= keys[low.bit_length() - 1]
+            board ^= low
+        #end while
+    #end for
+    
+    return result
+#end boardHash
+
+# tokenValue(player)
+#    Input: player ('MAX'/'MIN' string, Token, or the integers 1/-1)
+#
+#    Output: integer (1 for the maximizing player, -1 for the minimizing player)
+#
+#    Normalizes the different ways callers name a player into the value
+#    stored in the board.
+def tokenValue(player):
+    if player.__class__ is int:
+        return 1 if player > 0 else -1
+    elif isinstance(player, Token):
+        return player.value
+    elif isinstance(player, str):
+        return 1 if player.upper() == 'MAX' else -1
+    #end if/elif
+    
+    return 1 if player > 0 else -1
+#end tokenValue
+
 # This class stores the internal state of the game being played.
+# The board is held as two 64-bit integers, one per player, where bit
+# cellIndex(x, y, z) is set if that player has a token on (x, y, z).
+# moveCount and winner are kept up to date by play so that isWin never
+# has to scan the board. maxCounts and minCounts hold the number of tokens
+# each player has on every line, and score is the running heuristic sum
+# of the values of all lines. lineValues holds the value table of every
+# line, LINE_VALUE for all of them unless the state is scored by a learned
+# evaluator.Evaluator, which packs a tempo for the player to move into them
+# (see TEMPO_SHIFT). toMove is the player to move, 1 for max and -1 for
+# min, the other player than the one who made the last move.
+# moveStack records every move made with
+# push (and play) so that pop can take it back. hash is the Zobrist hash of
+# the board, also kept up to date by push and pop. geometry holds the
+# tables of the board the state is on, the 4x4x4 cube unless another is
+# given. The fields are slots, so a State holds no per-instance dictionary.
 class State:
 
-    gameRepresentation = None
+    __slots__ = ('maxBoard', 'minBoard', 'moveCount', 'winner', 'maxCounts', 'minCounts',
+                 'score', 'moveStack', 'hash', 'geometry', 'lineValues', 'toMove')
     
-    # __init__(self)
+    # __init__(self, geometry, evaluator)
     #    Input: self (the object being instantiated)
+    #    geometry (the Geometry of the board, see getGeometry)
+    #    evaluator (the evaluator.Evaluator that scores the state, or None
+    #    for the hand-written heuristic)
     #
     #    Output: None (Side effect of instantiation)
     #
-    #    Initializes the State object with an array of values, initially 0,
-    #    0 meaning an empty board.
-    def __init__(self):
-        self.gameRepresentation = np.zeros(shape=(4,4,4), dtype=int)
+    #    Initializes the State object with two empty bitboards, meaning an
+    #    empty board.
+    def __init__(self, geometry=DEFAULT_GEOMETRY, evaluator=None):
+        self.geometry = geometry
+        self.lineValues = geometry.lineValues if evaluator is None else evaluator.valuesFor(geometry)
+        # The player (min) moves first.
+        self.toMove = -1
+        self.maxBoard = 0
+        self.minBoard = 0
+        self.moveCount = 0
+        self.winner = 0
+        self.maxCounts = [0] * len(geometry.lines)
+        self.minCounts = [0] * len(geometry.lines)
+        self.score = 0
+        self.moveStack = []
+        self.hash = 0
     # end __init__
     
     # h(self)
@@ -35,108 +676,168 @@ class State:
     #    represents the "goodness" of a particular state to a particular player.
     #    Negative values mean the minimizing player is in a better position,
     #    positive values mean the maximizing player is in a better position.
+    #    Won and tied states score WIN_SCORE and TIE_SCORE, any other state
+    #    scores the running sum of its lines kept by play, weighted by hand
+    #    or by the evaluator of the state. The tempo of an evaluator counts
+    #    for the player to move.
     def h(self):
-        win, winner = self.isWin()
         # Check if max wins, if min wins, or if tie.
-        if win and winner == 1:
-            return 100
-        elif win and winner == -1:
-            return -100
-        elif win and winner == 0:
+        if self.winner != 0:
+            return self.winner * self.geometry.winScore
+        elif self.moveCount == self.geometry.cells:
             #Heuristic is negative since the AI is maximizing.
-            return -20
+            return TIE_SCORE
         #end if/elif
         
-        # Create extension directions.
-        extensions = []
-        for x in range(2):
-            for y in range(2):
-                for z in range(2):
-                    # Extension [0,0,0] is invalid.
-                    if x != 0 or y != 0 or z != 0:
-                        extensions.append(np.array([x,y,z]))
-                    #end if
-                #end for
-            #end for
-        #end for
-        
-        # Produces all edge points. 
-        points = []
-        for x in range(4):
-            for y in range(4):
-                for z in range(4):
-                    if x == 0 or y == 0 or z == 0:
-                        points.append(np.array[x,y,z])
-                    #end if
-                #end for
-            #end for
-        #end for
-        
-        score = 0
-        
-        # Extend each point in each direction.
-        for point in points:
-            for direction in extensions:
-                prevVal = 0
-                count = 0
-                tempScore = 0
-                for num in range(4):
-                    value = self.gameRepresentation[point[0], point[1], point[2]]
-                    # No point 
-                    if value != 0:
-                        if prevVal == 0:
-                            prevVal = value
-                        #end if
-                        
-                        if prevVal == value:
-                            # We found another one in the line.
-                            # Pos for max, neg for min.
-                            # The more that are in a particular direction, the better.
-                            count += 1
-                            tempScore += value * (count + 1)
-                        else:
-                            # Line is blocked. Should not encourage moves like this.
-                            count = 0
-                        #end if/else
-                    #end if
-                    
-                    score += tempScore
-                    
-                    # We want to encourage points even if they are not directly
-                    # in a line. No case for value is 0 is necessary.
-                    
-                    point[0] += direction[0]
-                    point[1] += direction[1]
-                    point[2] += direction[2]
-                #end for
-            #end for
-        #end for
-        
-        return score
+        value, tempo = splitTempo(self.score)
+        return value + self.toMove * tempo
     # end h
     
+    # _countLines(self)
+    #    Input: self (the object)
+    #
+    #    Output: None (side effect of rebuilding the line counts and score)
+    #
+    #    Recounts every line from the bitboards, for states not built by play.
+    def _countLines(self):
+        lineValues = self.lineValues
+        self.score = 0
+        for line, mask in enumerate(self.geometry.lineMasks):
+            maxCount = (self.maxBoard & mask).bit_count()
+            minCount = (self.minBoard & mask).bit_count()
+            self.maxCounts[line] = maxCount
+            self.minCounts[line] = minCount
+            self.score += lineValues[line][maxCount][minCount]
+        #end for
+    #end _countLines
+    
     # play(self, x, y, z, player
     #    Input: self (the object)
     #    x (the x value in the array, 0 to 3)
     #    y (the y value in the array, 0 to 3)
     #    z (the z value in the array, 0 to 3)
-    #    player (a string, 'MAX' for maximizing player turn,
-    #    'MIN' for minimizing player)
+    #    player ('MAX'/'MIN', a Token, or 1/-1; see tokenValue)
     #
     #    Output: Boolean (Is move legal)
     #    (side effect of changing the game state)
     #    
-    #    Does the turn of the player mentioned. Places a number to act
-    #    as a token for the player in the game's representation array.
-    def play(self, x, y, z, player):
-        if self.gameRepresentation[x,y,z] == 0:
-            self.gameRepresentation[x, y, z] = 1 if player.upper() == 'MAX' else -1
-            return True
+    #    Does the turn of the player mentioned. Sets the bit of the cell in
+    #    the bitboard of that player. On a board other than the cube, give
+    #    one coordinate per dimension before the player. A cell off the
+    #    board is not legal and leaves the state as it was.
+    def play(self, *move):
+        if not self.geometry.onBoard(move[:-1]):
+            return False
         #end if
         
-        return False
+        return self.push(self.geometry.cellIndex(move[:-1]), move[-1])
     #end play
     
+    # push(self, move, player)
+    #    Input: self (the object)
+    #    move (the cell index of the move, see cellIndex)
+    #    player ('MAX'/'MIN', a Token, or 1/-1; see tokenValue)
+    #
+    #    Output: Boolean (Is move legal)
+    #    (side effect of changing the game state and the move stack)
+    #
+    #    Makes a move in place, updating the line counts, score and winner
+    #    through the new cell, and records it so that pop can undo it. A
+    #    taken cell or an index off the board is not legal and changes
+    #    nothing.
+    def push(self, move, player):
+        index = move
+        if not 0 <= index < self.geometry.cells:
+            return False
+        #end if
+        bit = 1 << index
+        if (self.maxBoard | self.minBoard) & bit:
+            return False
+        #end if
+        
+        value = tokenValue(player)
+        self.moveStack.append((index, value, self.score, self.winner))
+        
+        geometry = self.geometry
+        lineValues = self.lineValues
+        last = geometry.size - 1
+        maxCounts = self.maxCounts
+        minCounts = self.minCounts
+        score = self.score
+        if value == 1:
+            self.maxBoard |= bit
+            self.hash ^= geometry.zobristMax[index]
+            
+            # Only the lines through the new token change value or can win.
+            for line in geometry.cellLines[index]:
+                maxCount = maxCounts[line]
+                minCount = minCounts[line]
+                lineValue = lineValues[line]
+                score += lineValue[maxCount + 1][minCount] - lineValue[maxCount][minCount]
+                maxCounts[line] = maxCount + 1
+                if maxCount == last:
+                    self.winner = 1
+                #end if
+            #end for
+        else:
+            self.minBoard |= bit
+            self.hash ^= geometry.zobristMin[index]
+            
+            for line in geometry.cellLines[index]:
+                maxCount = maxCounts[line]
+                minCount = minCounts[line]
+                lineValue = lineValues[line]
+                score += lineValue[maxCount][minCount + 1] - lineValue[maxCount][minCount]
+                minCounts[line] = minCount + 1
+                if minCount == last:
+                    self.winner = -1
+                #end if
+            #end for
+        #end if/else
+        
+        self.score = score
+        self.moveCount += 1
+        self.toMove = -value
+        
+        return True
+    #end push
+    
+    
+    # pop(self)
+    #    Input: self (the object)
+    #
+    #    Output: integer (the cell index of the move taken back)
+    #    (side effect of changing the game state and the move stack)
+    #
+    #    Undoes the last move made with push. Raises IndexError if there is
+    #    no move to undo.
+    def pop(self):
+        index, value, score, winner = self.moveStack.pop()
+        bit = 1 << index
+        geometry = self.geometry
+        
+        if value == 1:
+            self.maxBoard &= ~bit
+            self.hash ^= geometry.zobristMax[index]
+            for line in geometry.cellLines[index]:
+                self.maxCounts[line] -= 1
+            #end for
+        else:
+            self.minBoard &= ~bit
+            self.hash ^= geometry.zobristMin[index]
+            for line in geometry.cellLines[index]:
+                self.minCounts[line] -= 1
+            #end for
+        #end if/else
+        
+        self.score = score
+        self.winner = winner
+        self.moveCount -= 1
+        self.toMove = value
+        
+        return index
+    #end pop
+    
     # isValid(self, x, y, z)
     #    Input: self (the object)
     #    x (the x value of the move)
@@ -146,35 +847,122 @@ class State:
     #    Output: Boolean (If move is valid)
     #
     #    Returns if a given move would cause an error without playing the move.
-    def isValid(self, x, y, z):
-        return self.gameRepresentation[x,y,z] == 0
+    #    On a board other than the cube, give one coordinate per dimension.
+    #    A cell off the board is not valid.
+    def isValid(self, *coords):
+        if not self.geometry.onBoard(coords):
+            return False
+        #end if
+        
+        return not (self.maxBoard | self.minBoard) & (1 << self.geometry.cellIndex(coords))
     
     # getState(self)
     #    Input: self (the object)
     #
-    #    Output: numpy ndarray, 4x4x4 (the game's internal representation)
+    #    Output: numpy ndarray, 4x4x4 (the game's representation as an array,
+    #    size per dimension on other boards)
     #
-    #    Returns the array that represents the current game's state.
+    #    Builds the 4x4x4 array view of the bitboards, 1 for max, -1 for min
+    #    and 0 for empty. The array is a copy; changing it does not change
+    #    the state.
     def getState(self):
-        return self.gameRepresentation
+        geometry = self.geometry
+        array = boardsToArray([self.maxBoard], [self.minBoard], geometry.cells)
+        return array.astype(int).reshape((geometry.size,) * geometry.dims)
     # end getState
     
     # setState(self, array)
     #    Input: self (the object)
-    #    array (numpy ndarray, 4x4x4)
+    #    array (numpy ndarray, 4x4x4, or size per dimension on other boards)
     #
     #    Output: None (side effect of changing the game state to array)
     #
-    #    Sets the value of the game's representation array to the array provided.
+    #    Sets the bitboards from the array provided. Positive values are max
+    #    tokens, negative values are min tokens.
     def setState(self, array):
-        if np.shape(array) == (4,4,4):
-            del self.gameRepresentation
-            self.gameRepresentation = array
+        import numpy as np
+        shape = (self.geometry.size,) * self.geometry.dims
+        if np.shape(array) == shape:
+            maxBoard = 0
+            minBoard = 0
+            for index, value in enumerate(np.ravel(array)):
+                if value > 0:
+                    maxBoard |= 1 << index
+                elif value < 0:
+                    minBoard |= 1 << index
+                #end if/elif
+            #end for
+            
+            self.setBoards(maxBoard, minBoard)
         else:
-            raise TypeError('Argument "array" is not 4x4x4 as expected')
+            raise TypeError('Argument "array" is not %s as expected' % 'x'.join(map(str, shape)))
         #end if/else
     #end setState
     
+    # setBoards(self, maxBoard, minBoard, toMove)
+    #    Input: self (the object)
+    #    maxBoard, minBoard (the bitboards of the two players)
+    #    toMove (the player to move, 1 or -1, or None for the one whose
+    #    turn it is if the player (min) moved first)
+    #
+    #    Output: None (side effect of changing the game state)
+    #
+    #    Sets the bitboards directly and rebuilds everything play keeps up
+    #    to date from them.
+    def setBoards(self, maxBoard, minBoard, toMove=None):
+        self.maxBoard = maxBoard
+        self.minBoard = minBoard
+        self.moveCount = (maxBoard | minBoard).bit_count()
+        if toMove is None:
+            toMove = 1 if self.moveCount & 1 else -1
+        #end if
+        self.toMove = toMove
+        self.hash = boardHash(maxBoard, minBoard, self.geometry)
+        
+        # The order the tokens were placed in is unknown, so nothing can be popped.
+        self.moveStack = []
+        
+        self._countLines()
+        
+        # The boards may hold a finished game, so check every line once.
+        size = self.geometry.size
+        self.winner = 0
+        for line in range(len(self.maxCounts)):
+            if self.maxCounts[line] == size:
+                self.winner = 1
+                break
+            elif self.minCounts[line] == size:
+                self.winner = -1
+                break
+            #end if/elif
+        #end for
+    #end setBoards
+    
+    # setEvaluator(self, evaluator)
+    #    Input: self (the object)
+    #    evaluator (the evaluator.Evaluator to score the state with, or None
+    #    for the hand-written heuristic)
+    #
+    #    Output: None (side effect of rescoring the state)
+    #
+    #    Switches the weights of the lines. The moves on the stack are
+    #    taken back and made again, so that pop restores scores of the new
+    #    weights too.
+    def setEvaluator(self, evaluator):
+        moves = []
+        while self.moveStack:
+            value = self.moveStack[-1][1]
+            moves.append((self.pop(), value))
+        #end while
+        
+        self.lineValues = self.geometry.lineValues if evaluator is None else evaluator.valuesFor(self.geometry)
+        self._countLines()
+        
+        for index, value in reversed(moves):
+            self.push(index, value)
+        #end for
+    #end setEvaluator
+    
     # copy(self)
     #    Input: self (the object)
     #
@@ -182,56 +970,79 @@ class State:
     #
     #    Provides a copy of the State object.
     def copy(self):
-        copy_state = State()
-        copy_state.setState(np.copy(self.getState()))
+        # The line counts are copied, so skip building empty ones.
+        copy_state = State.__new__(State)
+        copy_state.geometry = self.geometry
+        copy_state.lineValues = self.lineValues
+        copy_state.toMove = self.toMove
+        copy_state.maxBoard = self.maxBoard
+        copy_state.minBoard = self.minBoard
+        copy_state.moveCount = self.moveCount
+        copy_state.winner = self.winner
+        copy_state.maxCounts = self.maxCounts[:]
+        copy_state.minCounts = self.minCounts[:]
+        copy_state.score = self.score
+        copy_state.moveStack = self.moveStack[:]
+        copy_state.hash = self.hash
         return copy_state
     #end copy
     
-    # _potWins(self)
+    # symmetries(self)
     #    Input: self (the object)
     #
-    #    Output: List (list of all points that could include wins)
+    #    Output: List (indices into the symmetries of the Geometry, SYMMETRIES
+    #    on the cube, of the symmetries that leave the state unchanged)
     #
-    #    Returns all points with a 0 in some direction (all winning lines have a 0
-    #    in some direction, because they cross the board.
-    def _potWins(self):
-        # Main idea, to get a win, you need a 0 in some dimension.
-        # Loop over pairs of dimensions, 3(4^2) < 4^3
-        # Store all potential wins, see if they work by expanding in each direction.
-        
-        potWins = []
-        for y in range(3):
-            for z in range(3):
-                token = self.gameRepresentation[0, y, z]
-                array = np.array([0,y,z])
-                if token != 0 and array not in potWins:
-                    potWins.append((array,token))
-                #end if
-            #end for
+    #    Finds the stabilizer of the state. Moves that one of these
+    #    symmetries maps onto each other lead to equivalent states.
+    def symmetries(self):
+        stabilizer = []
+        for i, perm in enumerate(self.geometry.symmetries):
+            if transformBoard(self.maxBoard, perm) == self.maxBoard and \
+                    transformBoard(self.minBoard, perm) == self.minBoard:
+                stabilizer.append(i)
+            #end if
         #end for
         
-        for x in range(3):
-            for z in range(3):
-                token = self.gameRepresentation[x, 0, z]
-                array = np.array([x,0,z])
-                if token != 0 and array not in potWins:
-                    potWins.append((array,token))
-                #end if
-            #end for
-        #end for
-        
-        for x in range(3):
-            for y in range(3):
-                token = self.gameRepresentation[x, y, 0]
-                array = np.array([x,y,0])
-                if token != 0 and array not in potWins:
-                    potWins.append((array,token))
-                #end if
-            #end for
+        return stabilizer
+    #end symmetries
+    
+    # canonical(self)
+    #    Input: self (the object)
+    #
+    #    Output: Tuple (the smallest (maxBoard, minBoard) pair over all
+    #    symmetric copies of the state)
+    #    integer (index into the symmetries of a symmetry producing it)
+    #
+    #    Maps the state to one representative of its symmetry class, so that
+    #    caches can share results between symmetric states. A move m of this
+    #    state is the move symmetries[sym][m] of the canonical one.
+    def canonical(self):
+        symmetries = self.geometry.symmetries
+        best = (self.maxBoard, self.minBoard)
+        bestSym = 0
+        for i in range(1, len(symmetries)):
+            perm = symmetries[i]
+            boards = (transformBoard(self.maxBoard, perm), transformBoard(self.minBoard, perm))
+            if boards < best:
+                best = boards
+                bestSym = i
+            #end if
         #end for
         
-        return potWins
-    #end _potWins
+        return (best, bestSym)
+    #end canonical
+    
+    # canonicalHash(self)
+    #    Input: self (the object)
+    #
+    #    Output: integer (Zobrist hash of the canonical form of the state)
+    #
+    #    Symmetric states have the same canonical hash.
+    def canonicalHash(self):
+        (maxBoard, minBoard), sym = self.canonical()
+        return boardHash(maxBoard, minBoard, self.geometry)
+    #end canonicalHash
     
     # isWin(self)
     #    Input: self (the object)
@@ -239,73 +1050,19 @@ class State:
     #    Output: Boolean (if state is won)
     #    winner (1 if max player, -1 if min player, 0 if not won)
     #
-    #    Tests if a state is won, and returns the player that won.
+    #    Tests if a state is won, and returns the player that won. The winner
+    #    is found by play as moves are made, and a full board is a tie.
     def isWin(self):
-        potWins = self._potWins()
-        
-        # Create extension directions.
-        extensions = []
-        for x in range(2):
-            for y in range(2):
-                for z in range(2):
-                    # Extension [0,0,0] is invalid.
-                    if x != 0 or y != 0 or z != 0:
-                        extensions.append(np.array([x,y,z]))
-                    #end if
-                #end for
-            #end for
-        #end for
-        
-        # Extend each potential win in every plausible direction.
-        for potWin in potWins:
-            for direction in extensions:
-                point = potWin[0]
-                # Determines plausibility of a direction.
-                xUnfeas = point[0] > 0 and direction[0] > 0 
-                yUnfeas = point[1] > 0 and direction[1] > 0
-                zUnfeas = point[2] > 0 and direction[2] > 0
-                if not(xUnfeas or yUnfeas or zUnfeas):
-                    val = potWin[1]
-                    
-                    winFound = False
-                    for numFound in range(1,4):
-                        point = point + direction
-                        
-                        x = point[0]
-                        y = point[1]
-                        z = point[2]
-                        token = self.gameRepresentation[x,y,z]
-                        if token != val:
-                            break
-                        #end if
-                        
-                        if numFound == 3:
-                            winFound = True
-                        #end if
-                    #end for
-                    
-                    if winFound:
-                        # Return win + player who won
-                        return (True, val)
-                    #end if
-                #end if
-            #end for
-        #end for
-        
-        # Check for tie.
-        for matrix in self.gameRepresentation:
-            for row in matrix:
-                for value in row:
-                    if value == 0:
-                        # Return no win.
-                        return (False, 0)
-                    #end if
-                #end for
-            #end for
-        #end for
+        if self.winner != 0:
+            # Return win + player who won
+            return (True, self.winner)
+        elif self.moveCount == self.geometry.cells:
+            # Return tie.
+            return (True, 0)
+        #end if/elif
         
-        # Return tie.
-        return (True, 0)
+        # Return no win.
+        return (False, 0)
     #end isWin
     
 #end State
@@ -316,17 +1073,49 @@ class Game:
     aiPlayer = None
     gameState = None
     turn = None
+    ponderer = None
+    record = None
+    recordPath = None
     
-    # __init__(self, maxDepth)
+    # __init__(self, maxDepth, timeLimit, book, geometry, think, recordPath, evaluator, threatDepth,
+    #          solveEmpty)
     #    Input: self (the object being instantiated)
     #    maxDepth (the maximum depth that the AI is allowed to search through)
+    #    timeLimit (seconds the AI may think per move, None for no limit)
+    #    book (the opening book of the AI, or None)
+    #    geometry (the Geometry of the board, see getGeometry)
+    #    think (whether the AI ponders on the player's turn, see
+    #    ponder.Ponderer)
+    #    recordPath (file the game is appended to once it is over, see
+    #    records, or None)
+    #    evaluator (the evaluator.Evaluator of the AI, or None for the
+    #    hand-written heuristic)
+    #    threatDepth (forcing moves the AI's threat search looks ahead, see
+    #    threats.ThreatSearch, 0 for none)
+    #    solveEmpty (most empty cells at which the AI solves the game
+    #    exactly, see endgame.EndgameSolver, 0 for never)
     #
     #    Output: None (Side effect of instantiation)
     #
     #    Instantiates the Game object, which includes a State and Model object.
-    def __init__(self, maxDepth):
-        self.gameState = State()
-        self.aiPlayer = Model(maxDepth)
+    #    With threatDepth the AI plays a forced threat win as soon as it has
+    #    one, and with solveEmpty it solves the endgame exactly once few
+    #    enough cells are empty. The solver gets the timeLimit of every move
+    #    as well, and searches as usual if it runs out, so give a game that
+    #    solves endgames a time limit to keep the AI from stalling on a hard
+    #    position.
+    def __init__(self, maxDepth, timeLimit=None, book=None, geometry=DEFAULT_GEOMETRY, think=False,
+                 recordPath=None, evaluator=None, threatDepth=0, solveEmpty=0):
+        import model
+        import ponder
+        import records
+        
+        self.gameState = State(geometry)
+        self.aiPlayer = model.Model(maxDepth, timeLimit=timeLimit, book=book, threatDepth=threatDepth,
+                                    solveEmpty=solveEmpty, evaluator=evaluator)
+        self.ponderer = ponder.Ponderer(self.aiPlayer) if think else None
+        self.record = records.newRecord(geometry)
+        self.recordPath = recordPath
         
         self.turn = Turn.PLAYER
     #end __init__
@@ -337,15 +1126,26 @@ class Game:
     #    Output: None (Side effect of printing out who won)
     #
     #    Starts the game, ending when the game is finished and printing out who won.
+    #    Every move goes into the record of the game, the AI's with the
+    #    statistics of its search, and the record is written out at the end.
     def run(self):
+        import records
+        
         winTuple = self.gameState.isWin()
     
         while(not winTuple[0]):
             if self.turn == Turn.PLAYER:
+                if self.ponderer is not None:
+                    self.ponderer.start(self.gameState)
+                #end if
+                
                 # Temporary system of taking in a player's turn.
-                playerTurn = input("Input your turn. Do this in the format 'x, y, z'")
+                dims = self.gameState.geometry.dims
+                playerTurn = input("Input your turn. Do this in the format 'x, y, z'" if dims == 3 else
+                                   "Input your turn. Do this in the format of %d coordinates, e.g. '%s'"
+                                   % (dims, ', '.join('0' * dims)))
                 
-                turnVal = np.array([0,0,0])
+                turnVal = [0] * dims
                 count = 0
                 
                 for val in playerTurn.split(', '):
@@ -353,12 +1153,26 @@ class Game:
                     count += 1
                 #end for
                 
-                self.gameState.play(turnVal[0], turnVal[1], turnVal[2], Token.PLAYER)
+                if not self.gameState.play(*turnVal, Token.PLAYER):
+                    print('That cell is taken or off the board!')
+                    continue
+                #end if
+                records.addMove(self.record, self.gameState.geometry.cellIndex(turnVal))
+                
+                self.turn = Turn.AI
             else:
-                currState = self.gameState.getState()
-                turnVal = self.aiPlayer.alphaBetaSearch(currState)
+                nodes = self.aiPlayer.nodes
+                start = time.perf_counter()
+                if self.ponderer is not None:
+                    action = self.ponderer.search(self.gameState)
+                else:
+                    action = self.aiPlayer.alphaBetaSearch(self.gameState)
+                #end if/else
+                records.addMove(self.record, action, self.aiPlayer, time.perf_counter() - start,
+                                self.aiPlayer.nodes - nodes)
                 
-                self.gameState.play(turnVal[0], turnVal[1], turnVal[2], Token.AI)
+                self.gameState.push(action, Token.AI)
+                self.turn = Turn.PLAYER
             #end if/else
             
             # Temporary method of making the game state visible to the player.
@@ -367,51 +1181,112 @@ class Game:
             winTuple = self.gameState.isWin()
         #end while
         
-        winner = ''
-        if winTuple[1] == 1:
-            winner = 'Player'
-        else:
-            winner = 'AI'
-        #end if/else
+        if self.ponderer is not None:
+            self.ponderer.stop()
+        #end if
+        
+        self.record['winner'] = winTuple[1]
+        if self.recordPath is not None:
+            records.writeRecord(self.recordPath, self.record)
+        #end if
         
-        print(winner + 'has won!')
+        if winTuple[1] == Token.PLAYER.value:
+            print('Player has won!')
+        elif winTuple[1] == Token.AI.value:
+            print('AI has won!')
+        else:
+            print('It is a tie!')
+        #end if/elif/else
     #end run
 
 #end Game
 
-# actions(state)
+# actions(state, player)
 #    Input: state (Current game state)
+#    player (1 or -1 for the staged order, None for increasing order)
 #
-#    Output: List (List of actions possible in this state)
+#    Output: Generator (the cell indices of the actions possible in this
+#    state)
 #
-#    Outputs all possible playable moves in a given state.
-def actions(state):
-    actions = []
-    
-    for x in range(4):
-        for y in range(4):
-            for z in range(4):
-                if state.isValid(x,y,z):
-                    actions.append(np.array([x,y,z]))
-                #end if
-            #end for
-        #end for
-    #end for
+#    Streams all possible playable moves in a given state, straight from
+#    the bitmask of empty cells, so a caller that stops early never builds
+#    the whole list. In increasing order by default. Given the player to
+#    move, the cells that win on the spot come first, then the cells that
+#    block a win of the opponent, then the rest, each stage in increasing
+#    order. Each stage is only found once the one before it is used up.
+def actions(state, player=None):
+    empty = ~(state.maxBoard | state.minBoard) & state.geometry.fullMask
+    
+    if player is not None:
+        wins = winningCells(state, player)
+        yield from bitCells(wins)
+        
+        blocks = winningCells(state, -player) & ~wins
+        yield from bitCells(blocks)
+        
+        empty &= ~(wins | blocks)
+    #end if
     
-    return actions
+    yield from bitCells(empty)
 #end actions
 
-def result(state, action, player):
-    newState = state.copy()
-    
-    val = 0
-    if player.upper() == 'MAX':
-        val = 1
+# bitCells(board)
+#    Input: board (a bitboard)
+#
+#    Output: Generator (the cell index of every set bit, lowest first)
+def bitCells(board):
+    while board:
+        low = board & -board
+        yield low.bit_length() - 1
+        board ^= low
+    #end while
+#end bitCells
+
+# winningCells(state, player)
+#    Input: state (Current game state)
+#    player (1 for max, -1 for min)
+#
+#    Output: integer (bit mask of the empty cells where player wins on the
+#    spot)
+#
+#    Finds the open cell of every line where player has all tokens but one
+#    and the opponent none. Most states have no such line, which the scan
+#    of the counts for a line one token short finds out without a loop.
+def winningCells(state, player):
+    if player == 1:
+        own = state.maxCounts
+        other = state.minCounts
     else:
-        val = -1
+        own = state.minCounts
+        other = state.maxCounts
     #end if/else
+    last = state.geometry.size - 1
+    if last not in own:
+        return 0
+    #end if
     
-    newState.play(action[0], action[1], action[2], val)
+    cells = 0
+    for mask, ownCount, otherCount in zip(state.geometry.lineMasks, own, other):
+        if ownCount == last and otherCount == 0:
+            cells |= mask
+        #end if
+    #end for
+    
+    return cells & ~(state.maxBoard | state.minBoard)
+#end winningCells
+
+# result(state, action, player)
+#    Input: state (Current game state)
+#    action (the cell index of the move to make)
+#    player ('MAX'/'MIN', a Token, or 1/-1; see tokenValue)
+#
+#    Output: State (a new state with the move made)
+#
+#    Leaves state untouched. The search uses State.push/pop instead, which
+#    avoid allocating a state per node.
+def result(state, action, player):
+    newState = state.copy()
+    newState.push(action, player)
     
     return newState
 #end result
\ No newline at end of file
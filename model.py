@@ -1,44 +1,545 @@
-import numpy
+import json
+import time
 import game
+import threats
+import endgame
+
+# Flags of a transposition table entry. The stored value is exact, or a
+# lower/upper bound of the true value when the search was cut off.
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# Default number of slots in a Model's transposition table.
+DEFAULT_TABLE_SIZE = 1 << 18
+
+# Move ordering stages, see Model._orderMoves. Moves are sorted by the
+# stages in this order of priority.
+#    'tactics': moves that win on the spot, then moves that block a win.
+#    'killers': the last two moves that caused a cutoff at the same ply.
+#    'lines': cells on more lines still open to the player to move.
+#    'history': moves that caused many cutoffs anywhere in the search.
+# The stored transposition table or principal variation move always
+# goes first.
+ORDER_STAGES = ('tactics', 'killers', 'lines', 'history')
+
+# Named orderings that can be passed to Model.
+ORDERINGS = {
+    'raster': (),
+    'static': ('tactics', 'lines'),
+    'killers': ('tactics', 'killers', 'lines'),
+    'history': ('tactics', 'lines', 'history'),
+    'full': ORDER_STAGES,
+}
+
+# Score bonuses of the ordering stages, far enough apart that a higher
+# stage always wins over the ones below it. A cell is on at most 7 lines
+# of the cube, and fewer than 16 on the boards up to 4^4 and 5^3.
+ORDER_TABLE = 1 << 40
+ORDER_WIN = 1 << 36
+ORDER_BLOCK = 1 << 32
+ORDER_KILLER = 1 << 28
+ORDER_LINE = 1 << 20
+ORDER_HISTORY_MAX = ORDER_LINE - 1
+
+# Search algorithms that can be passed to Model.
+#    'alphabeta': maxSearch and minSearch with the full window at every node.
+#    'pvs': negamax with principal variation search, see Model.negamax, and
+#    aspiration windows at the root, see Model._rootSearch.
+SEARCHES = ('alphabeta', 'pvs')
+
+# Half width of the first aspiration window around the expected root value.
+# A line with two tokens is worth 4 and one with three 16.
+ASPIRATION_WINDOW = 8
+
+# Nodes searched between two checks of the clock when a time budget is set.
+BUDGET_CHECK_INTERVAL = 1024
+
+# Raised inside the search when its time or node budget runs out.
+class _BudgetExceeded(Exception):
+    pass
+#end _BudgetExceeded
+
+# Raised out of alphaBetaSearch when Model.stop is called while it runs.
+class SearchStopped(Exception):
+    pass
+#end SearchStopped
+
+# This class is a fixed-size transposition table. Each slot holds at most
+# one entry (key, depth, flag, value, move, age) for the position whose key
+# maps to it. On a collision the deeper entry wins, unless the stored one
+# was made by an earlier search, in which case it is always replaced.
+class TranspositionTable:
+    
+    size = 0
+    slots = None
+    age = 0
+    hits = 0
+    misses = 0
+    cutoffs = 0
+    stores = 0
+    
+    # __init__(self, size)
+    #    Input: self (the object being instantiated)
+    #    size (the maximum number of entries held)
+    #
+    #    Output: None (Side effect of instantiation)
+    #
+    #    Initializes an empty table with size slots.
+    def __init__(self, size):
+        self.size = size
+        self.slots = [None] * size
+        self.age = 0
+        self.resetCounters()
+    #end __init__
+    
+    # resetCounters(self)
+    #    Input: self (the object)
+    #
+    #    Output: None (side effect of zeroing the counters)
+    #
+    #    Zeroes the hit, miss, cutoff and store counters.
+    def resetCounters(self):
+        self.hits = 0
+        self.misses = 0
+        self.cutoffs = 0
+        self.stores = 0
+    #end resetCounters
+    
+    # counters(self)
+    #    Input: self (the object)
+    #
+    #    Output: Dictionary (counter name to value)
+    #
+    #    Returns the counters, along with how many slots are in use.
+    def counters(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'cutoffs': self.cutoffs,
+            'stores': self.stores,
+            'used': self.size - self.slots.count(None),
+        }
+    #end counters
+    
+    # peek(self, key)
+    #    Input: self (the object)
+    #    key (the hash of the position)
+    #
+    #    Output: Tuple (the entry stored for key, or None)
+    #
+    #    Looks up the entry of a position without counting a hit or miss.
+    def peek(self, key):
+        entry = self.slots[key % self.size]
+        if entry is not None and entry[0] == key:
+            return entry
+        #end if
+        
+        return None
+    #end peek
+    
+    # newSearch(self)
+    #    Input: self (the object)
+    #
+    #    Output: None (side effect of aging the stored entries)
+    #
+    #    Marks the entries stored so far as coming from an earlier search, so
+    #    that they are replaced first.
+    def newSearch(self):
+        self.age += 1
+    #end newSearch
+    
+    # probe(self, key)
+    #    Input: self (the object)
+    #    key (the hash of the position)
+    #
+    #    Output: Tuple (the entry stored for key, or None)
+    #
+    #    Looks up the entry of a position.
+    def probe(self, key):
+        entry = self.slots[key % self.size]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        #end if
+        
+        self.misses += 1
+        return None
+    #end probe
+    
+    # store(self, key, depth, flag, value, move)
+    #    Input: self (the object)
+    #    key (the hash of the position)
+    #    depth (the number of plies searched below the position)
+    #    flag (EXACT, LOWER or UPPER)
+    #    value (the value found by the search)
+    #    move (the cell index of the best move found)
+    #
+    #    Output: None (side effect of filling a slot)
+    #
+    #    Stores the result of searching a position, following the
+    #    replacement policy of the table.
+    def store(self, key, depth, flag, value, move):
+        slot = key % self.size
+        entry = self.slots[slot]
+        if entry is None or entry[0] == key or entry[5] != self.age or depth >= entry[1]:
+            self.slots[slot] = (key, depth, flag, value, move, self.age)
+            self.stores += 1
+        #end if
+    #end store
+    
+#end TranspositionTable
+
+# This class holds what one search did, for profiling. Nodes and the
+# transposition table counters are counted by the search itself, the rest
+# only while stats are collected, since the clock calls slow it down.
+# Work done by the worker processes of a parallel search is only counted
+# in nodes. pondered marks a move answered from a search made on the
+# player's time, see ponder.Ponderer.
+class SearchStats:
+    
+    move = None
+    value = 0
+    depth = 0
+    nodes = 0
+    nodesPerPly = None
+    leaves = 0
+    winChecks = 0
+    expanded = 0
+    generated = 0
+    cutoffs = 0
+    cutoffIndices = None
+    table = None
+    threatWins = 0
+    bookHit = False
+    solved = False
+    pondered = False
+    moveTime = 0.0
+    evalTime = 0.0
+    winTime = 0.0
+    totalTime = 0.0
+    
+    # __init__(self, cells)
+    #    Input: self (the object being instantiated)
+    #    cells (the number of cells of the board searched)
+    #
+    #    Output: None (Side effect of instantiation)
+    #
+    #    Initializes the counters of a search that has not started.
+    #    nodesPerPly[d] counts the states visited d plies below the root,
+    #    and cutoffIndices[i] the cutoffs caused by the i-th move searched.
+    def __init__(self, cells=64):
+        self.nodesPerPly = [0] * (cells + 1)
+        self.cutoffIndices = [0] * cells
+        self.table = {}
+    #end __init__
+    
+    # branchingFactor(self)
+    #    Input: self (the object)
+    #
+    #    Output: Float (moves generated per state expanded)
+    #
+    #    The average number of moves of the states the search expanded.
+    def branchingFactor(self):
+        return self.generated / self.expanded if self.expanded else 0.0
+    #end branchingFactor
+    
+    # effectiveBranchingFactor(self)
+    #    Input: self (the object)
+    #
+    #    Output: Float (the average growth of the nodes from ply to ply)
+    #
+    #    How many children of each state the pruned search really visited.
+    def effectiveBranchingFactor(self):
+        plies = [count for count in self.nodesPerPly if count > 0]
+        if len(plies) < 2:
+            return 0.0
+        #end if
+        
+        return (plies[-1] / plies[0]) ** (1.0 / (len(plies) - 1))
+    #end effectiveBranchingFactor
+    
+    # toDict(self)
+    #    Input: self (the object)
+    #
+    #    Output: Dictionary (the stats, as plain values for JSON)
+    #
+    #    Trailing zeroes of the per ply and per index counts are left out.
+    def toDict(self):
+        plies = list(self.nodesPerPly)
+        while plies and plies[-1] == 0:
+            plies.pop()
+        #end while
+        
+        indices = list(self.cutoffIndices)
+        while indices and indices[-1] == 0:
+            indices.pop()
+        #end while
+        
+        return {
+            'move': self.move,
+            'value': self.value,
+            'depth': self.depth,
+            'nodes': self.nodes,
+            'nodesPerPly': plies,
+            'leaves': self.leaves,
+            'winChecks': self.winChecks,
+            'expanded': self.expanded,
+            'branchingFactor': self.branchingFactor(),
+            'effectiveBranchingFactor': self.effectiveBranchingFactor(),
+            'cutoffs': self.cutoffs,
+            'cutoffIndices': indices,
+            'table': self.table,
+            'threatWins': self.threatWins,
+            'bookHit': self.bookHit,
+            'solved': self.solved,
+            'pondered': self.pondered,
+            'moveTime': self.moveTime,
+            'evalTime': self.evalTime,
+            'winTime': self.winTime,
+            'totalTime': self.totalTime,
+        }
+    #end toDict
+    
+    # toJSON(self)
+    #    Input: self (the object)
+    #
+    #    Output: String (the stats as one line of JSON)
+    def toJSON(self):
+        return json.dumps(self.toDict())
+    #end toJSON
+    
+#end SearchStats
 
 class Model:
     
     maxLayers = 0
+    nodes = 0
+    table = None
+    useSymmetry = True
+    canonicalDepth = 0
+    timeLimit = None
+    nodeLimit = None
+    completedDepth = 0
+    principalVariation = None
+    pvMoves = None
+    deadline = None
+    nodeEnd = None
+    checkAt = float('inf')
+    searchStart = 0
+    nodeStart = 0
+    ordering = ORDER_STAGES
+    stagedMoves = False
+    killers = None
+    history = None
+    workers = 1
+    pool = None
+    batchLeaves = False
+    book = None
+    bookHits = 0
+    value = 0
+    search = 'alphabeta'
+    researches = 0
+    threatSearch = None
+    threatLeaves = False
+    threatWins = 0
+    endgame = None
+    solveEmpty = 0
+    solves = 0
+    evaluator = None
+    stopped = False
+    collectStats = False
+    statsLog = None
+    stats = None
+    lastStats = None
     
     # __init__(self)
     #    Input: self (the object being instantiated)
     #    maxLayers (maximum depth of the tree)
+    #    tableSize (slots in the transposition table, 0 to search without one)
+    #    useSymmetry (whether to search only one of each set of symmetric moves)
+    #    canonicalDepth (plies left to search from which on states are kept in
+    #    the transposition table by their canonical form, see _tableKey, 0
+    #    to key every state on its own hash)
+    #    timeLimit (seconds each alphaBetaSearch may take, None for no limit)
+    #    nodeLimit (nodes each alphaBetaSearch may visit, None for no limit)
+    #    ordering (a name in ORDERINGS, or a tuple of ORDER_STAGES)
+    #    stagedMoves (whether to stream the moves of each state by stages,
+    #    see _stagedMoves, instead of ordering the whole list at once)
+    #    workers (processes searching root moves in parallel, 1 for serial)
+    #    batchLeaves (whether to score the children of frontier states in one
+    #    vectorized call, see _scoreChildren)
+    #    book (an opening book with a lookup(state) method, see book.py, or
+    #    None to always search)
+    #    search (a name in SEARCHES, the algorithm of the search)
+    #    threatDepth (forcing moves the threat search looks ahead, see
+    #    threats.ThreatSearch, 0 to search without it)
+    #    threatLeaves (whether the threat search also runs at the frontier)
+    #    solveEmpty (most empty cells at which the endgame solver takes over,
+    #    see endgame.EndgameSolver, 0 to always search to maxLayers)
+    #    evaluator (the evaluator.Evaluator scoring the leaves, or None for
+    #    the hand-written heuristic of State.h)
+    #    collectStats (whether every search collects a SearchStats)
+    #    statsLog (a file every search appends its stats to as a line of
+    #    JSON, None for no file; implies collectStats)
     #
     #    Output: None (Side effect of instantiation)
     #
     #    Initializes the Model object, with a maximum depth of alpha-beta pruning.
-    def __init__(self, maxLayers):
+    #    nodes counts the states visited by the search, for benchmarking.
+    #    The transposition table is kept between searches, so later moves of
+    #    a game reuse what earlier ones found. With a time or node limit the
+    #    search deepens iteratively up to maxLayers instead of searching to
+    #    maxLayers at once. value is the value of the root of the last search.
+    #    researches counts the PVS and aspiration windows that failed and
+    #    had to be searched again. The threat search runs at the root, and
+    #    with threatLeaves at the frontier too, where a forced win for the
+    #    player to move scores as a win. That finds wins far beyond
+    #    maxLayers but makes leaves several times slower. threatWins counts
+    #    the positions it won. With solveEmpty, positions with that many empty
+    #    cells or fewer are solved to the end of the game, and solves counts
+    #    them. The solved positions are kept between searches too. With an
+    #    evaluator, the search runs on a copy of the state scored by it.
+    #    useSymmetry only merges symmetric moves of a symmetric state;
+    #    symmetric states reached by different paths only share table
+    #    entries with canonicalDepth, which is off by default because
+    #    finding canonical forms costs more time than the nodes it saves.
+    #    stagedMoves is off by default too: in benchmark.py moves, streaming
+    #    the moves is slower per node than listing them, and what it saves
+    #    in a search differs from position to position and run to run.
+    def __init__(self, maxLayers, tableSize=DEFAULT_TABLE_SIZE, useSymmetry=True,
+                 timeLimit=None, nodeLimit=None, ordering='full', workers=1,
+                 batchLeaves=False, book=None, search='alphabeta', threatDepth=0,
+                 threatLeaves=False, solveEmpty=0, evaluator=None, collectStats=False, statsLog=None,
+                 canonicalDepth=0, stagedMoves=False):
         self.maxLayers = maxLayers
+        self.nodes = 0
+        self.table = TranspositionTable(tableSize) if tableSize > 0 else None
+        self.useSymmetry = useSymmetry
+        self.canonicalDepth = canonicalDepth
+        self.timeLimit = timeLimit
+        self.nodeLimit = nodeLimit
+        self.completedDepth = 0
+        self.principalVariation = []
+        self.pvMoves = {}
+        
+        self.ordering = ORDERINGS[ordering] if isinstance(ordering, str) else tuple(ordering)
+        for stage in self.ordering:
+            if stage not in ORDER_STAGES:
+                raise ValueError('Unknown move ordering stage "' + stage + '"')
+            #end if
+        #end for
+        self._resetOrdering()
+        self.stagedMoves = stagedMoves
+        
+        self.workers = workers
+        self.pool = None
+        self.batchLeaves = batchLeaves
+        self.book = book
+        self.bookHits = 0
+        self.value = 0
+        
+        if search not in SEARCHES:
+            raise ValueError('Unknown search "' + search + '"')
+        #end if
+        self.search = search
+        self.researches = 0
+        
+        self.threatSearch = threats.ThreatSearch(threatDepth) if threatDepth > 0 else None
+        self.threatLeaves = threatLeaves and self.threatSearch is not None
+        self.threatWins = 0
+        
+        self.endgame = endgame.EndgameSolver() if solveEmpty > 0 else None
+        self.solveEmpty = solveEmpty
+        self.solves = 0
+        
+        self.evaluator = evaluator
+        
+        self.collectStats = collectStats or statsLog is not None
+        self.statsLog = statsLog
+        self.stats = None
+        self.lastStats = None
     #end __init__
     
-    # maxSearch(self, state, alpha, beta, depth)
+    # close(self)
     #    Input: self (the object)
-    #    state (the current game state)
+    #
+    #    Output: None (side effect of stopping the worker processes)
+    #
+    #    Shuts down the process pool of a parallel Model, if one was started.
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        #end if
+    #end close
+    
+    # stop(self, stopped)
+    #    Input: self (the object)
+    #    stopped (True to stop, False to let searches run again)
+    #
+    #    Output: None (side effect of stopping the running search)
+    #
+    #    Called from another thread to stop a search running in a serial
+    #    Model. The search raises SearchStopped at its next budget check,
+    #    leaving the state it searched with moves still pushed, and so does
+    #    every search started until stop is called with False.
+    def stop(self, stopped=True):
+        self.stopped = stopped
+        if stopped:
+            self.checkAt = 0
+        #end if
+        if self.endgame is not None:
+            self.endgame.stop(stopped)
+        #end if
+    #end stop
+    
+    # maxSearch(self, state, alpha, beta, depth, stabilizer)
+    #    Input: self (the object)
+    #    state (the current game state, changed with push/pop and restored)
     #    alpha (the highest value seen in this path)
     #    beta (the lowest value seen in this path)
     #    depth (the current depth of the recursion)
+    #    stabilizer (indices of the symmetries fixing state, or None if only
+    #    the identity does)
     #
     #    Output: Float (the perceived value of this state)
     #    List (the list of actions to take after this state to get the best value)
     #
     #    Implements the search of the maximizing player in alpha-beta pruning.
-    def maxSearch(self, state, alpha, beta, depth):
-        if self.maxLayers == depth or state.isWin()[0]:
-            return (state.h(), [])
+    def maxSearch(self, state, alpha, beta, depth, stabilizer=None):
+        if self._enter(state, depth):
+            return (self._leafValue(state, 1), [])
+        #end if
+        
+        if self.batchLeaves and depth + 1 == self.maxLayers:
+            return self._scoreChildren(state, stabilizer, 1, depth)
+        #end if
+        
+        # The same board is a different node for each player to move.
+        key, sym = self._tableKey(state, 1, depth)
+        tableMove = None
+        if self.table is not None:
+            cut, tableMove = self._tableProbe(state, key, sym, alpha, beta, depth)
+            if cut is not None:
+                return cut
+            #end if
+        #end if
+        
+        # The previous iteration's principal variation is searched first.
+        if self.pvMoves:
+            tableMove = self.pvMoves.get(state.hash ^ state.geometry.zobristSide, tableMove)
         #end if
         
+        alphaStart = alpha
         utility = -float('inf')
-        maxAction = [0,0,0]
+        maxAction = None
         
-        for action in actions(state):
-            newState = result(state, action, 'max')
-            response = minSearch(newState, alpha, beta, depth+1)[0]
-            del newState
+        moves = self._generateMoves(state, tableMove, depth, 1)
+        for index, (action, childStabilizer) in enumerate(_distinctMoves(moves, stabilizer, state.geometry.symmetries)):
+            state.push(action, 1)
+            response = self.minSearch(state, alpha, beta, depth+1, childStabilizer)[0]
+            state.pop()
             
             if response > utility:
                 maxAction = action
@@ -46,37 +547,63 @@ class Model:
             #end if
             
             if utility >= beta:
-                return (utility, maxAction)
+                self._recordCutoff(action, depth, 1, index)
+                break
             #end if
             
             alpha = max(alpha, utility)
         #end for
         
+        self._tableStore(key, depth, utility, alphaStart, beta, _mapMove(state.geometry, sym, maxAction))
+        
         return (utility, maxAction)
     #end maxSearch
     
-    # minSearch(self, state, alpha, beta, depth)
+    # minSearch(self, state, alpha, beta, depth, stabilizer)
     #    Input: self (the object)
-    #    state (the current game state)
+    #    state (the current game state, changed with push/pop and restored)
     #    alpha (the highest value seen in this path)
     #    beta (the lowest value seen in this path)
     #    depth (the current depth of the recursion)
+    #    stabilizer (indices of the symmetries fixing state, or None if only
+    #    the identity does)
     #
     #    Output: Float (the perceived value of this state)
     #    List (the list of actions to take after this state to get the best value)
     #
     #    Implements the search of the minimizing player in alpha-beta pruning.
-    def minSearch(self, state, alpha, beta, depth):
-        if self.maxLayers == depth or state.isWin():
-            return (state.h(), [])
+    def minSearch(self, state, alpha, beta, depth, stabilizer=None):
+        if self._enter(state, depth):
+            return (self._leafValue(state, -1), [])
         #end if
         
-        utility = -float('inf')
-        minAction = [0,0,0]
+        if self.batchLeaves and depth + 1 == self.maxLayers:
+            return self._scoreChildren(state, stabilizer, -1, depth)
+        #end if
+        
+        key, sym = self._tableKey(state, -1, depth)
+        tableMove = None
+        if self.table is not None:
+            cut, tableMove = self._tableProbe(state, key, sym, alpha, beta, depth)
+            if cut is not None:
+                return cut
+            #end if
+        #end if
+        
+        # The previous iteration's principal variation is searched first.
+        if self.pvMoves:
+            tableMove = self.pvMoves.get(state.hash, tableMove)
+        #end if
         
-        for action in actions(state):
-            newState = result(state, action, 'min')
-            response = maxSearch(newState, alpha, beta, depth+1)[0]
+        betaStart = beta
+        utility = float('inf')
+        minAction = None
+        
+        moves = self._generateMoves(state, tableMove, depth, -1)
+        for index, (action, childStabilizer) in enumerate(_distinctMoves(moves, stabilizer, state.geometry.symmetries)):
+            state.push(action, -1)
+            response = self.maxSearch(state, alpha, beta, depth+1, childStabilizer)[0]
+            state.pop()
             
             if response < utility:
                 minAction = action
@@ -84,28 +611,1044 @@ class Model:
             #end if
             
             if utility <= alpha:
-                return (utility, minAction)
+                self._recordCutoff(action, depth, -1, index)
+                break
             #end if
             
             beta = min(beta, utility)
         #end for
         
+        self._tableStore(key, depth, utility, alpha, betaStart, _mapMove(state.geometry, sym, minAction))
+        
         return (utility, minAction)
     #end minSearch
     
-    # alphaBetaSearch(self, state)
+    # negamax(self, state, alpha, beta, depth, player, stabilizer)
+    #    Input: self (the object)
+    #    state (the current game state, changed with push/pop and restored)
+    #    alpha (the highest value the player to move is sure of)
+    #    beta (the lowest value the opponent is sure of)
+    #    depth (the current depth of the recursion)
+    #    player (1 if max is to move, -1 if min is)
+    #    stabilizer (indices of the symmetries fixing state, or None if only
+    #    the identity does)
+    #
+    #    Output: Float (the value of this state to the player to move)
+    #    List (the best action of the player to move)
+    #
+    #    Implements both players of alpha-beta pruning in one function, with
+    #    principal variation search. The first move is searched with the
+    #    full window. Every other move is only tested with a null window
+    #    (alpha, alpha + 1), which is cheap, and searched again with the
+    #    full window if the test finds it better. Values are integers, so
+    #    the null window is enough to tell. The table holds the same values
+    #    as maxSearch and minSearch store, from max's point of view.
+    def negamax(self, state, alpha, beta, depth, player, stabilizer=None):
+        if self._enter(state, depth):
+            return (player * self._leafValue(state, player), [])
+        #end if
+        
+        if self.batchLeaves and depth + 1 == self.maxLayers:
+            utility, action = self._scoreChildren(state, stabilizer, player, depth)
+            return (player * utility, action)
+        #end if
+        
+        # The window as maxSearch or minSearch would see it, for the table.
+        if player == 1:
+            maxAlpha, maxBeta = alpha, beta
+        else:
+            maxAlpha, maxBeta = -beta, -alpha
+        #end if/else
+        key, sym = self._tableKey(state, player, depth)
+        
+        tableMove = None
+        if self.table is not None:
+            cut, tableMove = self._tableProbe(state, key, sym, maxAlpha, maxBeta, depth)
+            if cut is not None:
+                return (player * cut[0], cut[1])
+            #end if
+        #end if
+        
+        if self.pvMoves:
+            pvKey = state.hash ^ state.geometry.zobristSide if player == 1 else state.hash
+            tableMove = self.pvMoves.get(pvKey, tableMove)
+        #end if
+        
+        utility = -float('inf')
+        bestAction = None
+        
+        moves = self._generateMoves(state, tableMove, depth, player)
+        for index, (action, childStabilizer) in enumerate(_distinctMoves(moves, stabilizer, state.geometry.symmetries)):
+            state.push(action, player)
+            if utility == -float('inf'):
+                response = -self.negamax(state, -beta, -alpha, depth+1, -player, childStabilizer)[0]
+            else:
+                response = -self.negamax(state, -alpha-1, -alpha, depth+1, -player, childStabilizer)[0]
+                if alpha < response < beta:
+                    self.researches += 1
+                    response = -self.negamax(state, -beta, -alpha, depth+1, -player, childStabilizer)[0]
+                #end if
+            #end if/else
+            state.pop()
+            
+            if response > utility:
+                bestAction = action
+                utility = response
+            #end if
+            
+            if utility >= beta:
+                self._recordCutoff(action, depth, player, index)
+                break
+            #end if
+            
+            alpha = max(alpha, utility)
+        #end for
+        
+        self._tableStore(key, depth, player * utility, maxAlpha, maxBeta, _mapMove(state.geometry, sym, bestAction))
+        
+        return (utility, bestAction)
+    #end negamax
+    
+    # _enter(self, state, depth)
+    #    Input: self (the object)
+    #    state (the state the search just reached)
+    #    depth (the current depth of the recursion)
+    #
+    #    Output: Boolean (if the state is a leaf: at the depth limit or with
+    #    the game over)
+    #
+    #    Counts a node, checks the budget when it is due, and tells the
+    #    search whether to score the state or expand it.
+    def _enter(self, state, depth):
+        self.nodes += 1
+        if self.nodes >= self.checkAt:
+            self._checkBudget()
+        #end if
+        
+        stats = self.stats
+        if stats is None:
+            return self.maxLayers == depth or state.isWin()[0]
+        #end if
+        
+        stats.nodesPerPly[depth] += 1
+        if self.maxLayers == depth:
+            return True
+        #end if
+        
+        start = time.perf_counter()
+        over = state.isWin()[0]
+        stats.winTime += time.perf_counter() - start
+        stats.winChecks += 1
+        
+        return over
+    #end _enter
+    
+    # _generateMoves(self, state, tableMove, depth, player)
+    #    Input: self (the object)
+    #    state (the state being expanded)
+    #    tableMove (cell index to search first, or None)
+    #    depth (the current depth of the recursion)
+    #    player (1 if max is to move, -1 if min is)
+    #
+    #    Output: Iterable (the moves of the state, best first)
+    #
+    #    Generates and orders the moves of a state the search expands. With
+    #    stagedMoves and the tactics stage the moves are streamed by
+    #    _stagedMoves, so a cutoff stops the generation. Stats need the
+    #    number of moves, so with stats the moves are listed.
+    def _generateMoves(self, state, tableMove, depth, player):
+        staged = self.stagedMoves and 'tactics' in self.ordering
+        stats = self.stats
+        if stats is None:
+            if staged:
+                return self._stagedMoves(state, tableMove, depth, player)
+            #end if
+            return self._orderMoves(state, list(game.actions(state)), tableMove, depth, player)
+        #end if
+        
+        start = time.perf_counter()
+        if staged:
+            moves = list(self._stagedMoves(state, tableMove, depth, player))
+        else:
+            moves = self._orderMoves(state, list(game.actions(state)), tableMove, depth, player)
+        #end if/else
+        stats.moveTime += time.perf_counter() - start
+        stats.expanded += 1
+        stats.generated += len(moves)
+        
+        return moves
+    #end _generateMoves
+    
+    # _stagedMoves(self, state, tableMove, depth, player)
+    #    Input: self (the object)
+    #    state (the state being expanded, the same whenever a move is asked
+    #    for)
+    #    tableMove (cell index to search first, or None)
+    #    depth (the current depth of the recursion)
+    #    player (1 if max is to move, -1 if min is)
+    #
+    #    Output: Generator (the moves, in the order _orderMoves gives them)
+    #
+    #    Streams the moves by the stages of game.actions. A win on the spot
+    #    is worth at least as much as any other move, so it is the only move
+    #    generated. Otherwise the stored move comes first, then the blocks
+    #    of the opponent's wins, then the rest, and each stage is sorted
+    #    only once the one before it is searched without a cutoff.
+    def _stagedMoves(self, state, tableMove, depth, player):
+        wins = game.winningCells(state, player)
+        if wins:
+            yield (wins & -wins).bit_length() - 1
+            return
+        #end if
+        
+        empty = ~(state.maxBoard | state.minBoard) & state.geometry.fullMask
+        if tableMove is not None and empty >> tableMove & 1:
+            yield tableMove
+            empty ^= 1 << tableMove
+        #end if
+        
+        blocks = game.winningCells(state, -player) & empty
+        if blocks:
+            yield from self._orderMoves(state, list(game.bitCells(blocks)), None, depth, player)
+            empty ^= blocks
+        #end if
+        
+        yield from self._orderMoves(state, list(game.bitCells(empty)), None, depth, player)
+    #end _stagedMoves
+    
+    # _rootSearch(self, state, stabilizer, guess)
+    #    Input: self (the object)
+    #    state (the root state, with max to move)
+    #    stabilizer (symmetries of the state, or None)
+    #    guess (the value the root is expected to have, or None)
+    #
+    #    Output: Tuple (the value of the state, the best move)
+    #
+    #    Searches the root with the algorithm of the Model. PVS starts with
+    #    an aspiration window of ASPIRATION_WINDOW around the guess, and
+    #    opens the side the value fell out of until the value is inside.
+    def _rootSearch(self, state, stabilizer, guess):
+        if self.search == 'alphabeta':
+            return self.maxSearch(state, -float('inf'), float('inf'), 0, stabilizer)
+        #end if
+        
+        if guess is None or abs(guess) >= state.geometry.winScore:
+            return self.negamax(state, -float('inf'), float('inf'), 0, 1, stabilizer)
+        #end if
+        
+        alpha = guess - ASPIRATION_WINDOW
+        beta = guess + ASPIRATION_WINDOW
+        while True:
+            utility, action = self.negamax(state, alpha, beta, 0, 1, stabilizer)
+            if utility <= alpha:
+                alpha = -float('inf')
+            elif utility >= beta:
+                beta = float('inf')
+            else:
+                return (utility, action)
+            #end if/elif/else
+            self.researches += 1
+        #end while
+    #end _rootSearch
+    
+    # _leafValue(self, state, player)
+    #    Input: self (the object)
+    #    state (a state at the depth limit, or a finished game)
+    #    player (1 if max is to move, -1 if min is)
+    #
+    #    Output: Integer (the value of the state)
+    #
+    #    Scores a leaf with the heuristic, or as a win for the player to move
+    #    if the threat search finds one for them.
+    def _leafValue(self, state, player):
+        stats = self.stats
+        if stats is not None:
+            stats.leaves += 1
+            start = time.perf_counter()
+        #end if
+        
+        if self.threatLeaves and state.winner == 0 and self.threatSearch.forcedWin(state, player) is not None:
+            self.threatWins += 1
+            value = player * state.geometry.winScore
+        else:
+            value = state.h()
+        #end if/else
+        
+        if stats is not None:
+            stats.evalTime += time.perf_counter() - start
+        #end if
+        return value
+    #end _leafValue
+    
+    # _scoreChildren(self, state, stabilizer, player, depth)
+    #    Input: self (the object)
+    #    state (a game state one move above the depth limit)
+    #    stabilizer (symmetries of the state, or None)
+    #    player (1 if max is to move, -1 if min is)
+    #    depth (the current depth of the recursion)
+    #
+    #    Output: Tuple (the value of the state, the best move)
+    #
+    #    Builds every child of the state as a row of an array and scores them
+    #    all with one game.evaluateBatch call, instead of pushing and scoring
+    #    the children one by one. Every child counts as a node, and the
+    #    budget is checked once they are counted, before they are scored.
+    #    The children are put in the order of _orderMoves, so ties go to the
+    #    move the serial search would have searched first.
+    def _scoreChildren(self, state, stabilizer, player, depth):
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+        #end if
+        
+        geometry = state.geometry
+        empty = ~(state.maxBoard | state.minBoard) & geometry.fullMask
+        cells = []
+        while empty:
+            low = empty & -empty
+            cells.append(low.bit_length() - 1)
+            empty ^= low
+        #end while
+        
+        if stabilizer is not None:
+            perms = [geometry.symmetries[sym] for sym in stabilizer]
+            cells = [cell for cell in cells if all(perm[cell] >= cell for perm in perms)]
+        #end if
+        
+        self.nodes += len(cells)
+        if self.nodes >= self.checkAt:
+            self._checkBudget()
+        #end if
+        cells = self._orderMoves(state, cells, None, depth, player)
+        
+        import numpy
+        positions = numpy.repeat(game.boardsToArray([state.maxBoard], [state.minBoard], geometry.cells), len(cells), axis=0)
+        positions[numpy.arange(len(cells)), cells] = player
+        scores = game.evaluateBatch(positions, geometry, self.evaluator, -player)[0]
+        
+        if stats is not None:
+            stats.evalTime += time.perf_counter() - start
+            stats.expanded += 1
+            stats.generated += len(cells)
+            stats.leaves += len(cells)
+            stats.nodesPerPly[self.maxLayers] += len(cells)
+        #end if
+        
+        best = int(numpy.argmax(scores)) if player == 1 else int(numpy.argmin(scores))
+        return (int(scores[best]), cells[best])
+    #end _scoreChildren
+    
+    # _tableKey(self, state, player, depth)
+    #    Input: self (the object)
+    #    state (the current game state)
+    #    player (1 if max is to move, -1 if min is)
+    #    depth (the current depth of the recursion)
+    #
+    #    Output: integer (the key of the state in the transposition table)
+    #    integer (index of the symmetry taking the state to the form its
+    #    entry is stored for, 0 for the state itself)
+    #
+    #    A state with canonicalDepth plies or more left to search is keyed
+    #    on its canonical form, so that symmetric states reached by
+    #    different paths share one entry, with the move of the entry stored
+    #    for the canonical form. Finding that form tries every symmetry of
+    #    the board, which costs far more than a node, so it only pays off
+    #    above large subtrees: see benchmark.py canonical.
+    def _tableKey(self, state, player, depth):
+        sym = 0
+        if self.canonicalDepth and self.maxLayers - depth >= self.canonicalDepth:
+            (maxBoard, minBoard), sym = state.canonical()
+            key = game.boardHash(maxBoard, minBoard, state.geometry)
+        else:
+            key = state.hash
+        #end if/else
+        
+        if player == 1:
+            key ^= state.geometry.zobristSide
+        #end if
+        
+        return (key, sym)
+    #end _tableKey
+    
+    # _tableProbe(self, state, key, sym, alpha, beta, depth)
+    #    Input: self (the object)
+    #    state (the current game state)
+    #    key, sym (the key of the state and its symmetry, see _tableKey)
+    #    alpha, beta (the search window of the state)
+    #    depth (the current depth of the recursion)
+    #
+    #    Output: Tuple (the value and move to return, or None to search on)
+    #    integer (the move stored for the state, or None)
+    #
+    #    Looks the state up, with the stored move mapped back onto it.
+    def _tableProbe(self, state, key, sym, alpha, beta, depth):
+        entry = self.table.probe(key)
+        if entry is None:
+            return (None, None)
+        #end if
+        
+        geometry = state.geometry
+        move = _mapMove(geometry, geometry.symmetryInverse[sym], entry[4])
+        cut = self._tableCut(entry, alpha, beta, depth)
+        if cut is not None:
+            return ((cut[0], move), move)
+        #end if
+        
+        return (None, move)
+    #end _tableProbe
+    
+    # _tableCut(self, entry, alpha, beta, depth)
+    #    Input: self (the object)
+    #    entry (the transposition table entry of the state)
+    #    alpha, beta (the search window of the state)
+    #    depth (the current depth of the recursion)
+    #
+    #    Output: Tuple (the value and move to return, or None to search on)
+    #
+    #    Uses a stored result when it was searched exactly as deep as needed
+    #    here and its value settles the window. Deeper results are not used,
+    #    so a search returns the same values whatever the table holds, which
+    #    the parallel search relies on to agree with the serial one.
+    def _tableCut(self, entry, alpha, beta, depth):
+        flag = entry[2]
+        value = entry[3]
+        if entry[1] == self.maxLayers - depth:
+            if flag == EXACT or (flag == LOWER and value >= beta) or (flag == UPPER and value <= alpha):
+                self.table.cutoffs += 1
+                return (value, entry[4])
+            #end if
+        #end if
+        
+        return None
+    #end _tableCut
+    
+    # _tableStore(self, key, depth, utility, alpha, beta, action)
+    #    Input: self (the object)
+    #    key (the hash of the state, including the player to move)
+    #    depth (the current depth of the recursion)
+    #    utility (the value found for the state)
+    #    alpha, beta (the search window the state was entered with)
+    #    action (the best move found, mapped like the key, see _tableKey)
+    #
+    #    Output: None (side effect of storing the result)
+    #
+    #    Stores a searched state with the bound its value represents. A value
+    #    at or outside the window only bounds the true value.
+    def _tableStore(self, key, depth, utility, alpha, beta, action):
+        if self.table is None:
+            return
+        #end if
+        
+        if utility <= alpha:
+            flag = UPPER
+        elif utility >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        #end if/elif/else
+        
+        self.table.store(key, self.maxLayers - depth, flag, utility, action)
+    #end _tableStore
+    
+    # _resetOrdering(self, cells)
+    #    Input: self (the object)
+    #    cells (the number of cells of the board searched next)
+    #
+    #    Output: None (side effect of clearing the killer and history tables)
+    #
+    #    Forgets the cutoffs of earlier searches.
+    def _resetOrdering(self, cells=64):
+        self.killers = [[None, None] for _ in range(cells + 1)]
+        self.history = {1: [0] * cells, -1: [0] * cells}
+    #end _resetOrdering
+    
+    # _orderMoves(self, state, moves, tableMove, depth, player)
     #    Input: self (the object)
     #    state (the current game state)
+    #    moves (list of moves from game.actions)
+    #    tableMove (cell index to search first, or None)
+    #    depth (the current depth of the recursion)
+    #    player (1 if max is to move, -1 if min is)
+    #
+    #    Output: List (the moves, best first)
+    #
+    #    Sorts the moves by the ordering stages of the Model. Moves that no
+    #    stage tells apart keep their raster order.
+    def _orderMoves(self, state, moves, tableMove, depth, player):
+        stages = self.ordering
+        if not stages:
+            if tableMove is None:
+                return moves
+            #end if
+            
+            # Only the stored move is moved forward.
+            if tableMove in moves:
+                moves.remove(tableMove)
+                moves.insert(0, tableMove)
+            #end if
+            return moves
+        #end if
+        
+        tactics = 'tactics' in stages
+        lines = 'lines' in stages
+        killers = self.killers[depth] if 'killers' in stages else ()
+        history = self.history[player] if 'history' in stages else None
+        
+        if player == 1:
+            own = state.maxCounts
+            other = state.minCounts
+        else:
+            own = state.minCounts
+            other = state.maxCounts
+        #end if/else
+        cellLines = state.geometry.cellLines
+        last = state.geometry.size - 1
+        
+        scores = []
+        for cell in moves:
+            if cell == tableMove:
+                scores.append(ORDER_TABLE)
+                continue
+            #end if
+            
+            score = 0
+            if tactics or lines:
+                for line in cellLines[cell]:
+                    if other[line] == 0:
+                        if own[line] == last and tactics:
+                            score += ORDER_WIN
+                        elif lines:
+                            score += ORDER_LINE
+                        #end if/elif
+                    elif own[line] == 0 and other[line] == last and tactics:
+                        score += ORDER_BLOCK
+                    #end if/elif
+                #end for
+            #end if
+            
+            if cell in killers:
+                score += ORDER_KILLER
+            #end if
+            
+            if history is not None:
+                score += history[cell]
+            #end if
+            
+            scores.append(score)
+        #end for
+        
+        order = sorted(range(len(moves)), key=scores.__getitem__, reverse=True)
+        return [moves[i] for i in order]
+    #end _orderMoves
+    
+    # _recordCutoff(self, action, depth, player, index)
+    #    Input: self (the object)
+    #    action (the move that caused a cutoff)
+    #    depth (the current depth of the recursion)
+    #    player (1 if max made the move, -1 if min did)
+    #    index (how many moves were searched before it)
+    #
+    #    Output: None (side effect of updating the killer and history tables)
+    #
+    #    Remembers a move that refuted the position it was played in. Cutoffs
+    #    nearer the root weigh more in the history table.
+    def _recordCutoff(self, action, depth, player, index=0):
+        if self.stats is not None:
+            self.stats.cutoffs += 1
+            self.stats.cutoffIndices[index] += 1
+        #end if
+        
+        cell = action
+        
+        killers = self.killers[depth]
+        if killers[0] != cell:
+            killers[1] = killers[0]
+            killers[0] = cell
+        #end if
+        
+        history = self.history[player]
+        remaining = self.maxLayers - depth
+        history[cell] = min(history[cell] + remaining * remaining, ORDER_HISTORY_MAX)
+    #end _recordCutoff
+    
+    # _checkBudget(self)
+    #    Input: self (the object)
     #
-    #    Output: Numpy Array (Best move to make)
+    #    Output: None (raises _BudgetExceeded when the budget is spent)
+    #
+    #    Called by the search every BUDGET_CHECK_INTERVAL nodes, or when the
+    #    node budget is reached, to stop the current iteration.
+    def _checkBudget(self):
+        if self.stopped:
+            raise SearchStopped()
+        #end if
+        
+        if self.nodeEnd is not None and self.nodes >= self.nodeEnd:
+            raise _BudgetExceeded()
+        #end if
+        
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise _BudgetExceeded()
+        #end if
+        
+        self.checkAt = self.nodes + BUDGET_CHECK_INTERVAL
+        if self.nodeEnd is not None:
+            self.checkAt = min(self.checkAt, self.nodeEnd)
+        #end if
+    #end _checkBudget
+    
+    # _collectVariation(self, state, action)
+    #    Input: self (the object)
+    #    state (the root state of the search)
+    #    action (the best move found at the root)
+    #
+    #    Output: List (cell indices of the principal variation)
+    #    (side effect of setting pvMoves)
+    #
+    #    Follows the best moves stored in the transposition table from the
+    #    root, recording the move to search first at each state on the way.
+    def _collectVariation(self, state, action):
+        move = action
+        player = 1
+        
+        variation = []
+        self.pvMoves = {}
+        while move is not None and len(variation) < self.maxLayers and not (state.maxBoard | state.minBoard) >> move & 1:
+            self.pvMoves[state.hash ^ state.geometry.zobristSide if player == 1 else state.hash] = move
+            variation.append(move)
+            state.push(move, player)
+            if state.isWin()[0] or self.table is None:
+                break
+            #end if
+            
+            player = -player
+            key, sym = self._tableKey(state, player, len(variation))
+            entry = self.table.peek(key)
+            move = None
+            if entry is not None:
+                move = _mapMove(state.geometry, state.geometry.symmetryInverse[sym], entry[4])
+            #end if
+        #end while
+        
+        for _ in variation:
+            state.pop()
+        #end for
+        
+        return variation
+    #end _collectVariation
+    
+    # _deepen(self, state, stabilizer, timeLimit, nodeLimit)
+    #    Input: self (the object)
+    #    state (the current game state)
+    #    stabilizer (symmetries of the state, or None)
+    #    timeLimit (seconds the search may take, or None)
+    #    nodeLimit (nodes the search may visit, or None)
+    #
+    #    Output: integer (cell index of the best move of the deepest
+    #    completed iteration)
+    #
+    #    Searches to depth 1, 2, ... up to maxLayers (or the number of empty
+    #    cells) until the budget runs out, ordering each iteration by the
+    #    principal variation of the one before. The first iteration always
+    #    completes so that there is a move to return.
+    def _deepen(self, state, stabilizer, timeLimit, nodeLimit):
+        maxLayers = self.maxLayers
+        rootLength = len(state.moveStack)
+        bestAction = None
+        guess = state.h()
+        self.pvMoves = {}
+        
+        try:
+            for depth in range(1, min(maxLayers, state.geometry.cells - state.moveCount) + 1):
+                self.maxLayers = depth
+                if depth == 2:
+                    # Arm the budget once there is a move to fall back on.
+                    if timeLimit is not None:
+                        self.deadline = self.searchStart + timeLimit
+                    #end if
+                    if nodeLimit is not None:
+                        self.nodeEnd = self.nodeStart + nodeLimit
+                    #end if
+                    self.checkAt = self.nodes
+                #end if
+                
+                try:
+                    utility, action = self._rootSearch(state, stabilizer, guess)
+                except _BudgetExceeded:
+                    while len(state.moveStack) > rootLength:
+                        state.pop()
+                    #end while
+                    break
+                #end try/except
+                
+                bestAction = action
+                guess = utility
+                self.value = utility
+                self.completedDepth = depth
+                self.principalVariation = self._collectVariation(state, action)
+                
+                # A won or lost position does not change with more depth.
+                if abs(utility) >= state.geometry.winScore:
+                    break
+                #end if
+            #end for
+        finally:
+            self.maxLayers = maxLayers
+            self.deadline = None
+            self.nodeEnd = None
+            self.checkAt = float('inf')
+            self.pvMoves = {}
+        #end try/finally
+        
+        return bestAction
+    #end _deepen
+    
+    # _parallelSearch(self, state, stabilizer)
+    #    Input: self (the object)
+    #    state (the current game state)
+    #    stabilizer (symmetries of the state, or None)
+    #
+    #    Output: Tuple (the value of the state, the best move)
+    #
+    #    Searches the root moves in the worker processes, Young Brothers Wait
+    #    style. The first move is searched alone to get a bound, then up to
+    #    workers moves are kept in flight, each one started with the best
+    #    value known when it is sent. A move is sent only after every move
+    #    before it, so the first move reaching the best value always returns
+    #    it exactly, and that is the move the serial search would pick.
+    def _parallelSearch(self, state, stabilizer):
+        from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        #end if
+        
+        tableMove = None
+        if self.table is not None:
+            key, sym = self._tableKey(state, 1, 0)
+            entry = self.table.peek(key)
+            if entry is not None:
+                tableMove = _mapMove(state.geometry, state.geometry.symmetryInverse[sym], entry[4])
+            #end if
+        #end if
+        
+        moves = self._orderMoves(state, list(game.actions(state)), tableMove, 0, 1)
+        rootMoves = list(_distinctMoves(moves, stabilizer, state.geometry.symmetries))
+        settings = (self.maxLayers, self.table.size if self.table is not None else 0,
+                    self.useSymmetry, self.ordering, self.search,
+                    self.threatSearch.maxThreats if self.threatLeaves else 0, self.threatLeaves,
+                    self.canonicalDepth, self.stagedMoves)
+        
+        utility = -float('inf')
+        bestIndex = None
+        pending = {}
+        nextIndex = 0
+        while nextIndex < len(rootMoves) or pending:
+            # The eldest brother goes alone, the rest fill the free workers.
+            limit = 1 if bestIndex is None else self.workers
+            while nextIndex < len(rootMoves) and len(pending) < limit:
+                action, childStabilizer = rootMoves[nextIndex]
+                future = self.pool.submit(_searchRootMove, settings, state, action, childStabilizer, utility)
+                pending[future] = (nextIndex, utility)
+                nextIndex += 1
+            #end while
+            
+            done = wait(pending, return_when=FIRST_COMPLETED)[0]
+            for future in done:
+                index, alpha = pending.pop(future)
+                value, nodes = future.result()
+                self.nodes += nodes
+                
+                # A value at or below the alpha it was sent with is only a bound.
+                if value > alpha and (value > utility or (value == utility and index < bestIndex)):
+                    utility = value
+                    bestIndex = index
+                #end if
+            #end for
+        #end while
+        
+        return (utility, rootMoves[bestIndex][0])
+    #end _parallelSearch
+    
+    # alphaBetaSearch(self, state, timeLimit, nodeLimit)
+    #    Input: self (the object)
+    #    state (the current game state)
+    #    timeLimit (seconds the search may take, defaults to the Model's)
+    #    nodeLimit (nodes the search may visit, defaults to the Model's)
+    #
+    #    Output: integer (cell index of the best move to make)
     #
     #    Calls the initial alpha-beta search and returns the optimal action.
     #    The optimal action is the one that puts the model in the best position,
-    #    given its heuristic evaluation of the state.
-    def alphaBetaSearch(self, state):
-        response = maxSearch(state, -float('inf'), float('inf'), 0)
+    #    given its heuristic evaluation of the state. Without a budget the
+    #    search goes straight to maxLayers, spread over the worker processes
+    #    if the Model has more than one. With a budget it deepens iteratively
+    #    and returns the best move of the last iteration that finished.
+    #    Positions in the opening book, searched to at least maxLayers when
+    #    it was built, are answered from the book without searching. A
+    #    forced win found by the threat search is played without searching.
+    #    With solveEmpty, an endgame is solved exactly instead, and the search
+    #    only runs if the solver runs out of time or nodes.
+    #    If the Model collects stats, they are left in lastStats.
+    def alphaBetaSearch(self, state, timeLimit=None, nodeLimit=None):
+        if self.collectStats:
+            return self.searchWithStats(state, timeLimit, nodeLimit)[0]
+        #end if
         
-        return response[1]
+        return self._search(state, timeLimit, nodeLimit)
     #end alphaBetaSearch
     
-#end Model
\ No newline at end of file
+    # searchWithStats(self, state, timeLimit, nodeLimit, record)
+    #    Input: self (the object)
+    #    state (the current game state)
+    #    timeLimit (seconds the search may take, defaults to the Model's)
+    #    nodeLimit (nodes the search may visit, defaults to the Model's)
+    #    record (whether the stats go to recordStats)
+    #
+    #    Output: Tuple (the cell index of the best move, the SearchStats of
+    #    the search)
+    #
+    #    Runs alphaBetaSearch while collecting stats, and records them with
+    #    recordStats unless told not to.
+    def searchWithStats(self, state, timeLimit=None, nodeLimit=None, record=True):
+        stats = SearchStats(state.geometry.cells)
+        nodes = self.nodes
+        threatWins = self.threatWins
+        bookHits = self.bookHits
+        solves = self.solves
+        table = self.table
+        if table is not None:
+            tableCounters = (table.hits, table.misses, table.cutoffs, table.stores)
+        #end if
+        
+        self.stats = stats
+        start = time.perf_counter()
+        try:
+            action = self._search(state, timeLimit, nodeLimit)
+        finally:
+            self.stats = None
+        #end try/finally
+        
+        stats.totalTime = time.perf_counter() - start
+        stats.move = action
+        stats.value = self.value
+        stats.depth = self.completedDepth
+        stats.nodes = self.nodes - nodes
+        stats.threatWins = self.threatWins - threatWins
+        stats.bookHit = self.bookHits > bookHits
+        stats.solved = self.solves > solves
+        if table is not None:
+            stats.table = {
+                'hits': table.hits - tableCounters[0],
+                'misses': table.misses - tableCounters[1],
+                'cutoffs': table.cutoffs - tableCounters[2],
+                'stores': table.stores - tableCounters[3],
+            }
+        #end if
+        
+        if record:
+            self.recordStats(stats)
+        #end if
+        
+        return (action, stats)
+    #end searchWithStats
+    
+    # recordStats(self, stats)
+    #    Input: self (the object)
+    #    stats (the SearchStats of the move just answered)
+    #
+    #    Output: None (side effect of setting lastStats and logging)
+    #
+    #    Leaves the stats in lastStats, and appends them as a line of JSON
+    #    to the statsLog file of the Model if it has one.
+    def recordStats(self, stats):
+        self.lastStats = stats
+        if self.statsLog is not None:
+            with open(self.statsLog, 'a') as log:
+                log.write(stats.toJSON() + '\n')
+            #end with
+        #end if
+    #end recordStats
+    
+    # _search(self, state, timeLimit, nodeLimit)
+    #    Input: self (the object)
+    #    state (the current game state)
+    #    timeLimit (seconds the search may take, or None for the Model's)
+    #    nodeLimit (nodes the search may visit, or None for the Model's)
+    #
+    #    Output: integer (cell index of the best move to make)
+    #
+    #    The search of alphaBetaSearch, with stats collected or not.
+    def _search(self, state, timeLimit, nodeLimit):
+        if self.stopped:
+            raise SearchStopped()
+        #end if
+        
+        if self.evaluator is not None and state.lineValues is not self.evaluator.valuesFor(state.geometry):
+            state = state.copy()
+            state.setEvaluator(self.evaluator)
+        #end if
+        
+        if self.book is not None:
+            entry = self.book.lookup(state)
+            if entry is not None and entry[2] >= self.maxLayers:
+                self.bookHits += 1
+                self.value = entry[1]
+                self.completedDepth = entry[2]
+                self.principalVariation = [entry[0]]
+                return entry[0]
+            #end if
+        #end if
+        
+        if self.threatSearch is not None:
+            line = self.threatSearch.forcedWin(state, 1)
+            if line is not None:
+                self.threatWins += 1
+                self.value = state.geometry.winScore
+                self.completedDepth = self.maxLayers
+                self.principalVariation = [line[0]]
+                return line[0]
+            #end if
+        #end if
+        
+        timeLimit = self.timeLimit if timeLimit is None else timeLimit
+        nodeLimit = self.nodeLimit if nodeLimit is None else nodeLimit
+        self.searchStart = time.perf_counter()
+        self.nodeStart = self.nodes
+        
+        empty = state.geometry.cells - state.moveCount
+        if self.endgame is not None and empty <= self.solveEmpty:
+            nodes = self.endgame.nodes
+            solution = self.endgame.solve(state, 1, timeLimit, nodeLimit)
+            self.nodes += self.endgame.nodes - nodes
+            if solution is not None:
+                self.solves += 1
+                self.value = solution[0]
+                self.completedDepth = empty
+                self.principalVariation = [solution[1]]
+                return solution[1]
+            #end if
+            if self.stopped:
+                raise SearchStopped()
+            #end if
+            # Out of budget. The limits of the search count from the start
+            # of this call, so it gets what is left of them.
+        #end if
+        
+        if self.table is not None:
+            self.table.newSearch()
+        #end if
+        self._resetOrdering(state.geometry.cells)
+        
+        stabilizer = None
+        if self.useSymmetry:
+            stabilizer = state.symmetries()
+            if len(stabilizer) == 1:
+                stabilizer = None
+            #end if
+        #end if
+        
+        if timeLimit is not None or nodeLimit is not None:
+            return self._deepen(state, stabilizer, timeLimit, nodeLimit)
+        #end if
+        
+        if self.workers > 1:
+            response = self._parallelSearch(state, stabilizer)
+        else:
+            response = self._rootSearch(state, stabilizer, state.h())
+        #end if/else
+        self.value = response[0]
+        self.completedDepth = self.maxLayers
+        self.principalVariation = self._collectVariation(state, response[1])
+        
+        return response[1]
+    #end _search
+    
+#end Model
+
+# _distinctMoves(moves, stabilizer, symmetries)
+#    Input: moves (list of moves from game.actions)
+#    stabilizer (indices of the symmetries fixing the state, or None)
+#    symmetries (the symmetries of the Geometry of the state)
+#
+#    Output: Generator (pairs of a move and the stabilizer of the state
+#    after it, None once only the identity is left)
+#
+#    Skips every move that a symmetry of the state maps onto a smaller cell
+#    index, since it leads to a state equivalent to the one after that move.
+#    In the opening this leaves a handful of moves out of 64.
+def _distinctMoves(moves, stabilizer, symmetries):
+    if stabilizer is None:
+        for move in moves:
+            yield (move, None)
+        #end for
+        return
+    #end if
+    
+    perms = [symmetries[sym] for sym in stabilizer]
+    for move in moves:
+        index = move
+        if all(perm[index] >= index for perm in perms):
+            childStabilizer = [sym for sym, perm in zip(stabilizer, perms) if perm[index] == index]
+            yield (move, childStabilizer if len(childStabilizer) > 1 else None)
+        #end if
+    #end for
+#end _distinctMoves
+
+# Models of a worker process, one per search setting, kept between tasks
+# so that their transposition tables are reused.
+_workerModels = {}
+
+# _mapMove(geometry, sym, move)
+#    Input: geometry (the Geometry of the board)
+#    sym (index of one of its symmetries)
+#    move (a cell index, or None)
+#
+#    Output: integer (the cell the symmetry takes the move to, the move
+#    itself for the identity or no move)
+def _mapMove(geometry, sym, move):
+    if sym == 0 or move is None:
+        return move
+    #end if
+    
+    return geometry.symmetries[sym][move]
+#end _mapMove
+
+# _searchRootMove(settings, state, action, stabilizer, alpha)
+#    Input: settings (maxLayers, tableSize, useSymmetry, ordering, search,
+#    threatDepth, threatLeaves, canonicalDepth and stagedMoves of the parent
+#    Model)
+#    state (the root state)
+#    action (the root move to search)
+#    stabilizer (symmetries of the state after the move, or None)
+#    alpha (the best value the parent knows so far)
+#
+#    Output: Tuple (the value of the move, nodes searched)
+#
+#    Runs in a worker process of Model._parallelSearch. Searches the state
+#    after one root move with the window (alpha, inf).
+def _searchRootMove(settings, state, action, stabilizer, alpha):
+    searcher = _workerModels.get(settings)
+    if searcher is None:
+        (maxLayers, tableSize, useSymmetry, ordering, search, threatDepth, threatLeaves, canonicalDepth,
+         stagedMoves) = settings
+        searcher = Model(maxLayers, tableSize, useSymmetry, ordering=ordering, search=search,
+                         threatDepth=threatDepth, threatLeaves=threatLeaves, canonicalDepth=canonicalDepth,
+                         stagedMoves=stagedMoves)
+        _workerModels[settings] = searcher
+    #end if
+    
+    if searcher.table is not None:
+        searcher.table.newSearch()
+    #end if
+    searcher._resetOrdering(state.geometry.cells)
+    
+    nodes = searcher.nodes
+    state.push(action, 1)
+    if searcher.search == 'pvs':
+        value = -searcher.negamax(state, -float('inf'), -alpha, 1, -1, stabilizer)[0]
+    else:
+        value = searcher.minSearch(state, alpha, float('inf'), 1, stabilizer)[0]
+    #end if/else
+    
+    return (value, searcher.nodes - nodes)
+#end _searchRootMove
\ No newline at end of file
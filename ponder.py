@@ -0,0 +1,168 @@
+import copy
+import threading
+import game
+import model
+import threats
+
+# This class lets a Model think on the player's time. While the player
+# decides on a move, a background thread predicts the player's likely
+# replies and searches the position after each one, most likely first, as
+# the AI would on its turn. Waiting on input() releases the interpreter
+# lock, so the thread runs at full speed. When the player's move arrives
+# the thread is stopped. If that move was searched to the end, its answer
+# is played at once. Otherwise the search starts from a transposition table
+# already filled with the pondered subtrees, which share most of their
+# positions with it.
+class Ponderer:
+
+    searcher = None
+    thread = None
+    results = None
+    pondered = 0
+    hits = 0
+    misses = 0
+
+    # __init__(self, searcher)
+    #    Input: self (the object being instantiated)
+    #    searcher (the serial Model of the AI)
+    #
+    #    Output: None (Side effect of instantiation)
+    #
+    #    Initializes the ponderer with nothing searched. pondered counts the
+    #    replies searched to the end, and hits and misses the AI moves that
+    #    were and were not among them.
+    def __init__(self, searcher):
+        self.searcher = searcher
+        self.thread = None
+        self.results = {}
+        self.pondered = 0
+        self.hits = 0
+        self.misses = 0
+    #end __init__
+
+    # start(self, state)
+    #    Input: self (the object)
+    #    state (the game state, with the player (min) to move; copied)
+    #
+    #    Output: None (side effect of starting the background search)
+    #
+    #    Starts pondering on a position, forgetting what was pondered on an
+    #    earlier one.
+    def start(self, state):
+        self.stop()
+        self.results = {}
+        if state.isWin()[0]:
+            return
+        #end if
+
+        self.thread = threading.Thread(target=self._ponder, args=(state.copy(),), daemon=True)
+        self.thread.start()
+    #end start
+
+    # stop(self)
+    #    Input: self (the object)
+    #
+    #    Output: None (side effect of stopping the background search)
+    #
+    #    Stops pondering and waits for the thread to finish, so that the
+    #    Model can be used again.
+    def stop(self):
+        if self.thread is None:
+            return
+        #end if
+
+        self.searcher.stop()
+        self.thread.join()
+        self.thread = None
+        self.searcher.stop(False)
+    #end stop
+
+    # search(self, state)
+    #    Input: self (the object)
+    #    state (the game state, with the AI (max) to move)
+    #
+    #    Output: integer (cell index of the best move to make)
+    #
+    #    Stops pondering and answers the state, from the pondered results
+    #    if the player's move was searched, or with Model.alphaBetaSearch.
+    #    Either way value, completedDepth and principalVariation of the
+    #    Model describe the answer, and so do its lastStats if it collects
+    #    them, marked as pondered on a hit.
+    def search(self, state):
+        self.stop()
+
+        result = self.results.get((state.maxBoard, state.minBoard))
+        if result is None:
+            self.misses += 1
+            return self.searcher.alphaBetaSearch(state)
+        #end if
+
+        self.hits += 1
+        move, self.searcher.value, self.searcher.completedDepth, variation, stats = result
+        self.searcher.principalVariation = list(variation)
+        if stats is not None:
+            stats = copy.copy(stats)
+            stats.pondered = True
+            self.searcher.recordStats(stats)
+        #end if
+        return move
+    #end search
+
+    # _ponder(self, state)
+    #    Input: self (the object)
+    #    state (a copy of the game state, with the player to move)
+    #
+    #    Output: None (side effect of filling results)
+    #
+    #    Runs in the background thread. Searches the position after every
+    #    predicted reply until all are done or the search is stopped. The
+    #    stats of these searches are kept with their results, and only
+    #    recorded for the reply the player really makes.
+    def _ponder(self, state):
+        searcher = self.searcher
+        try:
+            for reply in predictReplies(state):
+                state.push(reply, -1)
+                if not state.isWin()[0]:
+                    stats = None
+                    if searcher.collectStats:
+                        move, stats = searcher.searchWithStats(state, record=False)
+                    else:
+                        move = searcher.alphaBetaSearch(state)
+                    #end if/else
+                    self.results[(state.maxBoard, state.minBoard)] = (move, searcher.value, searcher.completedDepth,
+                                                                      list(searcher.principalVariation), stats)
+                    self.pondered += 1
+                #end if
+                state.pop()
+            #end for
+        except model.SearchStopped:
+            pass
+        #end try/except
+    #end _ponder
+
+#end Ponderer
+
+# predictReplies(state)
+#    Input: state (the game state, with the player (min) to move)
+#
+#    Output: List (the cell indices of the player's moves, most likely first)
+#
+#    Guesses what the player will play. A player who can win does, and one
+#    facing a threat blocks it. Otherwise the moves leaving the lowest
+#    heuristic value, the best ones for min, come first. Ties go to the
+#    lowest cell.
+def predictReplies(state):
+    wins = threats.threatCells(state, -1)
+    blocks = threats.threatCells(state, 1)
+
+    scores = {}
+    for cell in game.actions(state):
+        state.push(cell, -1)
+        scores[cell] = state.h()
+        state.pop()
+    #end for
+
+    forced = set(wins) | set(blocks)
+    return sorted(scores, key=lambda cell: (cell not in wins, cell not in forced, scores[cell], cell))
+#end predictReplies
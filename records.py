@@ -0,0 +1,313 @@
+import argparse
+import json
+import os
+import game
+import model
+import tournament
+
+# Default file the games played in run.py are recorded to with --record, in
+# the working directory rather than next to the code, which may not be
+# writable.
+RECORD_PATH = 'games.jsonl'
+
+# A record file holds one game per line of JSON:
+#    {"size": 4, "dims": 3, "winner": 1, "moves": [{"cell": 21}, ...]}
+# size and dims give the geometry of the board (see game.getGeometry), and
+# winner is 1 if max won, -1 if min won and 0 for a tie, which a replay
+# works out from the moves again. The moves are in the order they were
+# played, min moving first, and each holds the cell index of the move. A
+# searched move also holds the seconds and nodes it took, the depth its
+# search completed and the value it found for max. The records of
+# tournament.py follow the same move layout, so they can be replayed as
+# well, on the default board.
+
+# Most plies from the start of a game that are mined for book candidates.
+DEFAULT_BOOK_PLIES = 3
+
+# Games in flight per worker process when replaying a file, so that a file
+# of any size is read no faster than it is analyzed.
+GAMES_PER_WORKER = 4
+
+# newRecord(geometry)
+#    Input: geometry (the Geometry of the board)
+#
+#    Output: Dictionary (the record of a game with no moves yet)
+def newRecord(geometry):
+    return {'size': geometry.size, 'dims': geometry.dims, 'winner': None, 'moves': []}
+#end newRecord
+
+# addMove(record, cell, searcher, seconds, nodes)
+#    Input: record (the record of the game)
+#    cell (the cell index of the move)
+#    searcher (the Model that searched the move, or None for a player's
+#    move)
+#    seconds (seconds the search took)
+#    nodes (nodes the search visited)
+#
+#    Output: None (side effect of adding the move to the record)
+def addMove(record, cell, searcher=None, seconds=None, nodes=None):
+    move = {'cell': int(cell)}
+    if searcher is not None:
+        move['seconds'] = seconds
+        move['nodes'] = nodes
+        move['depth'] = searcher.completedDepth
+        move['value'] = searcher.value
+    #end if
+    record['moves'].append(move)
+#end addMove
+
+# writeRecord(path, record)
+#    Input: path (the record file)
+#    record (the record of a finished game)
+#
+#    Output: None (side effect of appending the record to the file)
+def writeRecord(path, record):
+    with open(path, 'a') as log:
+        log.write(json.dumps(record, separators=(',', ':')) + '\n')
+    #end with
+#end writeRecord
+
+# readRecords(path)
+#    Input: path (the record file)
+#
+#    Output: Generator (the records of the file, one at a time)
+#
+#    Reads the file a line at a time, so only one record is held at once.
+#    Blank lines are skipped.
+def readRecords(path):
+    with open(path) as log:
+        for line in log:
+            if line.strip():
+                yield json.loads(line)
+            #end if
+        #end for
+    #end with
+#end readRecords
+
+# recordGeometry(record)
+#    Input: record (the record of a game)
+#
+#    Output: Geometry (the board of the game, the default one for records
+#    that do not give it)
+def recordGeometry(record):
+    return game.getGeometry(record.get('size', game.DEFAULT_SIZE), record.get('dims', game.DEFAULT_DIMS))
+#end recordGeometry
+
+# positions(record)
+#    Input: record (the record of a game)
+#
+#    Output: Generator (for every move, the state before it, the player
+#    making it and the move from the record)
+#
+#    Replays the game on one State. The state is only valid until the next
+#    position is asked for.
+def positions(record):
+    state = game.State(recordGeometry(record))
+    player = -1
+    for move in record['moves']:
+        yield (state, player, move)
+        state.push(move['cell'], player)
+        player = -player
+    #end for
+#end positions
+
+# Models of a worker process, keyed by depth.
+_workerModels = {}
+
+# _workerModel(depth)
+#    Input: depth (the depth the Model searches to)
+#
+#    Output: Model (the Model of this worker process for the depth)
+def _workerModel(depth):
+    searcher = _workerModels.get(depth)
+    if searcher is None:
+        searcher = model.Model(depth)
+        _workerModels[depth] = searcher
+    #end if
+
+    return searcher
+#end _workerModel
+
+# outcome(value, winScore)
+#    Input: value (a search value)
+#    winScore (the win score of the board)
+#
+#    Output: integer (1 if the value is a win, -1 if it is a loss, 0 if
+#    the game is still open)
+def outcome(value, winScore):
+    if value >= winScore:
+        return 1
+    elif value <= -winScore:
+        return -1
+    #end if/elif
+
+    return 0
+#end outcome
+
+# analyzeGame(record, depth, plies)
+#    Input: record (the record of a game)
+#    depth (the depth every position is searched to, at least 2)
+#    plies (the most plies from the start mined for book candidates)
+#
+#    Output: Dictionary (the blunders of the game, its opening positions
+#    with max to move, and its winner: 1 for max, -1 for min, 0 for none)
+#
+#    Runs in a worker process of analyze. Every position is searched for
+#    the side to move, and the move played is searched one ply shallower
+#    from the other side. A move is a blunder when it turns a position
+#    the search wins into one it does not, or one it does not lose into a
+#    loss. The values are for the side moving, the same way round as
+#    tournament.chooseMove searches them.
+def analyzeGame(record, depth, plies=DEFAULT_BOOK_PLIES):
+    searcher = _workerModel(depth)
+    replier = _workerModel(depth - 1)
+
+    blunders = []
+    openings = []
+    for ply, (state, player, move) in enumerate(positions(record)):
+        cell = move['cell']
+        if ply < plies and player == 1:
+            openings.append(state.canonical()[0])
+        #end if
+
+        best = tournament.chooseMove(searcher, state, player)
+        bestValue = searcher.value
+        if cell == best:
+            continue
+        #end if
+
+        state.push(cell, player)
+        if state.isWin()[0]:
+            playedValue = state.h() * player
+        else:
+            tournament.chooseMove(replier, state, -player)
+            playedValue = -replier.value
+        #end if/else
+        state.pop()
+
+        winScore = state.geometry.winScore
+        if outcome(playedValue, winScore) < outcome(bestValue, winScore):
+            blunders.append({'ply': ply, 'player': player, 'cell': cell, 'best': best,
+                             'playedValue': playedValue, 'bestValue': bestValue})
+        #end if
+    #end for
+
+    # The state holds the whole game once the replay is done.
+    winner = state.isWin()[1] if record['moves'] else 0
+
+    return {'blunders': blunders, 'openings': openings, 'winner': winner}
+#end analyzeGame
+
+# _collect(done, pending, summary, tally, log)
+#    Input: done (the finished futures of analyzeGame)
+#    pending (the futures in flight, mapped to their game index and number
+#    of moves)
+#    summary (the counts of analyze)
+#    tally (the canonical openings, mapped to how often they were reached
+#    and the points max scored from them)
+#    log (the open blunder file, or None)
+#
+#    Output: None (side effect of taking the results into the summary)
+def _collect(done, pending, summary, tally, log):
+    for future in done:
+        index, moves = pending.pop(future)
+        result = future.result()
+        summary['games'] += 1
+        summary['moves'] += moves
+        summary['blunders'] += len(result['blunders'])
+
+        if log is not None:
+            for blunder in result['blunders']:
+                blunder['game'] = index
+                log.write(json.dumps(blunder) + '\n')
+            #end for
+        #end if
+
+        points = (result['winner'] + 1) / 2
+        for boards in result['openings']:
+            count, total = tally.get(boards, (0, 0.0))
+            tally[boards] = (count + 1, total + points)
+        #end for
+    #end for
+#end _collect
+
+# analyze(path, depth, out, plies, workers)
+#    Input: path (the record file)
+#    depth (the depth every position is searched to, at least 2)
+#    out (file the blunders are streamed to as lines of JSON, or None)
+#    plies (the most plies from the start mined for book candidates)
+#    workers (number of worker processes, None for one per CPU)
+#
+#    Output: Dictionary (the games and moves analyzed, the number of
+#    blunders, and the book candidates: the canonical (maxBoard, minBoard)
+#    openings with max to move, with how often they were reached and the
+#    score of max from them, most frequent first)
+#
+#    Replays every game of the file over a pool of worker processes. The
+#    file is read as the games are analyzed, with a few games per worker in
+#    flight, and the blunders are written out as they are found, so memory
+#    does not grow with the size of the file. Only the tally of the
+#    openings is kept, which is bounded by the positions of the first
+#    plies.
+def analyze(path, depth, out=None, plies=DEFAULT_BOOK_PLIES, workers=None):
+    if depth < 2:
+        raise ValueError('Replays search at least 2 plies deep')
+    #end if
+
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+    summary = {'games': 0, 'moves': 0, 'blunders': 0}
+    tally = {}
+    log = open(out, 'w') if out is not None else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            limit = GAMES_PER_WORKER * (workers or os.cpu_count() or 1)
+            pending = {}
+            for index, record in enumerate(readRecords(path)):
+                if len(pending) >= limit:
+                    _collect(wait(pending, return_when=FIRST_COMPLETED)[0], pending, summary, tally, log)
+                #end if
+                pending[pool.submit(analyzeGame, record, depth, plies)] = (index, len(record['moves']))
+            #end for
+
+            _collect(wait(pending)[0], pending, summary, tally, log)
+        #end with
+    finally:
+        if log is not None:
+            log.close()
+        #end if
+    #end try/finally
+
+    candidates = [{'maxBoard': boards[0], 'minBoard': boards[1], 'count': count, 'score': total / count}
+                  for boards, (count, total) in tally.items()]
+    candidates.sort(key=lambda candidate: (-candidate['count'], -candidate['score'], candidate['maxBoard'],
+                                           candidate['minBoard']))
+    summary['candidates'] = candidates
+
+    return summary
+#end analyze
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays recorded games to find blunders and book candidates.')
+    parser.add_argument('path', nargs='?', default=RECORD_PATH, help='record file, one game per line of JSON')
+    parser.add_argument('--depth', type=int, default=3, help='search depth of every position, at least 2')
+    parser.add_argument('--out', default='blunders.jsonl', help='file the blunders are streamed to')
+    parser.add_argument('--plies', type=int, default=DEFAULT_BOOK_PLIES, help='plies mined for book candidates')
+    parser.add_argument('--top', type=int, default=10, help='book candidates printed')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, one per CPU by default')
+    args = parser.parse_args()
+
+    summary = analyze(args.path, args.depth, args.out, args.plies, args.workers)
+
+    print('%d games, %d moves, %d blunders written to %s' % (summary['games'], summary['moves'],
+                                                               summary['blunders'], args.out))
+    for candidate in summary['candidates'][:args.top]:
+        state = game.State()
+        state.setBoards(candidate['maxBoard'], candidate['minBoard'])
+        print('reached %d times, max scored %.2f:' % (candidate['count'], candidate['score']))
+        print(state.getState())
+    #end for
+#end main
+
+if __name__ == '__main__':
+    main()
+#end if
@@ -1,10 +1,39 @@
+import argparse
+import json
+import os
+import pickle
+import random
+import tempfile
+import time
+import tracemalloc
 import traceback
 import numpy as np
+import benchmark
+import book
+import endgame
+import evaluator
 import game
 import model
+import ponder
+import records
+import server
+import threats
+import tournament
 
 mode = 'debug' #other mode is 'run'
 
+# The settings of the AI at each difficulty level, passed on to game.Game.
+# The threat search and the endgame solver find forced wins far beyond the
+# search depth, so the easy level plays without them. The harder levels
+# get a time limit per move, which bounds the solver too.
+DIFFICULTIES = {
+    'easy': {'maxDepth': 2},
+    'difficult': {'maxDepth': 4, 'timeLimit': 10.0, 'threatDepth': threats.DEFAULT_THREATS,
+                  'solveEmpty': endgame.DEFAULT_SOLVE_EMPTY},
+    'insane': {'maxDepth': 6, 'timeLimit': 30.0, 'threatDepth': threats.DEFAULT_THREATS,
+               'solveEmpty': endgame.DEFAULT_SOLVE_EMPTY},
+}
+
 # stateTest()
 #    Input: None
 #
@@ -47,6 +76,18 @@ def stateTest():
         assert(copy_state.play(2,1,3,'min'))
         assert(not np.all(np.equal(copy_state.getState(), test_state.getState())))
         
+        #Cells off the board are refused without changing the state.
+        boards = (copy_state.maxBoard, copy_state.minBoard, copy_state.hash, copy_state.score,
+                  len(copy_state.moveStack))
+        for move in [(0,0,4), (4,0,0), (-1,0,0), (0,-1,3), (1,1), (1,1,1,1)]:
+            assert(not copy_state.play(*move, 'min'))
+            assert(not copy_state.isValid(*move))
+        #end for
+        assert(not copy_state.push(64, 'min') and not copy_state.push(-1, 'max'))
+        assert((copy_state.maxBoard, copy_state.minBoard, copy_state.hash, copy_state.score,
+                len(copy_state.moveStack)) == boards)
+        assert(copy_state.isValid(0,0,3))
+        
         del copy_state
         del test_state
         del test_array
@@ -100,12 +141,1030 @@ def stateTest():
         assert(not(test_state.isWin()[0]) and test_state.isWin()[1] == 0)
         
         del test_state
+        
+        #Line table tests
+        assert(len(game.LINES) == 76)
+        assert(sum(len(lines) == 7 for lines in game.CELL_LINES) == 16)
+        
+        test_state = game.State()
+        assert(test_state.play(3,0,0,'min'))
+        assert(test_state.play(2,1,1,'min'))
+        assert(test_state.play(1,2,2,'min'))
+        assert(not test_state.isWin()[0])
+        assert(test_state.play(0,3,3,'min'))
+        
+        assert(test_state.isWin()[0] and test_state.isWin()[1] == -1)
+        
+        copy_state = game.State()
+        copy_state.setState(test_state.getState())
+        assert(copy_state.isWin() == test_state.isWin())
+        
+        del copy_state
+        del test_state
+        
+        #A full board without any line is a tie.
+        tieBoard = 0xd8a1427e4ddb2ac3
+        test_array = np.array([1 if (tieBoard >> i) & 1 else -1 for i in range(64)])
+        
+        test_state = game.State()
+        test_state.setState(test_array.reshape((4,4,4)))
+        assert(test_state.isWin()[0] and test_state.isWin()[1] == 0)
+        
+        del test_state
+        del test_array
+        
+        #Heuristic tests
+        test_state = game.State()
+        assert(test_state.h() == 0)
+        assert(test_state.play(1,1,1,'max'))
+        assert(test_state.h() == 7 * game.LINE_WEIGHTS[1])
+        
+        #The shared diagonal is blocked and counts for nothing.
+        assert(test_state.play(2,2,2,'min'))
+        assert(test_state.h() == 0)
+        
+        assert(test_state.play(1,1,2,'max'))
+        assert(test_state.play(0,3,0,'min'))
+        copy_state = game.State()
+        copy_state.setState(test_state.getState())
+        assert(copy_state.h() == test_state.h())
+        
+        del copy_state
+        del test_state
+        
+        #Make/unmake tests, moves are cell indices
+        test_state = game.State()
+        assert(list(game.actions(test_state)) == list(range(64)))
+        assert(test_state.play(1,1,1,'max'))
+        copy_state = test_state.copy()
+        
+        assert(test_state.push(game.cellIndex(0,0,0), 'min'))
+        assert(not test_state.push(game.cellIndex(1,1,1), 'min'))
+        assert(test_state.push(game.cellIndex(2,2,2), 'max'))
+        assert(test_state.push(game.cellIndex(3,3,3), 'min'))
+        assert(test_state.h() != copy_state.h())
+        
+        assert(test_state.pop() == game.cellIndex(3,3,3))
+        assert(not hasattr(test_state, '__dict__'))
+        test_state.pop()
+        test_state.pop()
+        assert(np.all(np.equal(test_state.getState(), copy_state.getState())))
+        assert(test_state.h() == copy_state.h())
+        assert(test_state.maxCounts == copy_state.maxCounts)
+        assert(test_state.minCounts == copy_state.minCounts)
+        
+        #Popping a winning move clears the win.
+        for z in range(4):
+            assert(test_state.push(game.cellIndex(0,2,z), 'min'))
+        #end for
+        assert(test_state.isWin() == (True, -1))
+        test_state.pop()
+        assert(test_state.isWin() == (False, 0))
+        
+        del copy_state
+        del test_state
+        
+        #Zobrist hash tests
+        test_state = game.State()
+        copy_state = game.State()
+        assert(test_state.play(0,0,0,'max'))
+        assert(test_state.play(1,2,3,'min'))
+        assert(copy_state.play(1,2,3,'min'))
+        assert(copy_state.play(0,0,0,'max'))
+        assert(test_state.hash == copy_state.hash != 0)
+        
+        test_state.push(game.cellIndex(3,3,3), 'max')
+        assert(test_state.hash != copy_state.hash)
+        test_state.pop()
+        assert(test_state.hash == copy_state.hash)
+        
+        copy_state.setState(test_state.getState())
+        assert(test_state.hash == copy_state.hash)
+        
+        del copy_state
+        del test_state
+        
+        #Symmetry tests
+        assert(len(set(game.SYMMETRIES)) == 192)
+        lines = set(frozenset(line) for line in game.LINES)
+        for perm in game.SYMMETRIES:
+            assert(set(frozenset(perm[cell] for cell in line) for line in game.LINES) == lines)
+        #end for
+        
+        test_state = game.State()
+        assert(len(test_state.symmetries()) == 192)
+        assert(test_state.play(0,0,0,'max'))
+        assert(len(test_state.symmetries()) == 12)
+        
+        #Every corner and centre cell is equivalent to every other one.
+        copy_state = game.State()
+        assert(copy_state.play(2,1,2,'max'))
+        assert(copy_state.canonical()[0] == test_state.canonical()[0])
+        assert(copy_state.canonicalHash() == test_state.canonicalHash())
+        assert(copy_state.hash != test_state.hash)
+        
+        #The symmetry returned by canonical maps the state onto the canonical one.
+        (maxBoard, minBoard), sym = copy_state.canonical()
+        assert(game.transformBoard(copy_state.maxBoard, game.SYMMETRIES[sym]) == maxBoard)
+        
+        del copy_state
+        del test_state
+        
+        #Batch evaluation tests
+        test_state = game.State()
+        assert(test_state.play(1,1,1,'max'))
+        assert(test_state.play(2,2,1,'min'))
+        copy_state = test_state.copy()
+        for y in range(4):
+            assert(copy_state.play(0,y,3,'min'))
+        #end for
+        
+        positions = np.stack([test_state.getState(), copy_state.getState()])
+        scores, wins, winners = game.evaluateBatch(positions)
+        assert(list(scores) == [test_state.h(), copy_state.h()])
+        assert(list(wins) == [False, True] and list(winners) == [0, -1])
+
+        del copy_state
+        del test_state
+
+        #Board size tests
+        for size, dims, lineCount, symmetryCount in ((3,3,49,48), (5,3,109,192), (4,4,520,1536)):
+            geometry = game.getGeometry(size, dims)
+            assert(game.getGeometry(size, dims) is geometry)
+            assert(pickle.loads(pickle.dumps(geometry)) is geometry)
+            assert(len(geometry.lines) == lineCount and len(set(geometry.symmetries)) == symmetryCount)
+            assert(geometry.symmetries[0] == tuple(range(geometry.cells)))
+
+            lines = set(frozenset(line) for line in geometry.lines)
+            for perm in geometry.symmetries[::max(1, symmetryCount // 48)]:
+                assert(set(frozenset(perm[cell] for cell in line) for line in geometry.lines) == lines)
+            #end for
+
+            #A line of the last axis wins, and the running score matches a recount.
+            test_state = game.State(geometry)
+            for i in range(size - 1):
+                assert(test_state.play(*([1] * (dims - 1) + [i]), 'max'))
+                assert(test_state.play(*([0] * (dims - 1) + [i]), 'min'))
+            #end for
+            assert(not test_state.isWin()[0] and not test_state.isValid(*([1] * (dims - 1) + [0])))
+            copy_state = game.State(geometry)
+            copy_state.setState(test_state.getState())
+            assert(copy_state.hash == test_state.hash and copy_state.h() == test_state.h())
+
+            positions = test_state.getState()[np.newaxis]
+            assert(game.evaluateBatch(positions, geometry)[0][0] == test_state.h())
+
+            assert(test_state.play(*([1] * (dims - 1) + [size - 1]), 'max'))
+            assert(test_state.isWin() == (True, 1) and test_state.h() == geometry.winScore)
+
+            del copy_state
+            del test_state
+        #end for
+
+        #The symmetry reduction keeps the search value on other boards.
+        test_state = game.State(game.getGeometry(3, 3))
+        assert(test_state.play(0,0,0,'min'))
+        plain = model.Model(3, useSymmetry=False, ordering='raster')
+        reduced = model.Model(3)
+        assert(plain.alphaBetaSearch(test_state) is not None and reduced.alphaBetaSearch(test_state) is not None)
+        assert(plain.value == reduced.value)
+
+        del test_state
+#end stateTest
+
+# modelTest()
+#    Input: None
+#
+#    Output: None (Exceptions on failure)
+#
+#    Tests that the search finds the same values with its optimizations
+#    turned on as without them.
+def modelTest():
+        test_state = game.State()
+        for x, y, z, player in [(1,1,1,'max'), (2,2,2,'min'), (0,0,0,'max'), (3,3,3,'min')]:
+            assert(test_state.play(x, y, z, player))
+        #end for
+        
+        plain = model.Model(4, 0)
+        tabled = model.Model(4)
+        
+        plainValue = plain.maxSearch(test_state, -float('inf'), float('inf'), 0)[0]
+        tabledValue = tabled.maxSearch(test_state, -float('inf'), float('inf'), 0)[0]
+        
+        assert(plainValue == tabledValue)
+        assert(tabled.nodes < plain.nodes)
+        assert(tabled.table.hits > 0)
+        
+        #Keyed on canonical forms, a search finds the same move, and a
+        #symmetric copy of the position is answered from the table.
+        position = [(1,1,1,'max'), (2,2,2,'min'), (0,0,0,'max'), (3,3,3,'min'), (1,2,1,'max'), (1,0,1,'min')]
+        symmetric_state = game.State()
+        for x, y, z, player in position:
+            symmetric_state.play(x, y, z, player)
+        #end for
+        plain = model.Model(3)
+        canonical = model.Model(3, canonicalDepth=1)
+        action = canonical.alphaBetaSearch(symmetric_state)
+        assert(action == plain.alphaBetaSearch(symmetric_state) and canonical.value == plain.value)
+        
+        perm = game.SYMMETRIES[5]
+        mirrored = game.State()
+        mirrored.setBoards(game.transformBoard(symmetric_state.maxBoard, perm), game.transformBoard(symmetric_state.minBoard, perm))
+        nodes = canonical.nodes
+        assert(canonical.alphaBetaSearch(mirrored) == perm[action] and canonical.value == plain.value)
+        assert(canonical.nodes - nodes == 1)
+        
+        #The state is left as it was found.
+        assert(test_state.moveCount == 4 and test_state.moveStack[-1][0] == game.cellIndex(3,3,3))
+        
+        del test_state
+        
+        #Skipping symmetric moves gives the same value.
+        test_state = game.State()
+        assert(test_state.play(0,0,0,'max'))
+        assert(test_state.play(3,3,3,'min'))
+        
+        plain = model.Model(3, 0, False)
+        reduced = model.Model(3, 0, True)
+        stabilizer = test_state.symmetries()
+        
+        plainValue = plain.maxSearch(test_state, -float('inf'), float('inf'), 0)[0]
+        reducedValue = reduced.maxSearch(test_state, -float('inf'), float('inf'), 0, stabilizer)[0]
+        
+        assert(plainValue == reducedValue)
+        assert(reduced.nodes < plain.nodes)
+        
+        #Every move ordering finds the same value.
+        values = set()
+        for ordering in model.ORDERINGS:
+            ordered = model.Model(3, ordering=ordering)
+            values.add(ordered.maxSearch(test_state, -float('inf'), float('inf'), 0)[0])
+        #end for
+        assert(len(values) == 1)
+        
+        #Scoring the frontier in batches gives the same value.
+        plain = model.Model(3)
+        batched = model.Model(3, batchLeaves=True)
+        plainValue = plain.maxSearch(test_state, -float('inf'), float('inf'), 0)[0]
+        batchedValue = batched.maxSearch(test_state, -float('inf'), float('inf'), 0)[0]
+        
+        assert(plainValue == batchedValue)
+        
+        #Ties between batched children go to the move searched first.
+        for depth in (1, 2, 3):
+            plain = model.Model(depth)
+            batched = model.Model(depth, batchLeaves=True)
+            assert(plain.alphaBetaSearch(test_state) == batched.alphaBetaSearch(test_state))
+        #end for
+        
+        #The batched children count against the node budget before they are
+        #scored, so the search stops within one batch of the limit.
+        batched = model.Model(4, batchLeaves=True, nodeLimit=300)
+        assert(batched.alphaBetaSearch(test_state) is not None)
+        assert(batched.nodes <= 300 + game.DEFAULT_GEOMETRY.cells and batched.completedDepth < 4)
+        
+        #PVS finds the value and move of the plain alpha-beta search.
+        for depth in (2, 3, 4):
+            plain = model.Model(depth)
+            pvs = model.Model(depth, search='pvs')
+            plainAction = plain.alphaBetaSearch(test_state)
+            pvsAction = pvs.alphaBetaSearch(test_state)
+            
+            assert(plain.value == pvs.value)
+            assert(plainAction == pvsAction)
+        #end for
+        
+        #Negamax also plays the minimizing side.
+        minValue = model.Model(3).minSearch(test_state, -float('inf'), float('inf'), 0)[0]
+        negamaxValue = model.Model(3, search='pvs').negamax(test_state, -float('inf'), float('inf'), 0, -1)[0]
+        
+        assert(minValue == -negamaxValue)
+        
+        #The parallel search picks the move of the serial search.
+        serial = model.Model(3)
+        parallel = model.Model(3, workers=2)
+        serialAction = serial.alphaBetaSearch(test_state)
+        parallelAction = parallel.alphaBetaSearch(test_state)
+        parallel.close()
+        
+        assert(serialAction == parallelAction)
+        
+        #The stats of a search add up to its nodes, and are logged as JSON lines.
+        path = os.path.join(tempfile.mkdtemp(), 'test_stats.jsonl')
+        profiled = model.Model(3, statsLog=path)
+        action, stats = profiled.searchWithStats(test_state)
+        profiled.alphaBetaSearch(test_state)
+        
+        assert(stats.nodes == sum(stats.nodesPerPly))
+        assert(stats.nodesPerPly[0] == 1 and stats.depth == 3)
+        assert(stats.cutoffs == sum(stats.cutoffIndices) > 0)
+        assert(stats.leaves + stats.expanded == stats.nodes)
+        assert(stats.table['misses'] > 0)
+        assert(profiled.lastStats is not stats)
+        
+        with open(path) as log:
+            lines = [json.loads(line) for line in log]
+        #end with
+        os.remove(path)
+        
+        assert(len(lines) == 2 and lines[0]['nodes'] == stats.nodes)
+        assert(lines[0]['nodes'] + lines[1]['nodes'] == profiled.nodes)
+        assert(lines[0]['move'] == action)
+        
+        #The search allocates next to nothing per node. Without a table, what
+        #it holds at its peak only grows with the depth, not the nodes.
+        lean = model.Model(4, tableSize=0)
+        lean.alphaBetaSearch(test_state)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        lean.alphaBetaSearch(test_state)
+        after, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        
+        assert(lean.nodes > 2000)
+        assert(peak - before < 16384 and after - before < 8192)
+        
+        #A node budget stops the deepening and leaves the state untouched.
+        budgeted = model.Model(10, nodeLimit=3000)
+        action = budgeted.alphaBetaSearch(test_state)
+        
+        assert(test_state.isValid(*game.cellCoords(action)))
+        assert(1 <= budgeted.completedDepth < 10)
+        assert(budgeted.nodes <= 3000)
+        assert(test_state.moveCount == 2 and len(test_state.moveStack) == 2)
+        
+        del test_state
+        
+        #Staged moves: wins, then blocks, then the rest, found lazily.
+        test_state = game.State()
+        for x in range(3):
+            test_state.play(x, 0, 0, 'max')
+            test_state.play(x, 1, 1, 'min')
+        #end for
+        win = game.cellIndex(3, 0, 0)
+        block = game.cellIndex(3, 1, 1)
+        
+        assert(game.winningCells(test_state, 1) == 1 << win)
+        assert(next(game.actions(test_state, 1)) == win)
+        staged = list(game.actions(test_state, 1))
+        assert(staged[:2] == [win, block] and sorted(staged) == list(game.actions(test_state)))
+        assert(list(game.actions(test_state, -1))[:2] == [block, win])
+        
+        searcher = model.Model(2)
+        assert(list(searcher._stagedMoves(test_state, None, 0, 1)) == [win])
+        assert(searcher.alphaBetaSearch(test_state) == win)
+        
+        #Streaming the moves, which is off by default, does not change the
+        #values of the search.
+        test_state.pop()
+        test_state.pop()
+        listed = model.Model(3)
+        staged = model.Model(3, stagedMoves=True)
+        raster = model.Model(3, ordering='raster')
+        assert(not listed.stagedMoves and staged.alphaBetaSearch(test_state) is not None)
+        listed.alphaBetaSearch(test_state)
+        raster.alphaBetaSearch(test_state)
+        assert(staged.value == listed.value == raster.value)
+        
+        #The side to move has a key of its own on every board, so a budgeted
+        #search on the 4^4 board, with cell 128 open, answers as a fixed one.
+        hyper = game.getGeometry(4, 4)
+        for geometry in (game.DEFAULT_GEOMETRY, hyper, game.getGeometry(5, 3)):
+            assert(geometry.zobristSide not in geometry.zobristMax + geometry.zobristMin)
+        #end for
+        generator = random.Random(19)
+        for _ in range(3):
+            hyper_state = game.State(hyper)
+            cells = [cell for cell in range(hyper.cells) if cell != 128]
+            generator.shuffle(cells)
+            for i in range(6):
+                hyper_state.push(cells[i], -1 if i % 2 == 0 else 1)
+            #end for
+            fixed = model.Model(2)
+            budgeted = model.Model(2, nodeLimit=10 ** 7)
+            assert((fixed.alphaBetaSearch(hyper_state), fixed.value) ==
+                   (budgeted.alphaBetaSearch(hyper_state), budgeted.value))
+        #end for
+        
+        del test_state
+#end modelTest
 
+# serverTest()
+#    Input: None
+#
+#    Output: None (Exceptions on failure)
+#
+#    Tests the move submission and reply collection of GameServer.
+def serverTest():
+        test_server = server.GameServer(2, workers=1)
+        first = test_server.newGame()
+        second = test_server.newGame()
+        
+        assert(test_server.submitMoves([(first,0,0,0), (second,1,1,1)]) == [True, True])
+        #The AI has to reply before the player moves again.
+        assert(not test_server.submitMove(first, 3,3,3))
+        
+        move = test_server.awaitReply(first)
+        assert(test_server.getState(first).moveCount == 2)
+        assert(not test_server.getState(first).isValid(*move))
+        
+        test_server.awaitReply(second)
+        assert(test_server.poll(second) is None)
+        assert(not test_server.submitMove(second, 1,1,1))
+        assert(test_server.aiMoves == 2)
+        
+        #Malformed moves and unknown sessions are refused without a change.
+        board = (test_server.getState(second).maxBoard, test_server.getState(second).minBoard)
+        for bad in [(second,0,0,4), (second,-1,0,0), (second,'1',0,0), (second,1.5,0,0), (second,True,0,0),
+                    (second + 5,0,0,0), ('x',0,0,0)]:
+            assert(not test_server.submitMove(*bad))
+        #end for
+        assert((test_server.getState(second).maxBoard, test_server.getState(second).minBoard) == board)
+        assert(not test_server.isWaiting(second))
+        
+        #Ended games are dropped, and their session ids are not reused.
+        assert(test_server.submitMove(first, 3,3,3))
+        assert(test_server.endGame(first) and not test_server.endGame(first))
+        assert(test_server.sessions() == 1 and not test_server.submitMove(first, 2,2,2))
+        assert(test_server.pollAll() == {})
+        assert(test_server.newGame() == second + 1)
+        
+        test_server.close()
+#end serverTest
+
+# threatTest()
+#    Input: None
+#
+#    Output: None (Exceptions on failure)
+#
+#    Tests the threat search, alone and in Model.
+def threatTest():
+        test_state = game.State()
+        moves = [(2,2,2), (2,3,0), (3,1,3), (0,3,2), (1,3,1), (3,2,0), (3,3,0), (0,2,2), (0,1,1), (1,2,0)]
+        for i in range(len(moves)):
+            test_state.play(moves[i][0], moves[i][1], moves[i][2], 'min' if i % 2 == 0 else 'max')
+        #end for
+        
+        #Max wins with ten threats in a row, min has no threats that win.
+        line = threats.ThreatSearch().forcedWin(test_state, 1)
+        
+        assert(len(line) == 10)
+        assert(threats.ThreatSearch().forcedWin(test_state, -1) is None)
+        assert(threats.ThreatSearch(4).forcedWin(test_state, 1) is None)
+        
+        #Only the harder levels of the game look for threat wins.
+        assert(game.Game(**DIFFICULTIES['easy']).aiPlayer.threatSearch is None)
+        assert(game.Game(**DIFFICULTIES['insane']).aiPlayer.threatSearch.maxThreats == threats.DEFAULT_THREATS)
+        
+        #The search misses the win, unless it runs the threat search.
+        plain = model.Model(3)
+        plain.alphaBetaSearch(test_state)
+        
+        assert(plain.value < game.WIN_SCORE)
+        
+        threatened = model.Model(3, threatDepth=16)
+        action = threatened.alphaBetaSearch(test_state)
+        
+        assert(action == line[0] and threatened.value == game.WIN_SCORE)
+        assert(threatened.nodes == 0 and threatened.threatWins == 1)
+        
+        #At the frontier, the threat search finds the win behind the first threat.
+        plainValue = model.Model(2).maxSearch(test_state, -float('inf'), float('inf'), 0)[0]
+        leafValue = model.Model(2, threatDepth=16, threatLeaves=True).maxSearch(test_state, -float('inf'), float('inf'), 0)[0]
+        
+        assert(plainValue < game.WIN_SCORE and leafValue == game.WIN_SCORE)
+        
+        #Playing the threats wins against a defender that blocks each one.
+        search = threats.ThreatSearch()
+        while not test_state.isWin()[0]:
+            test_state.play(*game.cellCoords(search.forcedWin(test_state, 1)[0]), 'max')
+            blocks = threats.threatCells(test_state, 1)
+            if len(blocks) == 1 and not test_state.isWin()[0]:
+                test_state.play(*game.cellCoords(blocks[0]), 'min')
+            #end if
+        #end while
+        
+        assert(test_state.isWin() == (True, 1))
+        assert(len(test_state.moveStack) <= len(moves) + 2 * len(line))
+        
+        del test_state
+#end threatTest
+
+# endgameTest()
+#    Input: None
+#
+#    Output: None (Exceptions on failure)
+#
+#    Tests the endgame solver, alone and in Model.
+def endgameTest():
+        #Positions emptied out of a full board without any line.
+        tieBoard = 0xd8a1427e4ddb2ac3
+        generator = random.Random(8150)
+        for _ in range(6):
+            maxCells = generator.sample([i for i in range(64) if tieBoard >> i & 1], 28)
+            minCells = generator.sample([i for i in range(64) if not tieBoard >> i & 1], 28)
+            test_state = game.State()
+            test_state.setBoards(sum(1 << i for i in maxCells), sum(1 << i for i in minCells))
+
+            #The solver agrees with a full search on the result, and keeps the state.
+            solver = endgame.EndgameSolver()
+            value, action = solver.solve(test_state, 1)
+            plain = model.Model(8, tableSize=0, useSymmetry=False, ordering='raster')
+            plain.alphaBetaSearch(test_state)
+
+            outcome = lambda value: (value >= game.WIN_SCORE) - (value <= -game.WIN_SCORE)
+            assert(outcome(value) == outcome(plain.value))
+            assert(value != game.TIE_SCORE or plain.value == game.TIE_SCORE)
+            assert(test_state.moveCount == 56 and not test_state.moveStack)
+
+            #Solving again is answered from the cache.
+            nodes = solver.nodes
+            assert(solver.solve(test_state, 1) == (value, action))
+            assert(solver.nodes == nodes + 1)
+
+            del test_state
+        #end for
+
+        #The fastest win is preferred, counted in the empty cells left.
+        test_state = game.State()
+        for x in range(3):
+            assert(test_state.play(x,0,0,'max'))
+            assert(test_state.play(x,3,3,'min'))
+        #end for
+        assert(test_state.play(0,1,0,'max'))
+        solver = endgame.EndgameSolver()
+        value, action = solver.solve(test_state, 1, nodeLimit=100000)
+        assert(action == game.cellIndex(3,0,0))
+        assert(value == game.WIN_SCORE + 64 - test_state.moveCount - 1)
+
+        #A solve out of budget gives up and restores the state.
+        test_state = game.State()
+        assert(endgame.EndgameSolver().solve(test_state, 1, nodeLimit=2000) is None)
+        assert(test_state.moveCount == 0 and not test_state.moveStack)
+        
+        #The node limit holds to within a node, however small.
+        for nodeLimit in (10, 2000):
+            solver = endgame.EndgameSolver()
+            assert(solver.solve(test_state, 1, nodeLimit=nodeLimit) is None)
+            assert(nodeLimit <= solver.nodes <= nodeLimit + 1)
+        #end for
+
+        del test_state
+
+        #Model solves below the threshold, and searches above it.
+        test_state = game.State()
+        test_state.setBoards(sum(1 << i for i in range(64) if tieBoard >> i & 1 and i < 40),
+                             sum(1 << i for i in range(64) if not tieBoard >> i & 1 and i < 40))
+        assert(not test_state.isWin()[0] and 64 - test_state.moveCount == 24)
+
+        solving = model.Model(2, solveEmpty=endgame.DEFAULT_SOLVE_EMPTY, collectStats=True)
+        solving.alphaBetaSearch(test_state)
+        assert(solving.solves == 0 and not solving.lastStats.solved)
+
+        test_state.setBoards(test_state.maxBoard | (tieBoard & (0xFF << 40)),
+                             test_state.minBoard | (~tieBoard & (0xFF << 40)))
+        action = solving.alphaBetaSearch(test_state)
+        assert(solving.solves == 1 and solving.lastStats.solved and solving.lastStats.toDict()['solved'])
+        assert(solving.completedDepth == 64 - test_state.moveCount)
+        assert((action, solving.value) == endgame.EndgameSolver().solve(test_state, 1)[::-1])
+
+        # Only the harder difficulty levels solve endgames, and always within a time limit.
+        assert(game.Game(**DIFFICULTIES['easy']).aiPlayer.endgame is None)
+        for level in ('difficult', 'insane'):
+            aiPlayer = game.Game(**DIFFICULTIES[level]).aiPlayer
+            assert(aiPlayer.solveEmpty == endgame.DEFAULT_SOLVE_EMPTY and aiPlayer.timeLimit is not None)
+
+        del test_state
+#end endgameTest
+
+# ponderTest()
+#    Input: None
+#
+#    Output: None (Exceptions on failure)
+#
+#    Tests pondering on the player's turn.
+def ponderTest():
+        test_state = game.State()
+        for x, y, z, player in [(1,1,1,'min'), (2,2,2,'max'), (0,0,0,'min'), (3,3,3,'max'), (1,2,1,'min'), (1,0,1,'max')]:
+            assert(test_state.play(x, y, z, player))
+        #end for
+
+        replies = ponder.predictReplies(test_state)
+        assert(sorted(replies) == list(game.actions(test_state)))
+
+        #Blocking a threat is the most likely reply.
+        copy_state = game.State()
+        for z, (x, y) in enumerate([(1,2), (3,1), (2,3)]):
+            assert(copy_state.play(x,y,z,'min') and copy_state.play(0,0,z,'max'))
+        #end for
+        assert(ponder.predictReplies(copy_state)[0] == game.cellIndex(0,0,3))
+        del copy_state
+
+        thinking = model.Model(3)
+        ponderer = ponder.Ponderer(thinking)
+        ponderer.start(test_state)
+        waited = 0
+        while ponderer.pondered == 0 and waited < 100:
+            time.sleep(0.05)
+            waited += 1
+        #end while
+        ponderer.stop()
+        assert(ponderer.pondered >= 1 and not thinking.stopped)
+
+        #A pondered reply is answered at once, the same way a cold search answers it.
+        test_state.push(replies[0], -1)
+        nodes = thinking.nodes
+        action = ponderer.search(test_state)
+        cold = model.Model(3)
+        assert(thinking.nodes == nodes and ponderer.hits == 1)
+        assert((action, thinking.value) == (cold.alphaBetaSearch(test_state), cold.value))
+        test_state.pop()
+
+        #A reply not pondered is searched, and stopping leaves the state as it was.
+        copy_state = test_state.copy()
+        ponderer.start(test_state)
+        ponderer.stop()
+        assert(test_state.moveStack == copy_state.moveStack and test_state.hash == copy_state.hash)
+        test_state.push(replies[-1], -1)
+        action = ponderer.search(test_state)
+        assert(ponderer.misses == 1 and (action, thinking.value) == (cold.alphaBetaSearch(test_state), cold.value))
+
+        #A stopped Model refuses to search until it is let go.
+        thinking.stop()
+        try:
+            thinking.alphaBetaSearch(test_state)
+            assert(False)
+        except model.SearchStopped:
+            #Exception here was expected.
+            assert(True)
+        #end try/except
+        thinking.stop(False)
+        assert(thinking.alphaBetaSearch(test_state) == action)
+
+        #A hit leaves the pondered stats in lastStats, and only the moves played are logged.
+        handle, statsPath = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+        try:
+            counting = model.Model(3, statsLog=statsPath)
+            counting.alphaBetaSearch(test_state)
+            stale = counting.lastStats
+            ponderer = ponder.Ponderer(counting)
+            ponderer.start(test_state)
+            waited = 0
+            while ponderer.pondered == 0 and waited < 100:
+                time.sleep(0.05)
+                waited += 1
+            #end while
+            test_state.push(ponder.predictReplies(test_state)[0], -1)
+            action = ponderer.search(test_state)
+            assert(ponderer.hits == 1 and counting.lastStats is not stale and counting.lastStats.pondered)
+            assert(counting.lastStats.move == action and counting.lastStats.value == counting.value)
+            with open(statsPath) as log:
+                lines = [json.loads(line) for line in log]
+            #end with
+            assert([line['pondered'] for line in lines] == [False, True] and lines[1]['move'] == action)
+            test_state.pop()
+        finally:
+            os.remove(statsPath)
+        #end try/finally
+
+        #Pondering is off unless asked for on the command line.
+        assert(not parseArguments([]).think and parseArguments(['--think']).think)
+
+        del copy_state
+        del test_state
+#end ponderTest
+
+# tournamentTest()
+#    Input: None
+#
+#    Output: None (Exceptions on failure)
+#
+#    Tests the self-play tournament.
+def tournamentTest():
+        #Playing min, the AI blocks the three tokens of max.
+        test_state = game.State()
+        test_state.play(0,0,0, 'max')
+        test_state.play(0,0,1, 'max')
+        test_state.play(0,0,2, 'max')
+        test_state.play(1,1,1, 'min')
+        test_state.play(2,2,2, 'min')
+        
+        assert(tournament.chooseMove(model.Model(2), test_state, -1) == game.cellIndex(0,0,3))
+        assert(test_state.moveCount == 5)
+        
+        #Both sides move first equally often, and every game is streamed.
+        path = os.path.join(tempfile.mkdtemp(), 'test_tournament.jsonl')
+        summary = tournament.runTournament({'maxLayers': 1}, {'maxLayers': 2}, 4, path, workers=2)
+        
+        with open(path) as log:
+            records = [json.loads(line) for line in log]
+        #end with
+        os.remove(path)
+        
+        assert(summary['games'] == len(records) == 4)
+        assert(summary['wins'] + summary['losses'] + summary['draws'] == 4)
+        assert(sorted(record['first'] for record in records) == ['A', 'A', 'B', 'B'])
+        assert(sorted(record['game'] for record in records) == [0, 1, 2, 3])
+        assert(summary['A']['moves'] > 0 and summary['B']['meanNodes'] > summary['A']['meanNodes'])
+        
+        #The openings are played out before the AIs move.
+        for record in records:
+            assert(record['moves'][0]['cell'] == record['opening'][0] and 'seconds' not in record['moves'][0])
+            assert(record['moves'][2]['seconds'] >= 0)
+        #end for
+        
+        assert(tournament.eloDifference(0.5) == 0 and tournament.eloDifference(0.75) > 0)
+#end tournamentTest
+
+# recordsTest()
+#    Input: None
+#
+#    Output: None (Exceptions on failure)
+#
+#    Tests the game records and their replay.
+def recordsTest():
+        #Min lets max complete three tokens in a row, then max misses the win.
+        moves = [(0,3,3), (0,0,0), (3,2,1), (1,0,0), (1,1,3), (2,0,0), (2,3,0), (3,3,3), (3,0,0)]
+        record = records.newRecord(game.DEFAULT_GEOMETRY)
+        for i in range(len(moves)):
+            if i == 7:
+                searcher = model.Model(2)
+                records.addMove(record, game.cellIndex(*moves[i]), searcher, 0.5, 10)
+            else:
+                records.addMove(record, game.cellIndex(*moves[i]))
+            #end if/else
+        #end for
+        record['winner'] = 0
+        
+        assert(record['moves'][7] == {'cell': game.cellIndex(3,3,3), 'seconds': 0.5, 'nodes': 10, 'depth': 0,
+                                      'value': 0})
+        
+        #Records are appended a line at a time and read back one by one.
+        path = os.path.join(tempfile.mkdtemp(), 'test_records.jsonl')
+        out = os.path.join(os.path.dirname(path), 'test_blunders.jsonl')
+        records.writeRecord(path, record)
+        records.writeRecord(path, {'moves': record['moves'][:4]})
+        
+        read = records.readRecords(path)
+        assert(next(read) == record)
+        assert(records.recordGeometry(next(read)) is game.DEFAULT_GEOMETRY)
+        
+        replayed = [(player, move['cell'], state.moveCount) for state, player, move in records.positions(record)]
+        assert(replayed[:2] == [(-1, game.cellIndex(0,3,3), 0), (1, game.cellIndex(0,0,0), 1)])
+        assert(len(replayed) == len(moves))
+        
+        #Both the missed block and the missed win are found.
+        result = records.analyzeGame(record, 2)
+        assert([blunder['ply'] for blunder in result['blunders']] == [6, 7])
+        assert(result['blunders'][1]['best'] == game.cellIndex(3,0,0))
+        assert(result['winner'] == 0 and len(result['openings']) == 1)
+        
+        summary = records.analyze(path, 2, out, workers=2)
+        with open(out) as log:
+            blunders = [json.loads(line) for line in log]
+        #end with
+        os.remove(path)
+        os.remove(out)
+        
+        assert(summary['games'] == 2 and summary['moves'] == len(moves) + 4)
+        assert(summary['blunders'] == len(blunders) == 2)
+        assert(all(blunder['game'] == 0 for blunder in blunders))
+        assert(summary['candidates'][0]['count'] == 2)
+        
+        #Games are only recorded when asked for, to the working directory by default.
+        assert(parseArguments([]).record is None and not os.path.isabs(records.RECORD_PATH))
+        assert(parseArguments(['--record']).record == records.RECORD_PATH)
+        assert(parseArguments(['--record', path]).record == path)
+#end recordsTest
+
+# evaluatorTest()
+#    Input: None
+#
+#    Output: None (Exceptions on failure)
+#
+#    Tests the learned evaluator and its training.
+def evaluatorTest():
+        #The cube has four kinds of line; the four space diagonals are one.
+        classes = evaluator.lineClasses(game.DEFAULT_GEOMETRY)
+        assert(max(classes) == 3 and sorted(classes.count(c) for c in range(4)) == [4, 24, 24, 24])
+        assert(classes[game.DEFAULT_GEOMETRY.lines.index((0, 21, 42, 63))] == 2)
+        
+        #The hand-written values as an evaluator score the same as State.h.
+        hand = evaluator.fromHeuristic()
+        test_state = game.State()
+        scored = game.State(evaluator=hand)
+        for cell in (21, 0, 42, 63, 22, 5):
+            player = -1 if test_state.moveCount % 2 == 0 else 1
+            test_state.push(cell, player)
+            scored.push(cell, player)
+            assert(scored.h() == test_state.h())
+        #end for
+        
+        #Games of self-play are turned into line values for the player to move.
+        path = os.path.join(tempfile.mkdtemp(), 'test_selfplay.jsonl')
+        weights = os.path.join(os.path.dirname(path), 'test_evaluator.npz')
+        openings = [[21], [0], [42, 22], [63, 1]]
+        for i in range(len(openings)):
+            played = tournament.playGame({'A': {'maxLayers': 1}, 'B': {'maxLayers': 2}}, openings[i], 'AB'[i % 2])
+            records.writeRecord(path, played)
+        #end for
+        
+        trained = evaluator.train([path])
+        trained.save(weights)
+        loaded = evaluator.load(weights)
+        os.remove(path)
+        os.remove(weights)
+        
+        assert(trained.weights.shape == (4, 5, 5) and np.any(trained.weights != 0))
+        assert(np.array_equal(loaded.weights, trained.weights))
+        
+        #The game plays with the hand-written weights unless told otherwise.
+        assert(parseArguments([]).evaluator is None)
+        assert(parseArguments(['--evaluator']).evaluator == evaluator.EVALUATOR_PATH)
+        
+        #h follows the moves, counts the tempo for the player to move, and
+        #agrees with the batched scores and with the features.
+        scored.setEvaluator(trained)
+        assert(scored.lineValues is trained.lineValues and len(scored.moveStack) == 6)
+        for cell in (43, 2):
+            player = -1 if scored.moveCount % 2 == 0 else 1
+            scored.push(cell, player)
+            
+            boards = (scored.maxBoard, scored.minBoard) if player == -1 else (scored.minBoard, scored.maxBoard)
+            free = np.array([trained.weights[c, own, other] for c in range(4)
+                             for own, other in evaluator.freeCounts(4)])
+            exact = -player * (evaluator.features([boards[0]], [boards[1]]) @ free)[0]
+            assert(abs(scored.h() - exact) <= 38)
+            
+            batch = game.evaluateBatch(scored.getState().reshape((1, -1)), evaluator=trained)[0]
+            assert(batch[0] == scored.h())
+        #end for
+        
+        while scored.moveStack:
+            scored.pop()
+        #end while
+        assert(scored.score == 0)
+        
+        try:
+            game.State(game.getGeometry(3, 3), trained)
+            assert(False)
+        except ValueError:
+            pass
+        #end try/except
+        
+        #The Model searches a copy scored by its evaluator, and still wins.
+        test_state = game.State()
+        for z in range(3):
+            test_state.play(0,0,z, 'max')
+            test_state.play(1,1,z, 'min')
+        #end for
+        searcher = model.Model(3, evaluator=trained, batchLeaves=True)
+        score = test_state.h()
+        
+        assert(searcher.alphaBetaSearch(test_state) == game.cellIndex(0,0,3))
+        assert(test_state.lineValues is game.DEFAULT_GEOMETRY.lineValues and test_state.h() == score)
+        
+        test_state.pop()
+        action = searcher.alphaBetaSearch(test_state)
+        assert(test_state.isValid(*game.cellCoords(action)) and test_state.moveCount == 5)
+#end evaluatorTest
+
+# bookTest()
+#    Input: None
+#
+#    Output: None (Exceptions on failure)
+#
+#    Tests building an opening book and answering from it.
+def bookTest():
+        path = os.path.join(tempfile.mkdtemp(), 'test_book.npy')
+        count = book.build(path, plies=1, depth=2, workers=1)
+        test_book = book.OpeningBook(path)
+        
+        #A corner and a center cell are the only distinct first moves.
+        assert(count == len(test_book) == 2)
+        
+        #Any corner finds the entry of the canonical corner, moved back onto it.
+        test_state = game.State()
+        test_state.play(3,0,3, 'min')
+        move, score, depth = test_book.lookup(test_state)
+        
+        assert(depth == 2)
+        assert(test_state.isValid(*game.cellCoords(move)))
+        
+        assert(score == model.Model(2).maxSearch(test_state, -float('inf'), float('inf'), 0)[0])
+        
+        #A Model with the book answers without searching, unless it has to go deeper.
+        booked = model.Model(2, book=test_book)
+        action = booked.alphaBetaSearch(test_state)
+        
+        assert(booked.bookHits == 1 and booked.nodes == 0)
+        assert(action == move)
+        
+        deeper = model.Model(3, book=test_book)
+        deeper.alphaBetaSearch(test_state)
+        
+        assert(deeper.bookHits == 0 and deeper.nodes > 0)
+        
+        test_state.play(0,1,2, 'max')
+        assert(test_book.lookup(test_state) is None)
+        
+        del test_book
+        os.remove(path)
+#end bookTest
+
+# startupTest()
+#    Input: None
+#
+#    Output: None (Exceptions on failure)
+#
+#    Tests the table cache and the cold start of game against its budget.
+def startupTest():
+        #The cached tables are the ones the Geometry would build.
+        cached = game._loadTables(4, 3)
+        assert(cached is not None and cached.pop('version') == game.TABLE_CACHE_VERSION)
+        assert(cached == game.DEFAULT_GEOMETRY._buildTables())
+        
+        cacheDir, userDir, version = game.TABLE_CACHE_DIR, game.USER_CACHE_DIR, game.TABLE_CACHE_VERSION
+        game.TABLE_CACHE_DIR = tempfile.mkdtemp()
+        game.USER_CACHE_DIR = os.path.join(tempfile.mkdtemp(), 'cache')
+        try:
+            #A board without a cache file builds its tables and writes one.
+            assert(game._loadTables(3, 3) is None)
+            geometry = game.Geometry(3, 3)
+            assert(game._loadTables(3, 3)['symmetries'] == geometry.symmetries)
+            assert(len(geometry.lines) == 49 and len(geometry.symmetries) == 48)
+            
+            #Broken files and files of another version are built again.
+            with open(game._tablePath(3, 3), 'wb') as cache:
+                cache.write(b'not a table')
+            #end with
+            assert(game._loadTables(3, 3) is None)
+            game._saveTables(3, 3, geometry._buildTables())
+            assert(game._loadTables(3, 3) is not None)
+            game.TABLE_CACHE_VERSION += 1
+            assert(game._loadTables(3, 3) is None)
+            assert(game.Geometry(3, 3).lines == geometry.lines)
+            assert(not os.path.exists(game.USER_CACHE_DIR))
+            
+            #A cache directory that cannot be written, here one below a
+            #file, falls back to the user cache, and to none at all.
+            blocked = os.path.join(game.TABLE_CACHE_DIR, 'blocked')
+            with open(blocked, 'wb'):
+                pass
+            #end with
+            game.TABLE_CACHE_DIR = os.path.join(blocked, '__pycache__')
+            assert(game._loadTables(3, 3) is None)
+            assert(game.Geometry(3, 3).lines == geometry.lines)
+            assert(os.listdir(game.USER_CACHE_DIR) == [os.path.basename(game._tablePath(3, 3))])
+            assert(game._loadTables(3, 3)['symmetries'] == geometry.symmetries)
+            
+            game.USER_CACHE_DIR = os.path.join(blocked, 'cache')
+            assert(game._loadTables(3, 3) is None)
+            assert(game.Geometry(3, 3).lines == geometry.lines)
+        finally:
+            game.TABLE_CACHE_DIR = cacheDir
+            game.USER_CACHE_DIR = userDir
+            game.TABLE_CACHE_VERSION = version
+        #end try/finally
+        
+        #The NumPy tables are built when first read.
+        assert(game.LINE_MATRIX.shape == (76, 64) and game.LINE_MATRIX is game.DEFAULT_GEOMETRY.lineMatrix)
+        assert(list(game.LINE_VALUE_FLAT[:5]) == [0, -1, -4, -16, 0])
+        
+        #Importing game in a new process loads neither NumPy, the process
+        #pools nor the search, and stays within the budget. The best of
+        #three starts is taken, so that a busy machine does not fail the test.
+        times = [benchmark.importTimes('game') for _ in range(3)]
+        assert(not any(name in times[0] for name in benchmark.STARTUP_DEFERRED))
+        assert(not any(name in times[0] for name in ('model', 'endgame', 'ponder', 'records', 'threats')))
+        assert(min(startup['game'][1] for startup in times) <= benchmark.STARTUP_BUDGET)
+#end startupTest
 
 def debug():
     try:
         #Tests all aspects of State
         stateTest()
+        #Tests the search of Model
+        modelTest()
+        #Tests the multi-game server
+        serverTest()
+        #Tests the threat search
+        threatTest()
+        #Tests the endgame solver
+        endgameTest()
+        #Tests pondering on the player's turn
+        ponderTest()
+        #Tests the opening book
+        bookTest()
+        #Tests the self-play tournament
+        tournamentTest()
+        #Tests the game records and their replay
+        recordsTest()
+        #Tests the learned evaluator
+        evaluatorTest()
+        #Tests the table cache and the cold start
+        startupTest()
     except Exception:
         traceback.print_exc()
         return -1
@@ -114,7 +1173,26 @@ def debug():
     return 0
 #end debug
 
-def main():
+# parseArguments(argv)
+#    Input: argv (the command line arguments, defaults to sys.argv)
+#
+#    Output: argparse.Namespace (the options of the game)
+#
+#    Reads the options of an interactive game from the command line.
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description='Play 4x4x4 tic-tac-toe against the AI.')
+    parser.add_argument('--think', action='store_true',
+                        help='let the AI ponder on your time, using a background thread')
+    parser.add_argument('--record', nargs='?', const=records.RECORD_PATH, default=None, metavar='PATH',
+                        help='append every game to a record file, %s by default' % records.RECORD_PATH)
+    parser.add_argument('--evaluator', nargs='?', const=evaluator.EVALUATOR_PATH, default=None, metavar='PATH',
+                        help='play with the learned evaluator, trained by evaluator.py, instead of the '
+                             'hand-written weights')
+    return parser.parse_args(argv)
+#end parseArguments
+
+def main(argv=None):
+    arguments = parseArguments(argv)
     while True:
         gameStart = input('Would you like to start the game? [Y/N]')
         
@@ -122,21 +1200,26 @@ def main():
             print('Okay! Goodbye.')
             break
         elif gameStart.upper() == 'Y':
-            difficulty = input('Difficulty level? [easy/difficult/insane]')
+            difficulty = input('Difficulty level? [%s]' % '/'.join(DIFFICULTIES))
             
-            maxDepth = 0
-            if difficulty.lower() == 'easy':
-                maxDepth = 2
-            elif difficulty.lower() == 'difficult':
-                maxDepth = 4
-            elif difficulty.lower() == 'insane':
-                maxDepth = 6
-            else:
+            settings = DIFFICULTIES.get(difficulty.lower())
+            if settings is None:
                 print('Invalid difficulty!')
                 continue
-            #end if/elif/else
+            #end if
+            
+            openingBook = None
+            if os.path.exists(book.BOOK_PATH):
+                openingBook = book.OpeningBook(book.BOOK_PATH)
+            #end if
+            
+            learned = None
+            if arguments.evaluator is not None:
+                learned = evaluator.load(arguments.evaluator)
+            #end if
             
-            thisGame = Game(maxDepth)
+            thisGame = game.Game(book=openingBook, think=arguments.think, recordPath=arguments.record,
+                                 evaluator=learned, **settings)
             thisGame.run()
         else:
             print('Invalid answer!')
@@ -0,0 +1,299 @@
+import asyncio
+import numbers
+import game
+import model
+
+# Models of a worker process, one per search setting. The transposition
+# table is shared by every game the worker searches for, which is safe
+# since entries are keyed by position.
+_workerModels = {}
+
+# _aiReply(settings, state)
+#    Input: settings (maxDepth, timeLimit and statsLog of the server)
+#    state (the game state the AI has to answer)
+#
+#    Output: Tuple (cell index of the AI move, nodes searched)
+#
+#    Runs in a worker process of GameServer. Searches one AI move.
+def _aiReply(settings, state):
+    searcher = _workerModels.get(settings)
+    if searcher is None:
+        maxDepth, timeLimit, statsLog = settings
+        searcher = model.Model(maxDepth, timeLimit=timeLimit, statsLog=statsLog)
+        _workerModels[settings] = searcher
+    #end if
+
+    nodes = searcher.nodes
+    action = searcher.alphaBetaSearch(state)
+
+    return (action, searcher.nodes - nodes)
+#end _aiReply
+
+# This class runs many games between players and the AI at once. The
+# games are held in dictionaries keyed by session id, and endGame drops a
+# finished or abandoned one. Player moves are accepted without blocking.
+# Each one schedules the AI reply on a pool of worker processes, and the
+# reply is collected by polling or awaiting.
+class GameServer:
+
+    states = None
+    replies = None
+    nextSession = 0
+    settings = None
+    pool = None
+    playerMoves = 0
+    aiMoves = 0
+    nodes = 0
+
+    # __init__(self, maxDepth, workers, timeLimit, statsLog)
+    #    Input: self (the object being instantiated)
+    #    maxDepth (the maximum depth of the AI search)
+    #    workers (number of worker processes, None for one per CPU)
+    #    timeLimit (seconds the AI may think per move, None for no limit)
+    #    statsLog (a file the workers append the stats of every AI search
+    #    to, as lines of JSON, see model.SearchStats, None for no file)
+    #
+    #    Output: None (Side effect of instantiation)
+    #
+    #    Starts a server with no games and its pool of workers.
+    def __init__(self, maxDepth, workers=None, timeLimit=None, statsLog=None):
+        from concurrent.futures import ProcessPoolExecutor
+        self.states = {}
+        self.replies = {}
+        self.nextSession = 0
+        self.settings = (maxDepth, timeLimit, statsLog)
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.playerMoves = 0
+        self.aiMoves = 0
+        self.nodes = 0
+    #end __init__
+
+    # close(self)
+    #    Input: self (the object)
+    #
+    #    Output: None (side effect of stopping the workers)
+    #
+    #    Shuts down the worker pool, waiting for running searches.
+    def close(self):
+        self.pool.shutdown()
+    #end close
+
+    # newGame(self)
+    #    Input: self (the object)
+    #
+    #    Output: integer (the session id of the new game)
+    #
+    #    Starts a game on an empty board with the player to move.
+    def newGame(self):
+        session = self.nextSession
+        self.nextSession += 1
+        self.states[session] = game.State()
+        self.replies[session] = None
+        return session
+    #end newGame
+
+    # endGame(self, session)
+    #    Input: self (the object)
+    #    session (the session id of the game)
+    #
+    #    Output: Boolean (if there was such a game)
+    #
+    #    Drops a game, cancelling its AI reply if the search has not started.
+    #    A search already running finishes in its worker and is discarded.
+    #    The session id is not used again.
+    def endGame(self, session):
+        if session not in self.states:
+            return False
+        #end if
+
+        reply = self.replies.pop(session)
+        if reply is not None:
+            reply.cancel()
+        #end if
+        del self.states[session]
+
+        return True
+    #end endGame
+
+    # sessions(self)
+    #    Input: self (the object)
+    #
+    #    Output: integer (the number of games being played)
+    def sessions(self):
+        return len(self.states)
+    #end sessions
+
+    # getState(self, session)
+    #    Input: self (the object)
+    #    session (the session id of the game)
+    #
+    #    Output: State (the state of the game)
+    #
+    #    Returns the state of a game. It must not be changed by the caller.
+    #    This and the other methods taking a session raise KeyError for a
+    #    session that is not being played, except submitMove, which refuses
+    #    it.
+    def getState(self, session):
+        return self.states[session]
+    #end getState
+
+    # isWin(self, session)
+    #    Input: self (the object)
+    #    session (the session id of the game)
+    #
+    #    Output: Tuple (see State.isWin)
+    #
+    #    Tests if a game is over, and who won it.
+    def isWin(self, session):
+        return self.states[session].isWin()
+    #end isWin
+
+    # isWaiting(self, session)
+    #    Input: self (the object)
+    #    session (the session id of the game)
+    #
+    #    Output: Boolean (if the AI reply of the game is not collected yet)
+    #
+    #    Tells if a game is waiting on the AI.
+    def isWaiting(self, session):
+        return self.replies[session] is not None
+    #end isWaiting
+
+    # submitMove(self, session, x, y, z)
+    #    Input: self (the object)
+    #    session (the session id of the game)
+    #    x, y, z (the cell the player plays, integers from 0 to 3)
+    #
+    #    Output: Boolean (if the move was accepted)
+    #
+    #    Plays the player's move and, unless it ended the game, schedules the
+    #    AI reply. The move is refused, leaving the game as it was, if there
+    #    is no such session, the coordinates are not a cell of the board, the
+    #    game is over, the AI has not replied yet, or the cell is taken.
+    def submitMove(self, session, x, y, z):
+        state = self.states.get(session)
+        if state is None or self.replies[session] is not None or state.isWin()[0]:
+            return False
+        #end if
+
+        for coord in (x, y, z):
+            if not isinstance(coord, numbers.Integral) or isinstance(coord, bool):
+                return False
+            #end if
+        #end for
+
+        if not state.play(x, y, z, game.Token.PLAYER):
+            return False
+        #end if
+        self.playerMoves += 1
+
+        if not state.isWin()[0]:
+            self.replies[session] = self.pool.submit(_aiReply, self.settings, state.copy())
+        #end if
+
+        return True
+    #end submitMove
+
+    # submitMoves(self, moves)
+    #    Input: self (the object)
+    #    moves (list of (session, x, y, z) tuples)
+    #
+    #    Output: List (for each move, if it was accepted)
+    #
+    #    Submits the moves of many games at once.
+    def submitMoves(self, moves):
+        return [self.submitMove(session, x, y, z) for session, x, y, z in moves]
+    #end submitMoves
+
+    # _finish(self, session)
+    #    Input: self (the object)
+    #    session (the session id of a game whose AI search is done)
+    #
+    #    Output: Tuple (the (x, y, z) move the AI played)
+    #
+    #    Plays the AI reply found by a worker on the game's state.
+    def _finish(self, session):
+        index, nodes = self.replies[session].result()
+        self.replies[session] = None
+
+        move = game.cellCoords(index)
+        self.states[session].play(move[0], move[1], move[2], game.Token.AI)
+        self.aiMoves += 1
+        self.nodes += nodes
+
+        return move
+    #end _finish
+
+    # poll(self, session)
+    #    Input: self (the object)
+    #    session (the session id of the game)
+    #
+    #    Output: Tuple (the (x, y, z) move the AI played, or None if there
+    #    is no reply ready)
+    #
+    #    Collects the AI reply of a game without blocking.
+    def poll(self, session):
+        reply = self.replies[session]
+        if reply is None or not reply.done():
+            return None
+        #end if
+
+        return self._finish(session)
+    #end poll
+
+    # pollAll(self)
+    #    Input: self (the object)
+    #
+    #    Output: Dictionary (session id to the (x, y, z) move the AI played)
+    #
+    #    Collects every AI reply that is ready, without blocking.
+    def pollAll(self):
+        moves = {}
+        for session, reply in list(self.replies.items()):
+            if reply is not None and reply.done():
+                moves[session] = self._finish(session)
+            #end if
+        #end for
+
+        return moves
+    #end pollAll
+
+    # awaitReply(self, session, timeout)
+    #    Input: self (the object)
+    #    session (the session id of the game)
+    #    timeout (seconds to wait, None to wait as long as it takes)
+    #
+    #    Output: Tuple (the (x, y, z) move the AI played, or None if the
+    #    game is not waiting on the AI)
+    #
+    #    Blocks until the AI reply of a game is ready and collects it.
+    #    Raises concurrent.futures.TimeoutError if the timeout runs out.
+    def awaitReply(self, session, timeout=None):
+        reply = self.replies[session]
+        if reply is None:
+            return None
+        #end if
+
+        reply.result(timeout)
+        return self._finish(session)
+    #end awaitReply
+
+    # replyAsync(self, session)
+    #    Input: self (the object)
+    #    session (the session id of the game)
+    #
+    #    Output: Coroutine (resolving to the (x, y, z) move the AI played,
+    #    or None if the game is not waiting on the AI)
+    #
+    #    The asyncio version of awaitReply, for servers running an event loop.
+    async def replyAsync(self, session):
+        reply = self.replies[session]
+        if reply is None:
+            return None
+        #end if
+
+        await asyncio.wrap_future(reply)
+        return self._finish(session)
+    #end replyAsync
+
+#end GameServer
@@ -0,0 +1,211 @@
+import game
+
+# Most forcing moves of the attacker a threat search looks ahead by default.
+# A forcing move and its forced reply are two plies, so this reaches far
+# beyond the depth of any alpha-beta search.
+DEFAULT_THREATS = 16
+
+# Most results a ThreatSearch remembers before it forgets them all.
+CACHE_LIMIT = 1 << 16
+
+# threatCells(state, player)
+#    Input: state (the game state)
+#    player (1 for max, -1 for min)
+#
+#    Output: List (the distinct cells that win on the spot for player)
+#
+#    Finds the empty cell of every line where player has all tokens but one
+#    and the opponent none.
+def threatCells(state, player):
+    own = state.maxCounts if player == 1 else state.minCounts
+    other = state.minCounts if player == 1 else state.maxCounts
+    empty = ~(state.maxBoard | state.minBoard)
+    lineMasks = state.geometry.lineMasks
+    last = state.geometry.size - 1
+
+    cells = []
+    for line in range(len(lineMasks)):
+        if own[line] == last and other[line] == 0:
+            cell = (lineMasks[line] & empty).bit_length() - 1
+            if cell not in cells:
+                cells.append(cell)
+            #end if
+        #end if
+    #end for
+
+    return cells
+#end threatCells
+
+# This class finds forced wins made of threats. The attacker only plays
+# moves that make three in a line with the fourth cell open, so the
+# defender has a single move that does not lose: blocking it. Two threats
+# at once cannot both be blocked and win. When the defender's block makes
+# a threat of its own, the attacker has to block it and goes on only if
+# the block is a threat too. With every defender move forced, the search
+# tree is narrow and reaches wins far deeper than alpha-beta can. Every
+# win it finds is real, but a position it finds no win in may still have
+# one that needs quiet moves.
+class ThreatSearch:
+
+    maxThreats = DEFAULT_THREATS
+    nodes = 0
+    cache = None
+
+    # __init__(self, maxThreats)
+    #    Input: self (the object being instantiated)
+    #    maxThreats (the most forcing moves of the attacker to look ahead)
+    #
+    #    Output: None (Side effect of instantiation)
+    #
+    #    Initializes the search with no remembered results. nodes counts the
+    #    states visited, for benchmarking.
+    def __init__(self, maxThreats=DEFAULT_THREATS):
+        self.maxThreats = maxThreats
+        self.nodes = 0
+        self.cache = {}
+    #end __init__
+
+    # forcedWin(self, state, player)
+    #    Input: self (the object)
+    #    state (the game state, with player to move, restored on return)
+    #    player (1 for max, -1 for min)
+    #
+    #    Output: List (cell indices of the attacker's moves of a forced win,
+    #    or None if no threat sequence wins)
+    #
+    #    Searches for a sequence of threats that wins for player.
+    def forcedWin(self, state, player):
+        if state.isWin()[0]:
+            return None
+        #end if
+
+        wins = threatCells(state, player)
+        if wins:
+            return [wins[0]]
+        #end if
+
+        if len(self.cache) > CACHE_LIMIT:
+            self.cache = {}
+        #end if
+
+        return self._solve(state, player, self.maxThreats, threatCells(state, -player))
+    #end forcedWin
+
+    # _solve(self, state, player, remaining, blocks)
+    #    Input: self (the object)
+    #    state (the game state, with the attacker to move and no win on
+    #    the spot)
+    #    player (the attacker, 1 for max or -1 for min)
+    #    remaining (forcing moves the attacker may still play)
+    #    blocks (the cells where the defender wins on the spot)
+    #
+    #    Output: List (see forcedWin)
+    #
+    #    The recursive step of forcedWin. The threats of both players only
+    #    change on the lines through the last two moves, so they are found
+    #    there instead of on the whole board.
+    def _solve(self, state, player, remaining, blocks):
+        self.nodes += 1
+        if remaining == 0 or len(blocks) > 1:
+            return None
+        #end if
+
+        key = state.hash ^ state.geometry.zobristSide if player == 1 else state.hash
+        # A win found with fewer moves left is found with more, and no win
+        # with more moves left means none with fewer, so the answer does
+        # not depend on what was searched before.
+        known = self.cache.get(key)
+        if known is not None and (known[0] <= remaining if known[1] is not None else known[0] >= remaining):
+            return known[1]
+        #end if
+
+        if blocks:
+            candidates = blocks
+        else:
+            candidates = self._threatMoves(state, player)
+        #end if/else
+
+        own = state.maxCounts if player == 1 else state.minCounts
+        other = state.minCounts if player == 1 else state.maxCounts
+        cellLines = state.geometry.cellLines
+        lineMasks = state.geometry.lineMasks
+        last = state.geometry.size - 1
+        result = None
+        for cell in candidates:
+            empty = ~(state.maxBoard | state.minBoard | 1 << cell)
+            replies = []
+            for line in cellLines[cell]:
+                if own[line] == last - 1 and other[line] == 0:
+                    reply = (lineMasks[line] & empty).bit_length() - 1
+                    if reply not in replies:
+                        replies.append(reply)
+                    #end if
+                #end if
+            #end for
+
+            if len(replies) > 1:
+                result = [cell]
+            elif len(replies) == 1:
+                reply = replies[0]
+                state.push(cell, player)
+                state.push(reply, -player)
+
+                empty = ~(state.maxBoard | state.minBoard)
+                counterBlocks = []
+                for line in cellLines[reply]:
+                    if other[line] == last and own[line] == 0:
+                        counterBlocks.append((lineMasks[line] & empty).bit_length() - 1)
+                    #end if
+                #end for
+
+                line = self._solve(state, player, remaining - 1, counterBlocks)
+                state.pop()
+                state.pop()
+                if line is not None:
+                    result = [cell] + line
+                #end if
+            #end if/elif
+
+            if result is not None:
+                break
+            #end if
+        #end for
+
+        self.cache[key] = (remaining, result)
+        return result
+    #end _solve
+
+    # _threatMoves(self, state, player)
+    #    Input: self (the object)
+    #    state (the game state)
+    #    player (1 for max, -1 for min)
+    #
+    #    Output: List (the cells where player makes a threat, the ones
+    #    making the most first)
+    #
+    #    Finds the empty cells of every line where player has all tokens but
+    #    two and the opponent none.
+    def _threatMoves(self, state, player):
+        own = state.maxCounts if player == 1 else state.minCounts
+        other = state.minCounts if player == 1 else state.maxCounts
+        empty = ~(state.maxBoard | state.minBoard)
+        lineMasks = state.geometry.lineMasks
+        almost = state.geometry.size - 2
+
+        counts = {}
+        for line in range(len(lineMasks)):
+            if own[line] == almost and other[line] == 0:
+                cells = lineMasks[line] & empty
+                while cells:
+                    low = cells & -cells
+                    cell = low.bit_length() - 1
+                    counts[cell] = counts.get(cell, 0) + 1
+                    cells ^= low
+                #end while
+            #end if
+        #end for
+
+        return sorted(counts, key=lambda cell: (-counts[cell], cell))
+    #end _threatMoves
+
+#end ThreatSearch
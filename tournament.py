@@ -0,0 +1,285 @@
+import argparse
+import json
+import math
+import random
+import time
+import book
+import game
+import model
+
+# Settings of the two sides when none are given: keyword arguments of
+# model.Model.
+DEFAULT_CONFIG = {'maxLayers': 2}
+
+# Plies played at random before the AIs take over, for random openings.
+DEFAULT_OPENING_PLIES = 2
+
+# chooseMove(searcher, state, player)
+#    Input: searcher (the Model playing the move)
+#    state (the game state, not changed)
+#    player (1 if max is to move, -1 if min is)
+#
+#    Output: integer (the cell index of the move)
+#
+#    Searches a move for either side. A Model always plays max, so for
+#    min it searches the state with the two sides swapped and max to move,
+#    which the heuristic scores the same way from the other side.
+def chooseMove(searcher, state, player):
+    if player == -1:
+        swapped = game.State(state.geometry)
+        swapped.setBoards(state.minBoard, state.maxBoard, 1)
+        state = swapped
+    #end if
+
+    return searcher.alphaBetaSearch(state)
+#end chooseMove
+
+# randomOpening(generator, plies)
+#    Input: generator (the random.Random drawing the moves)
+#    plies (the number of moves to play)
+#
+#    Output: List (cell indices of the moves, the first one by min)
+#
+#    Draws random moves from the empty board that do not end the game.
+def randomOpening(generator, plies):
+    state = game.State()
+    moves = []
+    for ply in range(plies):
+        player = -1 if ply % 2 == 0 else 1
+        choices = []
+        for cell in game.actions(state):
+            state.push(cell, player)
+            if not state.isWin()[0]:
+                choices.append(cell)
+            #end if
+            state.pop()
+        #end for
+
+        cell = generator.choice(choices)
+        state.push(cell, player)
+        moves.append(cell)
+    #end for
+
+    return moves
+#end randomOpening
+
+# bookOpenings(plies)
+#    Input: plies (the most tokens on the board)
+#
+#    Output: List (for each distinct opening of book.openings, the cell
+#    indices of moves reaching it, the first one by min)
+#
+#    Turns the opening positions of the book into move lists.
+def bookOpenings(plies):
+    openings = []
+    for state in book.openings(plies):
+        maxCells = [cell for cell in range(64) if state.maxBoard >> cell & 1]
+        minCells = [cell for cell in range(64) if state.minBoard >> cell & 1]
+
+        moves = []
+        for i in range(len(minCells)):
+            moves.append(minCells[i])
+            if i < len(maxCells):
+                moves.append(maxCells[i])
+            #end if
+        #end for
+        openings.append(moves)
+    #end for
+
+    return openings
+#end bookOpenings
+
+# playGame(configs, opening, first)
+#    Input: configs (the Model keyword arguments of side 'A' and side 'B')
+#    opening (cell indices of the opening moves, the first one by min)
+#    first (the side playing min, which moves first: 'A' or 'B')
+#
+#    Output: Dictionary (the record of the game)
+#
+#    Plays one game between two fresh Models after the opening. Runs in a
+#    worker process of runTournament. Each move of the record holds the
+#    side that played it, its cell, and for AI moves the seconds and
+#    nodes it took.
+def playGame(configs, opening, first):
+    second = 'B' if first == 'A' else 'A'
+    sides = {-1: first, 1: second}
+    searchers = {-1: model.Model(**configs[first]), 1: model.Model(**configs[second])}
+
+    state = game.State()
+    moves = []
+    player = -1
+    for cell in opening:
+        state.push(cell, player)
+        moves.append({'side': sides[player], 'cell': cell})
+        player = -player
+    #end for
+
+    while not state.isWin()[0]:
+        searcher = searchers[player]
+        nodes = searcher.nodes
+        start = time.perf_counter()
+        cell = chooseMove(searcher, state, player)
+        elapsed = time.perf_counter() - start
+
+        state.push(cell, player)
+        moves.append({'side': sides[player], 'cell': cell, 'seconds': elapsed, 'nodes': searcher.nodes - nodes})
+        player = -player
+    #end while
+
+    for searcher in searchers.values():
+        searcher.close()
+    #end for
+
+    winner = state.isWin()[1]
+    return {
+        'first': first,
+        'opening': list(opening),
+        'winner': sides[winner] if winner != 0 else None,
+        'moves': moves,
+    }
+#end playGame
+
+# eloDifference(score)
+#    Input: score (the fraction of the points a side scored)
+#
+#    Output: Float (the Elo rating difference that expects that score)
+def eloDifference(score):
+    if score <= 0:
+        return -float('inf')
+    elif score >= 1:
+        return float('inf')
+    #end if/elif
+
+    return 400 * math.log10(score / (1 - score))
+#end eloDifference
+
+# summarize(records)
+#    Input: records (the game records of a tournament)
+#
+#    Output: Dictionary (results of side A, the Elo difference of A over
+#    B with its 95% interval, and the speed of each side)
+def summarize(records):
+    games = len(records)
+    wins = sum(1 for record in records if record['winner'] == 'A')
+    losses = sum(1 for record in records if record['winner'] == 'B')
+    draws = games - wins - losses
+
+    points = [1.0 if record['winner'] == 'A' else 0.0 if record['winner'] == 'B' else 0.5 for record in records]
+    score = sum(points) / games if games else 0.5
+    deviation = math.sqrt(sum((point - score) ** 2 for point in points) / games) if games else 0.0
+    margin = 1.96 * deviation / math.sqrt(games) if games else 0.0
+
+    summary = {
+        'games': games,
+        'wins': wins,
+        'losses': losses,
+        'draws': draws,
+        'score': score,
+        'elo': eloDifference(score),
+        'eloLow': eloDifference(score - margin),
+        'eloHigh': eloDifference(score + margin),
+    }
+
+    for side in ('A', 'B'):
+        searched = [move for record in records for move in record['moves'] if move['side'] == side and 'seconds' in move]
+        seconds = sorted(move['seconds'] for move in searched)
+        summary[side] = {
+            'moves': len(searched),
+            'meanSeconds': sum(seconds) / len(seconds) if seconds else 0.0,
+            'maxSeconds': seconds[-1] if seconds else 0.0,
+            'meanNodes': sum(move['nodes'] for move in searched) / len(searched) if searched else 0.0,
+        }
+    #end for
+
+    return summary
+#end summarize
+
+# runTournament(configA, configB, games, path, openings, plies, workers, seed)
+#    Input: configA, configB (Model keyword arguments of the two sides)
+#    games (the number of games, rounded up to an even number)
+#    path (file the game records are streamed to as lines of JSON, or
+#    None)
+#    openings ('random' or 'book')
+#    plies (moves of each random opening, or most tokens of book openings)
+#    workers (number of worker processes, None for one per CPU)
+#    seed (the seed of the random openings)
+#
+#    Output: Dictionary (see summarize)
+#
+#    Plays the games over a pool of worker processes. Every opening is
+#    played twice, with each side moving first once. Records are written
+#    as the games finish, so the file can be read while it runs.
+def runTournament(configA, configB, games, path=None, openings='random', plies=DEFAULT_OPENING_PLIES,
+                  workers=None, seed=8150):
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    configs = {'A': configA, 'B': configB}
+    pairs = (games + 1) // 2
+
+    if openings == 'book':
+        choices = bookOpenings(plies)
+        lines = [choices[i % len(choices)] for i in range(pairs)]
+    else:
+        generator = random.Random(seed)
+        lines = [randomOpening(generator, plies) for _ in range(pairs)]
+    #end if/else
+
+    log = open(path, 'w') if path is not None else None
+    records = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for i in range(pairs):
+                for first in ('A', 'B'):
+                    futures[pool.submit(playGame, configs, lines[i], first)] = 2 * i + (first == 'B')
+                #end for
+            #end for
+
+            for future in as_completed(futures):
+                record = future.result()
+                record['game'] = futures[future]
+                records.append(record)
+                if log is not None:
+                    log.write(json.dumps(record) + '\n')
+                    log.flush()
+                #end if
+            #end for
+        #end with
+    finally:
+        if log is not None:
+            log.close()
+        #end if
+    #end try/finally
+
+    records.sort(key=lambda record: record['game'])
+    return summarize(records)
+#end runTournament
+
+def main():
+    parser = argparse.ArgumentParser(description='Plays two AI settings against each other.')
+    parser.add_argument('--a', type=json.loads, default=DEFAULT_CONFIG,
+                        help='Model keyword arguments of side A, as JSON, e.g. \'{"maxLayers": 4, "ordering": "static"}\'')
+    parser.add_argument('--b', type=json.loads, default=DEFAULT_CONFIG, help='Model keyword arguments of side B, as JSON')
+    parser.add_argument('--games', type=int, default=100, help='number of games')
+    parser.add_argument('--out', default='tournament.jsonl', help='file the game records are streamed to')
+    parser.add_argument('--openings', choices=('random', 'book'), default='random', help='how games start')
+    parser.add_argument('--plies', type=int, default=DEFAULT_OPENING_PLIES, help='moves of each opening')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, one per CPU by default')
+    parser.add_argument('--seed', type=int, default=8150, help='seed of the random openings')
+    args = parser.parse_args()
+
+    summary = runTournament(args.a, args.b, args.games, args.out, args.openings, args.plies, args.workers, args.seed)
+
+    print('A %s vs B %s' % (json.dumps(args.a), json.dumps(args.b)))
+    print('%d games: A won %d, lost %d, drew %d, score %.3f' % (summary['games'], summary['wins'], summary['losses'],
+                                                                summary['draws'], summary['score']))
+    print('Elo of A over B: %+.0f (95%%: %+.0f to %+.0f)' % (summary['elo'], summary['eloLow'], summary['eloHigh']))
+    for side in ('A', 'B'):
+        speed = summary[side]
+        print('%s: %d moves, %.3fs mean, %.3fs max, %.0f nodes mean' % (side, speed['moves'], speed['meanSeconds'],
+                                                                       speed['maxSeconds'], speed['meanNodes']))
+    #end for
+#end main
+
+if __name__ == '__main__':
+    main()
+#end if